@@ -0,0 +1,317 @@
+"""
+Almacenes en disco de artefactos de la aplicación.
+
+Las imágenes incrustadas de las respuestas OCR se decodifican y se guardan
+como archivos direccionados por su contenido, de modo que las respuestas (y la
+caché de resultados) solo llevan un identificador corto y las vistas previas
+leen el archivo bajo demanda. Como sobreviven a la caché y a los lotes que
+las referencian, el almacén tiene un presupuesto de bytes y una antigüedad
+máxima: al superarlos se borran las menos usadas, y las vistas previas
+indican que ya no están disponibles.
+
+Cada sesión de Streamlit tiene además su propio directorio con los textos
+extraídos (comprimidos) y los archivos subidos, para que ``st.session_state``
+solo guarde identificadores. Los directorios tienen una cuota de bytes y se
+eliminan cuando la sesión lleva un tiempo inactiva.
+"""
+
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+
+from ocr_cache import DEFAULT_CACHE_DIR, hash_bytes
+
+logger = logging.getLogger("MistralOCR")
+
+DEFAULT_ARTIFACT_DIR = os.path.join(DEFAULT_CACHE_DIR, "artifacts")
+DEFAULT_SESSION_DIR = os.path.join(DEFAULT_CACHE_DIR, "sessions")
+
+# Cuota de disco por sesión (configurable con MISTRAL_OCR_SESSION_QUOTA_MB)
+DEFAULT_SESSION_QUOTA = (
+    int(os.environ.get("MISTRAL_OCR_SESSION_QUOTA_MB", "200")) * 1024 * 1024
+)
+# Tiempo sin actividad tras el cual se eliminan los artefactos de una sesión
+SESSION_IDLE_TTL = 2 * 60 * 60
+# Frecuencia máxima de la recolección de sesiones inactivas
+SESSION_GC_INTERVAL = 10 * 60
+# Presupuesto de disco de las imágenes extraídas (configurable con
+# MISTRAL_OCR_ARTIFACT_MB) y antigüedad tras la que se eliminan si no se usan
+DEFAULT_ARTIFACT_BUDGET = (
+    int(os.environ.get("MISTRAL_OCR_ARTIFACT_MB", "500")) * 1024 * 1024
+)
+ARTIFACT_TTL = 7 * 24 * 60 * 60
+# Frecuencia máxima de la limpieza por antigüedad de las imágenes extraídas
+ARTIFACT_GC_INTERVAL = 10 * 60
+
+
+class ArtifactQuotaExceeded(Exception):
+    """El artefacto no cabe en la cuota de disco de la sesión."""
+
+
+class ArtifactStore:
+    """
+    Almacén de archivos direccionado por contenido, seguro entre hilos.
+
+    Los identificadores tienen la forma ``<sha256>.<extensión>``. Volver a
+    guardar un artefacto lo marca como usado; ``collect`` elimina los que
+    llevan ``max_age`` segundos sin usarse y, si aun así se supera
+    ``max_bytes``, los menos usados.
+    """
+
+    def __init__(
+        self,
+        directory=DEFAULT_ARTIFACT_DIR,
+        max_bytes=DEFAULT_ARTIFACT_BUDGET,
+        max_age=ARTIFACT_TTL,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._last_gc = 0.0
+        os.makedirs(directory, exist_ok=True)
+        self._used = sum(
+            entry.stat().st_size for entry in os.scandir(directory) if entry.is_file()
+        )
+
+    def path(self, handle):
+        # El identificador nunca debe salir del directorio del almacén
+        return os.path.join(self.directory, os.path.basename(handle))
+
+    def put(self, data, extension="bin"):
+        """
+        Guarda un bloque de bytes y devuelve su identificador.
+        """
+        handle = f"{hash_bytes(data)}.{extension}"
+        path = self.path(handle)
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)
+            else:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                self._used += len(data)
+            run_gc = (
+                self._used > self.max_bytes
+                or time.time() - self._last_gc > ARTIFACT_GC_INTERVAL
+            )
+        if run_gc:
+            self.collect()
+        return handle
+
+    def exists(self, handle):
+        return os.path.exists(self.path(handle))
+
+    def read(self, handle):
+        """
+        Devuelve los bytes de un artefacto o None si ya no existe.
+        """
+        try:
+            with open(self.path(handle), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def collect(self):
+        """
+        Elimina los artefactos caducados y, si el almacén supera su
+        presupuesto, los menos usados hasta quedar por debajo.
+
+        Devuelve el número de artefactos eliminados.
+        """
+        with self._lock:
+            now = time.time()
+            self._last_gc = now
+            entries = []
+            for entry in os.scandir(self.directory):
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                except FileNotFoundError:
+                    continue
+
+            used = sum(size for _, size, _ in entries)
+            removed = 0
+            # Del uso más antiguo al más reciente
+            for mtime, size, path in sorted(entries):
+                if now - mtime <= self.max_age and used <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                used -= size
+                removed += 1
+            self._used = used
+
+        if removed:
+            logger.info(
+                f"{removed} imagen(es) extraída(s) eliminada(s) del almacén de artefactos"
+            )
+        return removed
+
+
+_artifact_store = None
+_artifact_store_lock = threading.Lock()
+
+
+def get_artifact_store():
+    """
+    Devuelve el almacén de artefactos compartido por todo el proceso.
+    """
+    global _artifact_store
+    with _artifact_store_lock:
+        if _artifact_store is None:
+            _artifact_store = ArtifactStore()
+            _artifact_store.collect()
+        return _artifact_store
+
+
+class SessionArtifactStore:
+    """
+    Artefactos de una sesión: textos comprimidos con gzip y archivos binarios
+    que se sirven por su ruta en disco.
+
+    Los binarios respetan la cuota de la sesión; los textos, pequeños una vez
+    comprimidos e imprescindibles para mostrar resultados, cuentan para el uso
+    pero nunca se rechazan.
+    """
+
+    def __init__(
+        self, session_id, root=DEFAULT_SESSION_DIR, quota_bytes=DEFAULT_SESSION_QUOTA
+    ):
+        self.session_id = session_id
+        self.directory = os.path.join(root, os.path.basename(session_id))
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._used = sum(entry.stat().st_size for entry in os.scandir(self.directory))
+
+    def path(self, handle):
+        return os.path.join(self.directory, os.path.basename(handle))
+
+    def exists(self, handle):
+        return os.path.exists(self.path(handle))
+
+    def touch(self):
+        """
+        Marca la sesión como activa para la recolección de sesiones inactivas.
+        """
+        try:
+            os.utime(self.directory)
+        except FileNotFoundError:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _put(self, data, handle, enforce_quota):
+        path = self.path(handle)
+        with self._lock:
+            if os.path.exists(path):
+                return handle
+            if enforce_quota and self._used + len(data) > self.quota_bytes:
+                raise ArtifactQuotaExceeded(
+                    f"La sesión superaría su cuota de {self.quota_bytes / (1024 * 1024):.0f} MB"
+                )
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._used += len(data)
+        return handle
+
+    def put_text(self, text):
+        data = gzip.compress(text.encode("utf-8"))
+        return self._put(data, f"{hash_bytes(data)}.txt.gz", enforce_quota=False)
+
+    def put_bytes(self, data, extension="bin"):
+        """
+        Guarda un binario y devuelve su identificador; lanza
+        ``ArtifactQuotaExceeded`` si no cabe en la cuota.
+        """
+        return self._put(data, f"{hash_bytes(data)}.{extension}", enforce_quota=True)
+
+    def read_text(self, handle):
+        """
+        Devuelve el texto guardado o None si ya no existe.
+        """
+        try:
+            with gzip.open(self.path(handle), "rt", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def usage(self):
+        return self._used
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+            self._used = 0
+
+
+_session_stores = {}
+_session_stores_lock = threading.Lock()
+_last_session_gc = 0.0
+
+
+def collect_idle_sessions(root=DEFAULT_SESSION_DIR, max_idle=SESSION_IDLE_TTL):
+    """
+    Elimina los directorios de las sesiones sin actividad reciente.
+
+    Devuelve el número de sesiones eliminadas.
+    """
+    if not os.path.isdir(root):
+        return 0
+
+    removed = 0
+    now = time.time()
+    for entry in os.scandir(root):
+        if not entry.is_dir():
+            continue
+        try:
+            idle = now - entry.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        if idle > max_idle:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            with _session_stores_lock:
+                _session_stores.pop(entry.name, None)
+            removed += 1
+
+    if removed:
+        logger.info(f"{removed} sesión(es) inactiva(s) eliminada(s) del disco")
+    return removed
+
+
+def get_session_store(session_id):
+    """
+    Devuelve el almacén de una sesión, marcándola como activa.
+
+    De paso, y como mucho cada ``SESSION_GC_INTERVAL`` segundos, elimina las
+    sesiones inactivas.
+    """
+    global _last_session_gc
+    now = time.time()
+    run_gc = False
+
+    with _session_stores_lock:
+        if now - _last_session_gc > SESSION_GC_INTERVAL:
+            _last_session_gc = now
+            run_gc = True
+        store = _session_stores.get(session_id)
+        if store is None:
+            store = SessionArtifactStore(session_id)
+            _session_stores[session_id] = store
+
+    store.touch()
+    if run_gc:
+        collect_idle_sessions()
+    return store
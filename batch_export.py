@@ -0,0 +1,111 @@
+"""
+Exportación de los resultados OCR a archivos descargables.
+
+Los contenidos de cada descarga se generan solo cuando el usuario la pide, y
+el ZIP de un lote se escribe documento a documento sobre un archivo temporal
+en disco, de modo que en memoria nunca hay más de un texto a la vez.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+import zipfile
+
+logger = logging.getLogger("MistralOCR")
+
+# Formatos de exportación de cada documento: (extensión, tipo MIME)
+EXPORT_FORMATS = (
+    ("json", "application/json"),
+    ("txt", "text/plain"),
+    ("md", "text/markdown"),
+)
+
+
+def export_basename(file_name):
+    """
+    Nombre base (sin extensión ni directorios) de los archivos exportados.
+    """
+    base = os.path.splitext(os.path.basename(file_name))[0]
+    return base or "documento"
+
+
+def render_export(result_text, extension):
+    """
+    Contenido de la descarga de un resultado en el formato indicado.
+    """
+    if extension == "json":
+        return json.dumps({"ocr_result": result_text}, ensure_ascii=False, indent=2)
+    return result_text
+
+
+def write_batch_zip(documents, output):
+    """
+    Escribe en ``output`` (ruta o archivo binario) un ZIP con los resultados.
+
+    ``documents`` es un iterable de pares ``(file_name, result_text)`` que se
+    consume de uno en uno, así que puede leer cada texto de disco justo antes
+    de escribirlo. Cada documento correcto aporta su versión txt, md y json en
+    una carpeta propia; ``manifest.json`` resume el lote. Devuelve las entradas
+    del manifiesto.
+    """
+    manifest = []
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for idx, (file_name, result_text) in enumerate(documents, start=1):
+            base = export_basename(file_name)
+            # El índice evita colisiones entre documentos con el mismo nombre
+            folder = f"{idx:03d}_{base}"
+            entry = {"index": idx, "file_name": file_name}
+
+            if result_text is None:
+                entry["status"] = "missing"
+            elif result_text.startswith("Error"):
+                entry["status"] = "error"
+                entry["error"] = result_text
+            else:
+                files = []
+                for extension, _ in EXPORT_FORMATS:
+                    path = f"{folder}/{base}.{extension}"
+                    archive.writestr(path, render_export(result_text, extension))
+                    files.append(path)
+                entry.update(
+                    status="ok",
+                    files=files,
+                    characters=len(result_text),
+                    words=len(result_text.split()),
+                )
+            manifest.append(entry)
+
+        archive.writestr(
+            "manifest.json",
+            json.dumps(
+                {
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "documents": manifest,
+                },
+                ensure_ascii=False,
+                indent=2,
+            ),
+        )
+
+    logger.info(f"ZIP de exportación generado con {len(manifest)} documento(s)")
+    return manifest
+
+
+def build_batch_zip(documents):
+    """
+    Genera el ZIP del lote en un archivo temporal y lo devuelve abierto para
+    lectura. El archivo se elimina del disco al cerrarlo.
+    """
+    fd, path = tempfile.mkstemp(suffix=".zip")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write_batch_zip(documents, f)
+        return open(path, "rb")
+    finally:
+        # En POSIX el archivo abierto sigue siendo legible tras eliminarlo
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
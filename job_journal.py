@@ -0,0 +1,471 @@
+"""
+Registro persistente de los lotes de procesamiento.
+
+Cada lote se anota en una base SQLite con el estado de sus documentos
+(pendiente, subiendo, OCR, terminado o fallido), el número de intentos, el
+``file_id`` de la subida y un puntero al texto extraído. Los archivos locales
+y los textos se guardan en un directorio propio del lote, de modo que si la
+sesión de Streamlit se desconecta o el servidor se reinicia, el lote puede
+reanudarse procesando solo los documentos que no terminaron.
+"""
+
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from artifact_store import SessionArtifactStore
+from ocr_async import STAGE_UPLOAD
+from ocr_cache import DEFAULT_CACHE_DIR
+from ocr_pipeline import SOURCE_URL, LocalFileSource
+from progress import FILE_UPLOADED, STAGE_STARTED
+
+logger = logging.getLogger("MistralOCR")
+
+DEFAULT_JOB_DIR = os.path.join(DEFAULT_CACHE_DIR, "jobs")
+
+# Cuota de disco por lote (configurable con MISTRAL_OCR_JOB_QUOTA_MB)
+DEFAULT_JOB_QUOTA = (
+    int(os.environ.get("MISTRAL_OCR_JOB_QUOTA_MB", "2048")) * 1024 * 1024
+)
+# Antigüedad tras la cual se elimina un lote sin actividad
+JOB_TTL = 24 * 60 * 60
+
+# Estados de un documento del lote
+DOC_PENDING = "pending"
+DOC_UPLOADING = "uploading"
+DOC_OCR = "ocr"
+DOC_DONE = "done"
+DOC_FAILED = "failed"
+DOC_CANCELLED = "cancelled"
+IN_PROGRESS_STATES = (DOC_PENDING, DOC_UPLOADING, DOC_OCR)
+
+
+class JobJournal:
+    """
+    Registro de lotes y de sus documentos, seguro entre hilos.
+
+    Los archivos locales se guardan en el almacén del lote al crearlo y los
+    documentos se reanudan desde ahí; las URLs se guardan tal cual.
+    """
+
+    def __init__(
+        self,
+        directory=DEFAULT_CACHE_DIR,
+        jobs_dir=DEFAULT_JOB_DIR,
+        quota_bytes=DEFAULT_JOB_QUOTA,
+    ):
+        self.jobs_dir = jobs_dir
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        self._stores = {}
+        self._deletion_callbacks = []
+
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(directory, "jobs.sqlite3"), check_same_thread=False
+        )
+        with self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    source_type TEXT NOT NULL,
+                    settings TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    file_name TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    file_id TEXT,
+                    result_handle TEXT,
+                    images TEXT,
+                    pages TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, idx)
+                )
+                """
+            )
+            # Los registros de versiones anteriores no guardaban las páginas
+            columns = {
+                row[1] for row in self._db.execute("PRAGMA table_info(documents)")
+            }
+            if "pages" not in columns:
+                self._db.execute("ALTER TABLE documents ADD COLUMN pages TEXT")
+
+    def store(self, job_id):
+        """
+        Almacén en disco con los archivos y los textos de un lote.
+        """
+        with self._lock:
+            store = self._stores.get(job_id)
+            if store is None:
+                store = SessionArtifactStore(
+                    job_id, root=self.jobs_dir, quota_bytes=self.quota_bytes
+                )
+                self._stores[job_id] = store
+            return store
+
+    def create_job(self, source_type, settings, sources):
+        """
+        Registra un lote nuevo con todos sus documentos pendientes.
+
+        Los archivos locales se copian al almacén del lote; si no caben en su
+        cuota se lanza ``ArtifactQuotaExceeded`` y el lote no se registra.
+        Devuelve el identificador del lote.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        rows = []
+        try:
+            for idx, source in enumerate(sources):
+                if isinstance(source, str):
+                    url = source.strip()
+                    rows.append((idx, url.split("/")[-1] or f"URL-{idx+1}", url))
+                else:
+                    extension = os.path.splitext(source.name)[1].lstrip(".").lower()
+                    handle = self.store(job_id).put_bytes(
+                        source.getvalue(), extension or "bin"
+                    )
+                    rows.append((idx, source.name, handle))
+        except Exception:
+            self._remove_files(job_id)
+            raise
+
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (job_id, source_type, settings, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, source_type, json.dumps(settings), now, now),
+            )
+            self._db.executemany(
+                "INSERT INTO documents (job_id, idx, file_name, source, state, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (job_id, idx, file_name, source, DOC_PENDING, now)
+                    for idx, file_name, source in rows
+                ],
+            )
+        logger.info(f"Lote {job_id} registrado con {len(rows)} documento(s)")
+        return job_id
+
+    def _update_document(
+        self, job_id, idx, assignments, values, in_progress_only=False
+    ):
+        now = time.time()
+        condition = "job_id = ? AND idx = ?"
+        params = (*values, now, job_id, idx)
+        if in_progress_only:
+            condition += " AND state IN (?, ?, ?)"
+            params += IN_PROGRESS_STATES
+        with self._lock, self._db:
+            self._db.execute(
+                f"UPDATE documents SET {assignments}, updated_at = ? WHERE {condition}",
+                params,
+            )
+            self._db.execute(
+                "UPDATE jobs SET updated_at = ? WHERE job_id = ?", (now, job_id)
+            )
+
+    def begin_attempt(self, job_id, idx, state):
+        """
+        Anota un nuevo intento de procesar el documento.
+
+        Igual que ``advance``, no modifica documentos que ya terminaron: un
+        hilo que sigue trabajando en un documento cancelado no lo reabre.
+        """
+        self._update_document(
+            job_id,
+            idx,
+            "state = ?, attempts = attempts + 1, error = NULL",
+            (state,),
+            in_progress_only=True,
+        )
+
+    def advance(self, job_id, idx, state):
+        """
+        Cambia la etapa de un documento en curso.
+        """
+        self._update_document(job_id, idx, "state = ?", (state,), in_progress_only=True)
+
+    def set_state(self, job_id, idx, state):
+        self._update_document(job_id, idx, "state = ?", (state,))
+
+    def set_file_id(self, job_id, idx, file_id):
+        self._update_document(job_id, idx, "file_id = ?", (file_id,))
+
+    def record_result(self, job_id, idx, result):
+        """
+        Guarda el texto de un resultado y marca el documento como terminado
+        o fallido.
+        """
+        result_handle = self.store(job_id).put_text(result["result_text"])
+        self._update_document(
+            job_id,
+            idx,
+            "state = ?, result_handle = ?, images = ?, pages = ?, error = ?",
+            (
+                DOC_DONE if result["success"] else DOC_FAILED,
+                result_handle,
+                json.dumps(result.get("images") or []),
+                json.dumps(result.get("page_offsets") or []),
+                None if result["success"] else result["result_text"],
+            ),
+        )
+
+    def cancel_document(self, job_id, idx):
+        self._update_document(
+            job_id,
+            idx,
+            "state = ?, result_handle = NULL, error = ?",
+            (DOC_CANCELLED, "Error: procesamiento cancelado por el usuario."),
+        )
+
+    def get_job(self, job_id):
+        """
+        Devuelve el lote con sus opciones y el recuento de documentos por
+        estado, o None si no existe.
+
+        ``remaining`` cuenta los documentos que procesaría una reanudación
+        (todos salvo los terminados y los cancelados).
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT source_type, settings, created_at, updated_at FROM jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+            states = dict(
+                self._db.execute(
+                    "SELECT state, COUNT(*) FROM documents WHERE job_id = ? GROUP BY state",
+                    (job_id,),
+                ).fetchall()
+            )
+        if row is None:
+            return None
+
+        source_type, settings, created_at, updated_at = row
+        total = sum(states.values())
+        done = states.get(DOC_DONE, 0)
+        failed = states.get(DOC_FAILED, 0)
+        cancelled = states.get(DOC_CANCELLED, 0)
+        return {
+            "job_id": job_id,
+            "source_type": source_type,
+            "settings": json.loads(settings),
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "total": total,
+            "done": done,
+            "failed": failed,
+            "cancelled": cancelled,
+            "remaining": total - done - cancelled,
+        }
+
+    def job_ids(self):
+        """
+        Identificadores de todos los lotes del registro, del más reciente al
+        más antiguo.
+        """
+        with self._lock:
+            return [
+                row[0]
+                for row in self._db.execute(
+                    "SELECT job_id FROM jobs ORDER BY created_at DESC"
+                ).fetchall()
+            ]
+
+    def documents(self, job_id):
+        """
+        Documentos del lote en su orden original.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT idx, file_name, source, state, attempts, file_id, result_handle, images, pages, error FROM documents WHERE job_id = ? ORDER BY idx",
+                (job_id,),
+            ).fetchall()
+        return [
+            {
+                "idx": idx,
+                "file_name": file_name,
+                "source": source,
+                "state": state,
+                "attempts": attempts,
+                "file_id": file_id,
+                "result_handle": result_handle,
+                "images": json.loads(images) if images else [],
+                "page_offsets": json.loads(pages) if pages else [],
+                "error": error,
+            }
+            for idx, file_name, source, state, attempts, file_id, result_handle, images, pages, error in rows
+        ]
+
+    def pending_documents(self, job_id):
+        """
+        Documentos que quedan por procesar al reanudar el lote: los no
+        terminados y los fallidos, que se reintentan. Los cancelados no.
+        """
+        return [
+            document
+            for document in self.documents(job_id)
+            if document["state"] not in (DOC_DONE, DOC_CANCELLED)
+        ]
+
+    def open_source(self, job_id, document, source_type):
+        """
+        Fuente de un documento para el pipeline: la URL o el archivo guardado
+        en el almacén del lote. Lanza ``OSError`` si el archivo ya no existe.
+        """
+        if source_type == SOURCE_URL:
+            return document["source"]
+        return LocalFileSource(
+            self.store(job_id).path(document["source"]), name=document["file_name"]
+        )
+
+    def load_result(self, job_id, document, source_type):
+        """
+        Reconstruye el resultado de un documento ya procesado, con la misma
+        forma que los de ``process_document``.
+
+        El archivo no se lee: ``file_path`` es su ruta en el almacén del lote
+        (None para URLs o si ya no existe) y ``file_bytes`` queda vacío.
+        """
+        store = self.store(job_id)
+        result_text = None
+        if document["result_handle"]:
+            result_text = store.read_text(document["result_handle"])
+        if result_text is None:
+            result_text = (
+                document["error"]
+                or f"El resultado de {document['file_name']} ya no está disponible."
+            )
+
+        file_path = None
+        if source_type != SOURCE_URL and store.exists(document["source"]):
+            file_path = store.path(document["source"])
+
+        return {
+            "success": document["state"] == DOC_DONE,
+            "result_text": result_text,
+            "preview_src": document["source"] if source_type == SOURCE_URL else "",
+            "mime_type": mimetypes.guess_type(document["file_name"])[0],
+            "file_name": document["file_name"],
+            "file_bytes": None,
+            "file_path": file_path,
+            "raw_response": None,
+            "images": document["images"],
+            "page_offsets": document["page_offsets"],
+        }
+
+    def _remove_files(self, job_id):
+        with self._lock:
+            self._stores.pop(job_id, None)
+        shutil.rmtree(
+            os.path.join(self.jobs_dir, os.path.basename(job_id)), ignore_errors=True
+        )
+
+    def on_job_deleted(self, callback):
+        """
+        Registra ``callback(job_id)``, que se llama al descartar o caducar un
+        lote (por ejemplo, para sacarlo del índice de búsqueda).
+        """
+        self._deletion_callbacks.append(callback)
+        return callback
+
+    def delete_job(self, job_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM documents WHERE job_id = ?", (job_id,))
+            self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        self._remove_files(job_id)
+        for callback in list(self._deletion_callbacks):
+            try:
+                callback(job_id)
+            except Exception as e:
+                logger.warning(
+                    f"Error al notificar el borrado del lote {job_id}: {str(e)}"
+                )
+
+    def collect_expired(self, max_age=JOB_TTL):
+        """
+        Elimina los lotes sin actividad en ``max_age`` segundos.
+
+        Devuelve el número de lotes eliminados.
+        """
+        with self._lock:
+            expired = [
+                row[0]
+                for row in self._db.execute(
+                    "SELECT job_id FROM jobs WHERE updated_at < ?",
+                    (time.time() - max_age,),
+                ).fetchall()
+            ]
+        for job_id in expired:
+            self.delete_job(job_id)
+        if expired:
+            logger.info(f"{len(expired)} lote(s) caducado(s) eliminado(s) del registro")
+        return len(expired)
+
+
+_job_journal = None
+_job_journal_lock = threading.Lock()
+
+
+def get_job_journal():
+    """
+    Devuelve el registro de lotes compartido por todo el proceso, eliminando
+    al crearlo los lotes caducados.
+    """
+    global _job_journal
+    with _job_journal_lock:
+        if _job_journal is None:
+            _job_journal = JobJournal()
+            _job_journal.collect_expired()
+        return _job_journal
+
+
+class JobRecorder:
+    """
+    Suscriptor de progreso que anota en el registro el estado de cada
+    documento y el ``file_id`` de su subida.
+
+    ``indices`` traduce el índice del documento en la ejecución (el contexto
+    ``document`` de los eventos) al del lote, ya que al reanudar solo se
+    procesa una parte.
+    """
+
+    def __init__(self, journal, job_id, indices):
+        self.journal = journal
+        self.job_id = job_id
+        self.indices = list(indices)
+        self._lock = threading.Lock()
+        self._started = set()
+
+    def __call__(self, event):
+        run_idx = event.get("document")
+        if run_idx is None or run_idx >= len(self.indices):
+            return
+        idx = self.indices[run_idx]
+
+        if event["type"] == STAGE_STARTED:
+            state = DOC_UPLOADING if event["stage"] == STAGE_UPLOAD else DOC_OCR
+            with self._lock:
+                first = idx not in self._started
+                self._started.add(idx)
+            if first:
+                self.journal.begin_attempt(self.job_id, idx, state)
+            else:
+                self.journal.advance(self.job_id, idx, state)
+        elif event["type"] == FILE_UPLOADED:
+            self.journal.set_file_id(self.job_id, idx, event["file_id"])
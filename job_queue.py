@@ -0,0 +1,424 @@
+"""
+Cola de lotes OCR en segundo plano.
+
+Los lotes se ejecutan en un hilo del proceso con su propio bucle de eventos,
+fuera del ciclo de reruns de Streamlit: interactuar con la interfaz ya no
+abandona el trabajo en curso, varias sesiones pueden encolar lotes sin
+bloquearse entre sí y cada documento (o el lote entero) se puede cancelar.
+
+Con el motor asíncrono, cancelar un documento aborta sus solicitudes en
+curso. Con el de hilos, los documentos que aún no empezaron se descartan y
+los que ya están en un hilo terminan su solicitud, pero su resultado se
+ignora.
+
+El estado de cada documento se guarda en el registro de lotes
+(``job_journal``); la cola solo conserva en memoria lo que muestra la
+interfaz mientras el lote está en curso. Los textos extraídos se añaden al
+índice de búsqueda (``search_index``) a medida que llegan.
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from job_journal import DOC_PENDING, JobRecorder, get_job_journal
+from mistral_client import TRANSPORT_POOL
+from ocr_async import DEFAULT_STAGE_LIMITS, AsyncOCREngine
+from ocr_pipeline import finish_async_document, plan_async_document, process_document
+from progress import (
+    DEBUG,
+    IMAGE_OPTIMIZED,
+    STAGE_STARTED,
+    STAGE_UPDATED,
+    ProgressEvents,
+)
+from search_index import get_search_index
+
+logger = logging.getLogger("MistralOCR")
+
+# Motores de ejecución de lotes
+ENGINE_THREADS = "threads"
+ENGINE_ASYNC = "asyncio"
+
+# Lotes que se procesan a la vez (configurable con MISTRAL_OCR_MAX_RUNNING_JOBS);
+# el resto espera su turno en la cola
+MAX_RUNNING_JOBS = int(os.environ.get("MISTRAL_OCR_MAX_RUNNING_JOBS", "4"))
+# Hilos compartidos por todos los lotes (preparación y motor de hilos)
+MAX_WORKER_THREADS = 32
+# Detalles técnicos que se conservan por documento
+MAX_DEBUG_EVENTS = 20
+# Tiempo que un lote terminado sigue en memoria antes de olvidarse
+FINISHED_JOB_TTL = 10 * 60
+
+# Estados de un lote en la cola
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_FINISHED = "finished"
+
+
+class QueuedJob:
+    """
+    Lote enviado a la cola.
+
+    ``documents`` son los documentos del registro que se procesan en esta
+    ejecución. El lote es también un suscriptor de progreso que guarda la
+    última etiqueta de cada documento, los bytes que se ahorraron al
+    optimizar su imagen y, con ``show_debug``, sus detalles técnicos.
+    """
+
+    def __init__(
+        self,
+        job_id,
+        api_key,
+        source_type,
+        settings,
+        documents,
+        engine_options,
+        use_cache=True,
+        show_debug=False,
+    ):
+        self.job_id = job_id
+        self.api_key = api_key
+        self.source_type = source_type
+        self.settings = settings
+        self.documents = documents
+        self.engine_options = engine_options
+        self.use_cache = use_cache
+        self.show_debug = show_debug
+        self.indices = [document["idx"] for document in documents]
+        self.status = JOB_QUEUED
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.labels = {}
+        self.bytes_saved = {}
+        self.debug = {}
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._cancelled = set()
+
+    def __call__(self, event):
+        run_idx = event.get("document")
+        if run_idx is None or run_idx >= len(self.indices):
+            return
+        idx = self.indices[run_idx]
+
+        if event["type"] in (STAGE_STARTED, STAGE_UPDATED):
+            self.labels[idx] = event["label"]
+        elif event["type"] == IMAGE_OPTIMIZED:
+            self.bytes_saved[idx] = event["original_bytes"] - event["optimized_bytes"]
+        elif event["type"] == DEBUG and self.show_debug:
+            with self._lock:
+                events = self.debug.setdefault(idx, [])
+                events.append((event["kind"], event["content"]))
+                del events[:-MAX_DEBUG_EVENTS]
+
+    def debug_events(self, idx):
+        with self._lock:
+            return list(self.debug.get(idx, []))
+
+
+class JobQueue:
+    """
+    Cola de lotes con un bucle de eventos en un hilo propio.
+
+    Como mucho ``max_running_jobs`` lotes se procesan a la vez; dentro de
+    cada uno, el número de documentos en curso lo limitan las opciones del
+    motor.
+    """
+
+    def __init__(self, journal=None, index=None, max_running_jobs=MAX_RUNNING_JOBS):
+        self.journal = journal or get_job_journal()
+        self.index = index or get_search_index()
+        # Los lotes descartados o caducados dejan de poder buscarse
+        self.journal.on_job_deleted(self.index.forget_job)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._running = asyncio.Semaphore(max(1, max_running_jobs))
+        self._executor = ThreadPoolExecutor(
+            max_workers=MAX_WORKER_THREADS, thread_name_prefix="ocr-worker"
+        )
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="ocr-queue", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self,
+        job_id,
+        api_key,
+        source_type,
+        settings,
+        documents,
+        engine_options,
+        use_cache=True,
+        show_debug=False,
+    ):
+        """
+        Encola los ``documents`` de un lote del registro (normalmente los de
+        ``JobJournal.pending_documents``) y devuelve su ``QueuedJob``.
+
+        Si el lote ya está en la cola, devuelve el existente.
+        """
+        now = time.time()
+        with self._lock:
+            previous = self._jobs.get(job_id)
+            if previous is not None and previous.status != JOB_FINISHED:
+                return previous
+            for other_id, other in list(self._jobs.items()):
+                if other.finished_at and now - other.finished_at > FINISHED_JOB_TTL:
+                    del self._jobs[other_id]
+
+            job = QueuedJob(
+                job_id,
+                api_key,
+                source_type,
+                settings,
+                documents,
+                engine_options,
+                use_cache=use_cache,
+                show_debug=show_debug,
+            )
+            self._jobs[job_id] = job
+
+        # Los documentos que se reintentan vuelven a estar pendientes
+        for document in documents:
+            if document["state"] != DOC_PENDING:
+                self.journal.set_state(job_id, document["idx"], DOC_PENDING)
+
+        asyncio.run_coroutine_threadsafe(self._run_job(job), self._loop)
+        logger.info(f"Lote {job_id} encolado con {len(documents)} documento(s)")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def is_active(self, job_id):
+        job = self.get(job_id)
+        return job is not None and job.status != JOB_FINISHED
+
+    def queue_position(self, job_id):
+        """
+        Posición (desde 1) de un lote en espera, o 0 si no está esperando.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != JOB_QUEUED:
+                return 0
+            return 1 + sum(
+                1
+                for other in self._jobs.values()
+                if other.status == JOB_QUEUED and other.submitted_at < job.submitted_at
+            )
+
+    def cancel_document(self, job_id, idx):
+        return self._request_cancel(job_id, idx)
+
+    def cancel_job(self, job_id):
+        return self._request_cancel(job_id, None)
+
+    def _request_cancel(self, job_id, idx):
+        job = self.get(job_id)
+        if job is None or job.status == JOB_FINISHED:
+            return False
+        self._loop.call_soon_threadsafe(self._cancel, job, idx)
+        return True
+
+    def _cancel(self, job, idx):
+        # Se ejecuta en el hilo del bucle, igual que la creación de las tareas
+        for target in job.indices if idx is None else [idx]:
+            if target in job._cancelled:
+                continue
+            job._cancelled.add(target)
+            task = job._tasks.get(target)
+            if task is None:
+                # Aún no empezó: se marca ya para que la interfaz lo refleje
+                self.journal.cancel_document(job.job_id, target)
+            elif not task.done():
+                task.cancel()
+
+    async def _run_job(self, job):
+        async with self._running:
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            progress = ProgressEvents(
+                [JobRecorder(self.journal, job.job_id, job.indices), job]
+            )
+            options = job.engine_options
+            try:
+                if options.get("engine") == ENGINE_THREADS:
+                    await self._run_documents(
+                        job,
+                        self._threaded_operation(job, progress),
+                        options.get("max_concurrency", 4),
+                    )
+                else:
+                    stage_limits = options.get("stage_limits") or DEFAULT_STAGE_LIMITS
+                    async with AsyncOCREngine(job.api_key, stage_limits) as engine:
+                        await self._run_documents(
+                            job,
+                            self._async_operation(job, engine, progress),
+                            # Documentos preparados en memoria a la vez
+                            2 * sum(stage_limits.values()),
+                        )
+            except Exception as e:
+                logger.error(
+                    f"Error inesperado en el lote {job.job_id}: {str(e)}\n{traceback.format_exc()}"
+                )
+            finally:
+                job.status = JOB_FINISHED
+                job.finished_at = time.time()
+                job.api_key = None
+                logger.info(
+                    f"Lote {job.job_id} terminado en {job.finished_at - job.started_at:.1f} s"
+                )
+
+    async def _run_documents(self, job, operation, max_in_flight):
+        slots = asyncio.Semaphore(max(1, max_in_flight))
+        for run_idx, document in enumerate(job.documents):
+            if document["idx"] not in job._cancelled:
+                job._tasks[document["idx"]] = asyncio.create_task(
+                    self._run_document(job, operation, slots, run_idx, document)
+                )
+        if job._tasks:
+            await asyncio.gather(*job._tasks.values())
+
+    async def _run_document(self, job, operation, slots, run_idx, document):
+        loop = asyncio.get_running_loop()
+        try:
+            async with slots:
+                try:
+                    source = await loop.run_in_executor(
+                        self._executor,
+                        self.journal.open_source,
+                        job.job_id,
+                        document,
+                        job.source_type,
+                    )
+                except OSError as e:
+                    result = {
+                        "success": False,
+                        "result_text": f"Error: el archivo {document['file_name']} ya no está disponible ({str(e)})",
+                    }
+                else:
+                    result = await operation(run_idx, source)
+        except asyncio.CancelledError:
+            self.journal.cancel_document(job.job_id, document["idx"])
+            logger.info(f"Documento {document['file_name']} cancelado")
+            return
+        except Exception as e:
+            logger.error(
+                f"Error inesperado procesando {document['file_name']}: {str(e)}\n{traceback.format_exc()}"
+            )
+            result = {"success": False, "result_text": f"Error inesperado: {str(e)}"}
+
+        self.journal.record_result(job.job_id, document["idx"], result)
+        if result["success"]:
+            try:
+                # Indexar un documento largo no debe bloquear el bucle
+                await loop.run_in_executor(
+                    self._executor,
+                    functools.partial(
+                        self.index.add_document,
+                        (job.job_id, document["idx"]),
+                        document["file_name"],
+                        result["result_text"],
+                        result.get("page_offsets"),
+                    ),
+                )
+            except asyncio.CancelledError:
+                # El documento ya terminó; el hilo termina de indexarlo igualmente
+                pass
+            except Exception as e:
+                logger.warning(f"No se pudo indexar {document['file_name']}: {str(e)}")
+
+    def _async_operation(self, job, engine, progress):
+        settings = job.settings
+        total = len(job.documents)
+
+        async def operation(run_idx, source):
+            loop = asyncio.get_running_loop()
+            # Leer y codificar el documento no debe bloquear el bucle
+            result, ocr_job = await loop.run_in_executor(
+                self._executor,
+                functools.partial(
+                    plan_async_document,
+                    source,
+                    run_idx,
+                    total,
+                    job.source_type,
+                    settings["processing_method"],
+                    settings["optimize_images"],
+                    settings["direct_api_for_images"],
+                    use_cache=job.use_cache,
+                    split_pages=settings["split_pages"],
+                    image_options=settings["image_options"],
+                    progress=progress,
+                ),
+            )
+            if result is not None:
+                return result
+            ocr_response = await engine.process(ocr_job)
+            return await loop.run_in_executor(
+                self._executor,
+                finish_async_document,
+                ocr_job,
+                ocr_response,
+                run_idx,
+                total,
+            )
+
+        return operation
+
+    def _threaded_operation(self, job, progress):
+        settings = job.settings
+        options = job.engine_options
+        total = len(job.documents)
+        api_key = job.api_key
+
+        async def operation(run_idx, source):
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                functools.partial(
+                    process_document,
+                    api_key,
+                    source,
+                    run_idx,
+                    total,
+                    job.source_type,
+                    settings["processing_method"],
+                    job.show_debug,
+                    settings["optimize_images"],
+                    settings["direct_api_for_images"],
+                    options.get("transport_mode", TRANSPORT_POOL),
+                    use_cache=job.use_cache,
+                    split_pages=settings["split_pages"],
+                    chunk_concurrency=options.get("chunk_concurrency", 4),
+                    image_options=settings["image_options"],
+                    progress=progress,
+                ),
+            )
+
+        return operation
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Devuelve la cola de lotes compartida por todas las sesiones del proceso.
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
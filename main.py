@@ -1,17 +1,57 @@
 import streamlit as st
 import os
-import base64
-import json
 import time
 import subprocess
-import tempfile
-import requests
-from pathlib import Path
-import io
-import mimetypes
-from PIL import Image
 import traceback
 import logging
+import uuid
+import functools
+
+from ocr_async import (
+    DEFAULT_STAGE_LIMITS,
+    STAGE_DOCUMENT_UNDERSTANDING,
+    STAGE_OCR,
+    STAGE_UPLOAD,
+)
+from ocr_cache import get_result_cache
+from batch_export import EXPORT_FORMATS, build_batch_zip, export_basename, render_export
+from artifact_store import (
+    ArtifactQuotaExceeded,
+    get_artifact_store,
+    get_session_store,
+)
+from job_journal import (
+    DOC_CANCELLED,
+    DOC_DONE,
+    DOC_FAILED,
+    DOC_OCR,
+    DOC_PENDING,
+    DOC_UPLOADING,
+    IN_PROGRESS_STATES,
+    get_job_journal,
+)
+from job_queue import (
+    ENGINE_ASYNC,
+    ENGINE_THREADS,
+    JOB_FINISHED,
+    JOB_QUEUED,
+    get_job_queue,
+)
+from ocr_responses import DEFAULT_MAX_IMAGE_BYTES
+from image_tools import (
+    DEFAULT_IMAGE_BUDGET,
+    DEFAULT_MAX_DPI,
+    MIN_LEGIBLE_SIDE,
+    make_thumbnail,
+)
+from pdf_tools import DEFAULT_PAGES_PER_CHUNK, render_pdf_thumbnail
+from search_index import escape_markdown, get_search_index
+from retry_policy import get_rate_limiter
+from mistral_client import (
+    TRANSPORT_CURL,
+    TRANSPORT_POOL,
+    validate_api_key,
+)
 
 # Configuración de logging
 logging.basicConfig(
@@ -22,6 +62,23 @@ logger = logging.getLogger("MistralOCR")
 # Versión de la aplicación
 APP_VERSION = "4.1"
 
+# Intervalo de consulta del estado de un lote en segundo plano (segundos)
+JOB_POLL_INTERVAL = 1.0
+# Documentos por página en el navegador de resultados
+RESULTS_PAGE_SIZE = 25
+# Alcance de la búsqueda en los resultados
+SEARCH_THIS_JOB = "Este lote"
+SEARCH_ALL_JOBS = "Todos mis lotes"
+
+# Etiquetas de los estados de un documento del lote
+DOCUMENT_STATE_LABELS = {
+    DOC_PENDING: "⏳ Pendiente",
+    DOC_UPLOADING: "⬆️ Subiendo",
+    DOC_OCR: "🔍 OCR",
+    DOC_DONE: "✅ Terminado",
+    DOC_FAILED: "❌ Fallido",
+    DOC_CANCELLED: "⏹️ Cancelado",
+}
 # Configuración inicial de la página
 st.set_page_config(
     layout="wide",
@@ -63,28 +120,12 @@ st.markdown(
         border-radius: 0.5rem;
         margin-bottom: 1rem;
     }
-    .stButton>button {
+    .stButton>button, .stDownloadButton>button {
         background-color: #1976D2;
         color: white;
         font-weight: 500;
     }
-    .stButton>button:hover {
-        background-color: #1565C0;
-        color: white;
-    }
-    .download-button {
-        display: inline-block;
-        padding: 0.5rem 1rem;
-        background-color: #1976D2;
-        color: white;
-        text-decoration: none;
-        border-radius: 4px;
-        font-weight: 500;
-        text-align: center;
-        margin: 0.25rem 0;
-        width: 100%;
-    }
-    .download-button:hover {
+    .stButton>button:hover, .stDownloadButton>button:hover {
         background-color: #1565C0;
         color: white;
     }
@@ -112,20 +153,37 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-# Inicializar variables de estado de sesión para persistencia
-if "ocr_result" not in st.session_state:
-    st.session_state["ocr_result"] = []
+# Inicializar variables de estado de sesión para persistencia. Los textos y
+# los archivos se guardan en disco; aquí solo se conservan sus identificadores
+if "artifact_session" not in st.session_state:
+    st.session_state["artifact_session"] = uuid.uuid4().hex
+if "text_handles" not in st.session_state:
+    st.session_state["text_handles"] = []
+if "file_paths" not in st.session_state:
+    st.session_state["file_paths"] = []
+if "thumbnail_handles" not in st.session_state:
+    st.session_state["thumbnail_handles"] = []
 if "preview_src" not in st.session_state:
     st.session_state["preview_src"] = []
-if "image_bytes" not in st.session_state:
-    st.session_state["image_bytes"] = []
 if "file_names" not in st.session_state:
     st.session_state["file_names"] = []
+if "extracted_images" not in st.session_state:
+    st.session_state["extracted_images"] = []
+if "document_stats" not in st.session_state:
+    st.session_state["document_stats"] = []
+# Lotes creados o abiertos en esta sesión: los únicos en los que puede buscar
+if "session_jobs" not in st.session_state:
+    st.session_state["session_jobs"] = []
 if "processing_complete" not in st.session_state:
     st.session_state["processing_complete"] = False
 if "show_technical_details" not in st.session_state:
     st.session_state["show_technical_details"] = False
 
+session_store = get_session_store(st.session_state["artifact_session"])
+job_journal = get_job_journal()
+job_queue = get_job_queue()
+search_index = get_search_index()
+
 # ====================== FUNCIONES UTILITARIAS ======================
 
 
@@ -147,939 +205,580 @@ def get_mistral_api_key():
     return None
 
 
-def validate_api_key(api_key):
-    """
-    Verifica la validez de la API key.
-    """
-    if not api_key:
-        return False, "No se ha proporcionado API key"
-
-    headers = {"Authorization": f"Bearer {api_key}"}
-    try:
-        # Intentar una solicitud simple para verificar la clave con timeout para evitar bloqueos
-        response = requests.get(
-            "https://api.mistral.ai/v1/models", headers=headers, timeout=10
-        )
-
-        if response.status_code == 200:
-            return True, "API key válida"
-        elif response.status_code == 401:
-            return False, "API key no válida o expirada"
-        else:
-            return False, f"Error verificando API key: código {response.status_code}"
-    except requests.exceptions.ConnectionError:
-        return (
-            False,
-            "Error de conexión al verificar la API key. Comprueba tu conexión a internet.",
-        )
-    except requests.exceptions.Timeout:
-        return (
-            False,
-            "Timeout al verificar la API key. El servidor está tardando demasiado en responder.",
-        )
-    except Exception as e:
-        logger.error(f"Error inesperado al validar API key: {str(e)}")
-        return False, f"Error al validar API key: {str(e)}"
+# ====================== ARTEFACTOS DE LA SESIÓN ======================
 
 
-def prepare_image_for_ocr(file_data):
-    """
-    Prepara una imagen para ser procesada con OCR, asegurando formato óptimo.
+def store_document_result(store, result):
     """
-    try:
-        # Abrir la imagen con PIL para procesamiento
-        img = Image.open(io.BytesIO(file_data))
-
-        # Determinar el mejor formato para salida
-        save_format = "JPEG" if img.mode == "RGB" else "PNG"
+    Guarda en el almacén de la sesión el texto de un resultado del registro
+    de lotes.
 
-        # Crear un buffer para guardar la imagen optimizada
-        buffer = io.BytesIO()
+    Devuelve ``(text_handle, thumbnail_handle)``. El archivo original no se
+    copia: la sesión usa su ``file_path`` en el almacén del lote.
 
-        # Guardar la imagen en el buffer con el formato seleccionado
-        if save_format == "JPEG":
-            img.save(buffer, format="JPEG", quality=95)
-        else:
-            img.save(buffer, format="PNG")
-
-        # Devolver los datos optimizados
-        buffer.seek(0)
-        return buffer.read(), f"image/{save_format.lower()}"
-
-    except Exception as e:
-        logger.warning(f"No se pudo optimizar la imagen: {str(e)}")
-        return file_data, "image/jpeg"  # Formato por defecto
-
-
-def extract_text_from_ocr_response(response):
+    De las imágenes (y de la primera página de los PDFs, si ``pypdfium2``
+    está instalado) se guarda además una miniatura, que se genera una sola vez
+    aquí, leyendo el archivo desde disco, y es lo que se muestra por defecto.
     """
-    Extrae texto de diferentes formatos de respuesta OCR.
-    """
-    try:
-        # Caso 1: Si hay páginas con markdown
-        if "pages" in response and isinstance(response["pages"], list):
-            pages = response["pages"]
-            if pages and "markdown" in pages[0]:
-                markdown_text = "\n\n".join(
-                    page.get("markdown", "") for page in pages if "markdown" in page
-                )
-                if markdown_text.strip():
-                    return {"text": markdown_text, "format": "markdown"}
-
-        # Caso 2: Si hay un texto plano en la respuesta
-        if "text" in response:
-            return {"text": response["text"], "format": "text"}
-
-        # Caso 3: Si hay elementos (para formatos más estructurados)
-        if "elements" in response:
-            elements = response["elements"]
-            if isinstance(elements, list):
-                text_parts = []
-                for element in elements:
-                    if "text" in element:
-                        text_parts.append(element["text"])
-                return {"text": "\n".join(text_parts), "format": "elements"}
-
-        # Caso 4: Si hay un campo 'content' principal
-        if "content" in response:
-            return {"text": response["content"], "format": "content"}
-
-        # Caso 5: Si no se encuentra texto en el formato esperado, intentar examinar toda la respuesta
-        response_str = json.dumps(response, indent=2)
-
-        # Si la respuesta es muy grande, devolver un mensaje informativo
-        if len(response_str) > 5000:
-            return {
-                "text": "La respuesta OCR contiene datos pero no en el formato esperado. Revisa los detalles técnicos para más información.",
-                "format": "unknown",
-                "raw_response": response,
-            }
+    text_handle = store.put_text(result["result_text"])
+    thumbnail_handle = None
+    file_path = result.get("file_path")
+    mime_type = result.get("mime_type")
 
-        # Intentar extraer cualquier texto encontrado en la respuesta
-        extracted_text = extract_all_text_fields(response)
-        if extracted_text:
-            return {"text": extracted_text, "format": "extracted"}
+    if mime_type and file_path:
+        try:
+            if mime_type == "application/pdf":
+                thumbnail = render_pdf_thumbnail(file_path)
+            elif mime_type.startswith("image/"):
+                thumbnail = make_thumbnail(file_path)
+            else:
+                thumbnail = None
+            if thumbnail is not None:
+                thumbnail_handle = store.put_bytes(thumbnail, "jpg")
+        except ArtifactQuotaExceeded as e:
+            logger.warning(f"Miniatura de {result['file_name']} descartada: {str(e)}")
+        except Exception as e:
+            logger.warning(
+                f"No se pudo generar la miniatura de {result['file_name']}: {str(e)}"
+            )
 
-        return {
-            "text": "No se pudo encontrar texto en la respuesta OCR. Revisa los detalles técnicos.",
-            "format": "unknown",
-            "raw_response": response,
-        }
-    except Exception as e:
-        logger.error(f"Error al extraer texto de la respuesta OCR: {str(e)}")
-        return {"error": f"Error al procesar la respuesta: {str(e)}"}
+    return text_handle, thumbnail_handle
 
 
-def extract_all_text_fields(data, prefix=""):
+def load_document_preview(file_path, preview_src):
     """
-    Función recursiva para extraer todos los campos de texto de un diccionario anidado.
+    Fuente de la vista previa de un documento guardado: la URL original o la
+    ruta del archivo en el almacén del lote. El contenido nunca se incrusta en
+    la página.
     """
-    result = []
+    if not file_path:
+        return preview_src
+    return file_path if os.path.exists(file_path) else ""
 
-    if isinstance(data, dict):
-        for key, value in data.items():
-            new_prefix = f"{prefix}.{key}" if prefix else key
 
-            if isinstance(value, str) and len(value) > 1:
-                result.append(f"{new_prefix}: {value}")
-            elif isinstance(value, (dict, list)):
-                result.extend(extract_all_text_fields(value, new_prefix))
+def read_file_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
 
-    elif isinstance(data, list):
-        for i, item in enumerate(data):
-            new_prefix = f"{prefix}[{i}]"
-            if isinstance(item, (dict, list)):
-                result.extend(extract_all_text_fields(item, new_prefix))
-            elif isinstance(item, str) and len(item) > 1:
-                result.append(f"{new_prefix}: {item}")
 
-    return "\n".join(result)
-
-
-def create_download_link(data, filetype, filename):
+def build_session_zip(store, file_names, text_handles):
     """
-    Crea un enlace de descarga para los resultados.
+    ZIP con los resultados guardados en la sesión, leyendo de disco cada
+    texto solo cuando le toca entrar en el archivo.
     """
-    try:
-        b64 = base64.b64encode(data.encode()).decode()
-        href = f'<a href="data:{filetype};base64,{b64}" download="{filename}" class="download-button">Descargar {filename}</a>'
-        return href
-    except Exception as e:
-        logger.error(f"Error al crear enlace de descarga: {str(e)}")
-        return f'<span style="color: red;">Error al crear enlace de descarga: {str(e)}</span>'
+    return build_batch_zip(
+        (file_name, store.read_text(text_handle))
+        for file_name, text_handle in zip(file_names, text_handles)
+    )
 
 
-# ====================== FUNCIONES DE PROCESAMIENTO OCR ======================
+# ====================== VISUALIZACIÓN INCREMENTAL ======================
 
 
-def process_image_with_rest(api_key, image_data):
+def render_document_result(
+    file_name,
+    preview_src,
+    image_bytes,
+    result_text,
+    key,
+    images=None,
+    thumbnail_src=None,
+):
     """
-    Procesa una imagen utilizando API REST directamente (más confiable para imágenes).
+    Muestra la vista previa, el texto extraído y las descargas de un documento.
+
+    Se usa tanto en la vista final como en la vista en vivo del lote, por lo
+    que ``key`` debe ser único dentro de la ejecución del script. Las imágenes
+    extraídas (``images``) solo se leen de disco si el usuario las pide. Con
+    ``thumbnail_src`` se muestra la miniatura y la imagen completa solo se
+    envía al navegador si el usuario la pide. Los PDFs locales se sirven
+    desde disco al pulsar el botón, nunca dentro de la página.
     """
-    with st.status("Procesando imagen con REST API...", expanded=True) as status:
-        try:
-            # Obtener un mime type adecuado para la imagen
+    # Dividir el espacio para previsualización y texto
+    col1, col2 = st.columns([1, 1])
+
+    with col1:
+        st.subheader("Vista previa del documento")
+
+        if not (preview_src or thumbnail_src or image_bytes is not None):
+            st.info("Vista previa no disponible para este documento.")
+        elif "pdf" in file_name.lower():
+            if thumbnail_src:
+                st.image(
+                    thumbnail_src,
+                    caption=f"Primera página: {file_name}",
+                    use_container_width=True,
+                )
+            if preview_src.startswith(("http://", "https://")):
+                # Solución para PDFs en Streamlit Cloud
+                pdf_display_html = f"""
+                <div style="border: 1px solid #ddd; border-radius: 5px; padding: 20px; text-align: center;">
+                    <p style="margin-bottom: 15px;">Vista previa directa no disponible</p>
+                    <a href="{preview_src}"
+                       target="_blank"
+                       style="display: inline-block; padding: 10px 20px;
+                              background-color: #1976D2; color: white;
+                              text-decoration: none; border-radius: 4px;
+                              font-weight: 500;">
+                        Abrir PDF en nueva pestaña
+                    </a>
+                </div>
+                """
+                st.markdown(pdf_display_html, unsafe_allow_html=True)
+            elif preview_src:
+                st.download_button(
+                    "📄 Abrir PDF",
+                    data=functools.partial(read_file_bytes, preview_src),
+                    file_name=file_name,
+                    mime="application/pdf",
+                    key=f"{key}_pdf",
+                    on_click="ignore",
+                )
+        else:
+            # Para imágenes
             try:
-                # Si image_data es un archivo subido, convertirlo a bytes
-                if hasattr(image_data, "read"):
-                    bytes_data = image_data.read()
-                    image_data.seek(0)  # Reset file pointer
+                has_full_image = bool(preview_src) or image_bytes is not None
+                if thumbnail_src and not (
+                    has_full_image
+                    and st.toggle("🔍 Ver a tamaño completo", key=f"full_preview_{key}")
+                ):
+                    source, caption = thumbnail_src, f"Miniatura: {file_name}"
                 else:
-                    # Si ya es bytes, usarlo directamente
-                    bytes_data = image_data
-
-                # Intentar detectar el tipo MIME de la imagen
-                image_format = Image.open(io.BytesIO(bytes_data)).format.lower()
-                mime_type = f"image/{image_format}"
-                status.update(label=f"Imagen detectada como {mime_type}")
+                    source = image_bytes if image_bytes is not None else preview_src
+                    caption = f"Imagen original: {file_name}"
+                st.image(source, caption=caption, use_container_width=True)
             except Exception as e:
-                logger.warning(f"Error al detectar formato de imagen: {str(e)}")
-                # Si falla, usar un tipo genérico
-                mime_type = "image/jpeg"
-                bytes_data = (
-                    image_data if not hasattr(image_data, "read") else image_data.read()
-                )
-
-            # Codificar la imagen a base64
-            encoded_image = base64.b64encode(bytes_data).decode("utf-8")
-            image_url = f"data:{mime_type};base64,{encoded_image}"
-
-            # Preparar los datos para la solicitud
-            payload = {
-                "model": "mistral-ocr-latest",
-                "document": {"type": "image_url", "image_url": image_url},
-            }
-
-            # Configurar los headers
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {api_key}",
-            }
-
-            status.update(label="Enviando imagen a la API...")
+                st.error(f"Error al mostrar imagen: {str(e)}")
+                st.info("Vista previa no disponible debido a un error.")
 
-            # Hacer la solicitud a la API de Mistral con timeout
-            response = requests.post(
-                "https://api.mistral.ai/v1/ocr",
-                json=payload,
-                headers=headers,
-                timeout=60,  # 60 segundos de timeout para imágenes grandes
-            )
-
-            # Revisar si la respuesta fue exitosa
-            if response.status_code == 200:
-                result = response.json()
-                status.update(label="Imagen procesada correctamente", state="complete")
-                return extract_text_from_ocr_response(result)
-            else:
-                error_message = (
-                    f"Error en API OCR (código {response.status_code}): {response.text}"
-                )
-                logger.error(error_message)
-                status.update(label="Error al procesar la imagen", state="error")
-                return {"error": error_message}
+    with col2:
+        st.subheader(f"Texto extraído")
+
+        if result_text is None:
+            st.error("No hay resultados disponibles para este documento.")
+            return
+
+        if not result_text.startswith("Error:"):
+            # Añadir contador de caracteres
+            char_count = len(result_text)
+            word_count = len(result_text.split())
+            st.caption(f"{word_count} palabras | {char_count} caracteres")
+
+        # Texto área con resultado
+        st.text_area(
+            label="",
+            value=result_text,
+            height=400,
+            key=key,
+        )
 
-        except requests.exceptions.Timeout:
-            error_message = (
-                "Timeout al procesar la imagen. La operación tomó demasiado tiempo."
-            )
-            logger.error(error_message)
-            status.update(label="Timeout al procesar la imagen", state="error")
-            return {"error": error_message}
+        # Opciones de descarga para resultados exitosos
+        if not result_text.startswith("Error"):
+            st.subheader("Descargar resultados")
 
-        except requests.exceptions.ConnectionError:
-            error_message = "Error de conexión al procesar la imagen. Comprueba tu conexión a internet."
-            logger.error(error_message)
-            status.update(label="Error de conexión", state="error")
-            return {"error": error_message}
+            try:
+                # Nombre base para archivos de descarga
+                base_filename = export_basename(file_name)
+
+                # El contenido de cada descarga se genera solo al pulsar el
+                # botón, y la pulsación no relanza el script (ni el lote en curso)
+                download_columns = st.columns(len(EXPORT_FORMATS))
+                for column, (extension, mime_type) in zip(
+                    download_columns, EXPORT_FORMATS
+                ):
+                    with column:
+                        st.download_button(
+                            f"Descargar {extension.upper()}",
+                            data=functools.partial(
+                                render_export, result_text, extension
+                            ),
+                            file_name=f"{base_filename}.{extension}",
+                            mime=mime_type,
+                            key=f"{key}_download_{extension}",
+                            on_click="ignore",
+                        )
+            except Exception as e:
+                st.error(f"Error al crear enlaces de descarga: {str(e)}")
 
-        except Exception as e:
-            error_message = f"Error al procesar imagen: {str(e)}"
-            logger.error(f"{error_message}\n{traceback.format_exc()}")
-            status.update(label=f"Error: {str(e)}", state="error")
-            return {"error": error_message}
+        if images and st.checkbox(
+            f"Mostrar imágenes extraídas ({len(images)})", key=f"{key}_images"
+        ):
+            render_extracted_images(images)
 
 
-def process_ocr_with_curl(api_key, document, method="REST", show_debug=False):
+def render_extracted_images(images):
     """
-    Realiza solicitud OCR usando cURL para mayor compatibilidad y control.
+    Lee del almacén de artefactos y muestra las imágenes extraídas.
     """
-    # Crear un directorio temporal para los archivos
-    temp_dir = None
-    temp_files = []
+    store = get_artifact_store()
+    for image in images:
+        caption = f"Página {image['page'] + 1}: {image.get('id') or ''}"
+        if store.exists(image["artifact"]):
+            st.image(store.path(image["artifact"]), caption=caption)
+        else:
+            st.caption(f"{caption} (ya no está disponible en disco)")
 
-    with st.status("Iniciando procesamiento OCR...", expanded=True) as status:
-        try:
-            temp_dir = tempfile.mkdtemp()
-            logger.info(f"Directorio temporal creado: {temp_dir}")
-
-            # Preparar el documento según su tipo
-            if document.get("type") == "document_url":
-                url = document["document_url"]
-                if url.startswith("data:application/pdf;base64,"):
-                    # Guardar el PDF base64 en un archivo temporal
-                    try:
-                        status.update(label="Preparando archivo PDF...")
-                        pdf_base64 = url.replace("data:application/pdf;base64,", "")
-                        temp_pdf_path = os.path.join(temp_dir, "temp_document.pdf")
-                        temp_files.append(temp_pdf_path)
-
-                        with open(temp_pdf_path, "wb") as f:
-                            f.write(base64.b64decode(pdf_base64))
-
-                        logger.info(f"PDF guardado temporalmente en: {temp_pdf_path}")
-
-                        # Crear un comando cURL para subir el archivo
-                        upload_command = [
-                            "curl",
-                            "--fail",  # Fallar si hay error HTTP
-                            "--silent",  # Silenciar progreso
-                            "--show-error",  # Mostrar errores
-                            "--connect-timeout",
-                            "30",  # Timeout de conexión
-                            "--max-time",
-                            "120",  # Timeout total
-                            "https://api.mistral.ai/v1/files",
-                            "-H",
-                            f"Authorization: Bearer {api_key}",
-                            "-F",
-                            "purpose=ocr",
-                            "-F",
-                            f"file=@{temp_pdf_path}",
-                        ]
-
-                        # Ejecutar el comando y capturar la salida
-                        status.update(label="Subiendo PDF al servidor de Mistral...")
-                        result = subprocess.run(
-                            upload_command, capture_output=True, text=True
-                        )
 
-                        if result.returncode != 0:
-                            error_msg = f"Error al subir archivo (código {result.returncode}): {result.stderr}"
-                            logger.error(error_msg)
-                            status.update(label="Error al subir archivo", state="error")
-                            return {"error": error_msg}
-
-                        # Parsear el resultado para obtener el ID del archivo
-                        file_data = json.loads(result.stdout)
-                        file_id = file_data.get("id")
-                        if not file_id:
-                            status.update(
-                                label="Error: No se pudo obtener ID del archivo",
-                                state="error",
-                            )
-                            return {
-                                "error": "No se pudo obtener el ID del archivo subido"
-                            }
-
-                        logger.info(f"Archivo subido exitosamente. ID: {file_id}")
-                        status.update(label=f"Archivo subido. ID: {file_id}")
-
-                        # Obtener URL firmada
-                        get_url_command = [
-                            "curl",
-                            "--fail",
-                            "--silent",
-                            "--show-error",
-                            "--connect-timeout",
-                            "30",
-                            "--max-time",
-                            "60",
-                            "-X",
-                            "GET",
-                            f"https://api.mistral.ai/v1/files/{file_id}/url?expiry=24",
-                            "-H",
-                            "Accept: application/json",
-                            "-H",
-                            f"Authorization: Bearer {api_key}",
-                        ]
-
-                        status.update(label="Obteniendo URL firmada...")
-                        url_result = subprocess.run(
-                            get_url_command, capture_output=True, text=True
-                        )
+def render_document_at(store, idx):
+    """
+    Muestra el resultado del documento ``idx`` de la sesión, leyendo del
+    disco solo lo que necesita.
+    """
+    file_paths = st.session_state["file_paths"]
+    preview = load_document_preview(
+        file_paths[idx] if idx < len(file_paths) else None,
+        st.session_state["preview_src"][idx],
+    )
+    thumbnail_handles = st.session_state["thumbnail_handles"]
+    thumbnail_handle = thumbnail_handles[idx] if idx < len(thumbnail_handles) else None
+    extracted_images = st.session_state["extracted_images"]
+    render_document_result(
+        st.session_state["file_names"][idx],
+        preview,
+        None,
+        store.read_text(st.session_state["text_handles"][idx]),
+        key=f"text_area_{idx}",
+        images=extracted_images[idx] if idx < len(extracted_images) else None,
+        thumbnail_src=(
+            store.path(thumbnail_handle)
+            if thumbnail_handle and store.exists(thumbnail_handle)
+            else None
+        ),
+    )
 
-                        if url_result.returncode != 0:
-                            error_msg = f"Error al obtener URL firmada (código {url_result.returncode}): {url_result.stderr}"
-                            logger.error(error_msg)
-                            status.update(
-                                label="Error al obtener URL firmada", state="error"
-                            )
-                            return {"error": error_msg}
-
-                        url_data = json.loads(url_result.stdout)
-                        signed_url = url_data.get("url")
-                        if not signed_url:
-                            status.update(
-                                label="Error: No se pudo obtener URL firmada",
-                                state="error",
-                            )
-                            return {"error": "No se pudo obtener la URL firmada"}
-
-                        # Usar la URL firmada para el OCR
-                        document = {"type": "document_url", "document_url": signed_url}
-                        logger.info("URL firmada obtenida correctamente para OCR")
-                        status.update(label="URL firmada obtenida correctamente")
-
-                    except json.JSONDecodeError as e:
-                        error_msg = f"Error al parsear respuesta del servidor: {str(e)}"
-                        logger.error(error_msg)
-                        status.update(
-                            label="Error: Formato de respuesta incorrecto",
-                            state="error",
-                        )
-                        return {"error": error_msg}
-                    except Exception as e:
-                        error_msg = f"Error al procesar PDF: {str(e)}"
-                        logger.error(f"{error_msg}\n{traceback.format_exc()}")
-                        status.update(
-                            label=f"Error al procesar PDF: {str(e)}", state="error"
-                        )
-                        return {"error": error_msg}
-
-            elif document.get("type") == "image_url":
-                # Para imágenes, procesar directamente con la API REST
-                url = document["image_url"]
-                if url.startswith("data:"):
-                    # Es una imagen en base64
-                    try:
-                        status.update(label="Procesando imagen...")
-                        # Extraer los datos de la imagen
-                        if "," in url:
-                            base64_data = url.split(",")[1]
-                        else:
-                            base64_data = url.split(";base64,")[1]
-
-                        # Decodificar la imagen
-                        image_data = base64.b64decode(base64_data)
-
-                        # Usar la función específica para imágenes
-                        return process_image_with_rest(api_key, image_data)
-                    except Exception as e:
-                        error_msg = f"Error al procesar imagen base64: {str(e)}"
-                        logger.error(f"{error_msg}\n{traceback.format_exc()}")
-                        status.update(
-                            label=f"Error al procesar imagen: {str(e)}", state="error"
-                        )
-                        return {"error": error_msg}
 
-            # Preparar datos para la solicitud OCR
-            json_data = {
-                "model": "mistral-ocr-latest",
-                "document": document,
-                "include_image_base64": True,
+def render_results_browser(store):
+    """
+    Tabla paginada de los documentos de la sesión con su estado, tamaño y
+    número de palabras; solo se muestran la vista previa y el texto del
+    documento seleccionado, para que lotes de cientos de documentos no
+    generen cientos de pestañas en cada rerun.
+    """
+    file_names = st.session_state["file_names"]
+    stats = st.session_state["document_stats"]
+
+    filter_col, page_col = st.columns([3, 1])
+    name_filter = filter_col.text_input(
+        "Filtrar por nombre",
+        key="results_filter",
+        placeholder="Filtrar por nombre",
+        label_visibility="collapsed",
+    )
+    indices = [
+        idx
+        for idx, name in enumerate(file_names)
+        if name_filter.lower() in name.lower()
+    ]
+    if not indices:
+        st.info("Ningún documento coincide con el filtro.")
+        return
+
+    page_count = -(-len(indices) // RESULTS_PAGE_SIZE)
+    page = page_col.selectbox(
+        "Página",
+        options=range(1, page_count + 1),
+        format_func=lambda page: f"Página {page} de {page_count}",
+        key="results_page",
+        label_visibility="collapsed",
+    )
+    page_indices = indices[(page - 1) * RESULTS_PAGE_SIZE : page * RESULTS_PAGE_SIZE]
+
+    rows = []
+    for idx in page_indices:
+        document = stats[idx] if idx < len(stats) else {}
+        rows.append(
+            {
+                "Nº": idx + 1,
+                "Documento": file_names[idx],
+                "Estado": DOCUMENT_STATE_LABELS.get(
+                    document.get("state"), document.get("state", "")
+                ),
+                "Tamaño": (
+                    f"{document['size'] / 1024:.0f} KB"
+                    if document.get("size") is not None
+                    else ""
+                ),
+                "Palabras": document.get("words"),
             }
+        )
+    st.dataframe(rows, hide_index=True, use_container_width=True)
+
+    # Si el documento elegido no está en la página, se elige el primero
+    selected_idx = st.selectbox(
+        "Documento",
+        options=page_indices,
+        format_func=lambda idx: f"Doc {idx+1}: {file_names[idx]}",
+        key="results_document",
+        label_visibility="collapsed",
+    )
+    render_document_at(store, selected_idx)
 
-            # Guardar en archivo temporal
-            temp_json_path = os.path.join(temp_dir, "request.json")
-            temp_files.append(temp_json_path)
-
-            with open(temp_json_path, "w", encoding="utf-8") as f:
-                json.dump(json_data, f, ensure_ascii=False, indent=2)
-
-            # Comando para OCR con mejores prácticas
-            ocr_command = [
-                "curl",
-                "--fail",
-                "--silent",
-                "--show-error",
-                "--connect-timeout",
-                "30",
-                "--max-time",
-                "180",  # 3 minutos para documentos grandes
-                "https://api.mistral.ai/v1/ocr",
-                "-H",
-                "Content-Type: application/json",
-                "-H",
-                f"Authorization: Bearer {api_key}",
-                "-d",
-                f"@{temp_json_path}",
-            ]
-
-            # Ejecutar OCR
-            status.update(label="Ejecutando OCR con cURL...")
-            if show_debug:
-                # Mostrar comando sin API key
-                safe_command = " ".join(ocr_command).replace(api_key, "****")
-                st.code(safe_command, language="bash")
-
-            logger.info("Ejecutando OCR con cURL")
-            ocr_result = subprocess.run(ocr_command, capture_output=True, text=True)
-
-            if ocr_result.returncode != 0:
-                error_details = {
-                    "error": f"Error en OCR (código {ocr_result.returncode})",
-                    "stderr": ocr_result.stderr,
-                    "stdout": ocr_result.stdout,
-                }
-                logger.error(
-                    f"Error durante la ejecución de cURL: {error_details['error']}"
-                )
-                status.update(label=f"Error: {error_details['error']}", state="error")
-                return {"error": json.dumps(error_details)}
 
-            # Comprobar si hay errores en la respuesta
-            if (
-                "error" in ocr_result.stdout.lower()
-                or "not found" in ocr_result.stdout.lower()
-            ):
-                status.update(
-                    label="API respondió con error, intentando método alternativo...",
-                    state="running",
-                )
+def show_result(idx):
+    """
+    Selecciona el documento ``idx`` en el navegador de resultados.
+    """
+    st.session_state["results_filter"] = ""
+    st.session_state["results_page"] = idx // RESULTS_PAGE_SIZE + 1
+    st.session_state["results_document"] = idx
 
-                if show_debug:
-                    st.code(ocr_result.stdout, language="json")
 
-                # Intentar método alternativo
-                if "document understanding" not in method.lower():
-                    st.info(
-                        "Intentando procesar con el método Document Understanding..."
-                    )
-                    return process_with_document_understanding(api_key, document)
+def remember_job(job_id):
+    """
+    Anota un lote como propio de la sesión para poder buscar en él.
+    """
+    if job_id not in st.session_state["session_jobs"]:
+        st.session_state["session_jobs"].append(job_id)
 
-            try:
-                # Intentar parsear la respuesta JSON
-                response_json = json.loads(ocr_result.stdout)
-                status.update(label="Procesando respuesta OCR...")
-
-                # Extraer el texto de la respuesta
-                extraction_result = extract_text_from_ocr_response(response_json)
-
-                if "error" in extraction_result:
-                    status.update(
-                        label=f"Error al extraer texto: {extraction_result['error']}",
-                        state="error",
-                    )
-                    return extraction_result
-
-                if show_debug and "raw_response" in extraction_result:
-                    st.subheader("Respuesta completa de la API")
-                    st.json(extraction_result["raw_response"])
-
-                if "text" in extraction_result:
-                    status.update(
-                        label="Texto extraído correctamente", state="complete"
-                    )
-                    return {"pages": [{"markdown": extraction_result["text"]}]}
-                else:
-                    status.update(
-                        label="Texto extraído con formato inesperado", state="complete"
-                    )
-                    return response_json
-
-            except json.JSONDecodeError:
-                logger.warning(
-                    f"Error al parsear JSON de respuesta OCR: {ocr_result.stdout[:200]}..."
-                )
 
-                status.update(label="Procesando respuesta no-JSON...")
+def render_result_search(job_id):
+    """
+    Búsqueda de texto completo en los resultados del lote actual o de todos
+    los lotes que esta sesión creó o abrió, con los resultados ordenados por
+    relevancia. El registro lo comparten todas las sesiones, así que nunca se
+    busca en lotes ajenos.
+    """
+    query_col, scope_col = st.columns([3, 1])
+    query = query_col.text_input(
+        "Buscar en los resultados",
+        key="search_query",
+        placeholder="🔎 Buscar en el texto de los documentos",
+        label_visibility="collapsed",
+    )
+    scope = scope_col.selectbox(
+        "Alcance de la búsqueda",
+        options=[SEARCH_THIS_JOB, SEARCH_ALL_JOBS],
+        key="search_scope",
+        label_visibility="collapsed",
+    )
+    if not query.strip():
+        return
 
-                if not ocr_result.stdout.strip():
-                    status.update(label="Respuesta vacía del servidor", state="error")
-                    return {"error": "Respuesta vacía del servidor"}
+    start = time.perf_counter()
+    if scope == SEARCH_THIS_JOB:
+        job_ids = [job_id]
+    else:
+        # Los lotes descartados o caducados ya no están en el registro
+        existing = set(job_journal.job_ids())
+        job_ids = [
+            session_job
+            for session_job in st.session_state["session_jobs"]
+            if session_job in existing
+        ]
+    search_index.sync_jobs(job_journal, job_ids)
+    hits, total = search_index.search(query, job_ids=job_ids)
+    elapsed = time.perf_counter() - start
+
+    if not hits:
+        st.info(f"Ningún documento contiene «{query}».")
+        return
+    st.caption(
+        f"{total} página(s) con coincidencias, se muestran las {len(hits)} más relevantes ({elapsed * 1000:.0f} ms)"
+    )
+    browsable = len(st.session_state["file_names"]) > 1
+    for position, hit in enumerate(hits):
+        hit_job_id, idx = hit["key"]
+        location = f"Doc {idx+1}: {escape_markdown(hit['file_name'])}"
+        if hit["page"] is not None:
+            location += f" · página {hit['page']}"
+        if hit_job_id != job_id:
+            other_job = job_journal.get_job(hit_job_id)
+            if other_job:
+                location += f" · lote del {time.strftime('%d/%m/%Y %H:%M', time.localtime(other_job['created_at']))}"
+        text_col, button_col = st.columns([5, 1])
+        text_col.markdown(f"**{location}**  \n{hit['snippet']}")
+        if browsable and hit_job_id == job_id:
+            button_col.button(
+                "Ver documento",
+                key=f"search_hit_{position}",
+                on_click=show_result,
+                args=(idx,),
+                use_container_width=True,
+            )
 
-                # Si la respuesta no es JSON, podría ser texto plano
-                if (
-                    ocr_result.stdout.strip()
-                    and len(ocr_result.stdout) < 1000
-                    and not ocr_result.stdout.startswith("{")
-                    and not ocr_result.stdout.startswith("[")
-                ):
-                    # Podría ser texto plano, devolverlo como resultado
-                    status.update(
-                        label="Texto extraído en formato plano", state="complete"
-                    )
-                    return {"pages": [{"markdown": ocr_result.stdout}]}
 
-                status.update(label="Error al parsear respuesta OCR", state="error")
-                return {
-                    "error": f"Error al parsear respuesta OCR: {ocr_result.stdout[:200]}..."
-                }
+def render_batch_summary(placeholder, completed, succeeded, total, elapsed):
+    """
+    Actualiza el resumen en curso del lote: completados, correctos, fallidos
+    y rendimiento en documentos por minuto.
+    """
+    throughput = completed / elapsed * 60 if elapsed > 0 else 0.0
+    with placeholder.container():
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Completados", f"{completed}/{total}")
+        col2.metric("✅ Correctos", succeeded)
+        col3.metric("❌ Fallidos", completed - succeeded)
+        col4.metric("Rendimiento", f"{throughput:.1f} docs/min")
 
-        except Exception as e:
-            error_msg = f"Error durante el procesamiento OCR: {str(e)}"
-            logger.error(f"{error_msg}\n{traceback.format_exc()}")
-            status.update(label=f"Error inesperado: {str(e)}", state="error")
-            return {"error": error_msg}
-
-        finally:
-            # Limpiar archivos temporales de manera segura
-            if temp_files:
-                for file_path in temp_files:
-                    try:
-                        if os.path.exists(file_path):
-                            os.unlink(file_path)
-                            logger.debug(f"Archivo temporal eliminado: {file_path}")
-                    except Exception as e:
-                        logger.warning(
-                            f"No se pudo eliminar archivo temporal {file_path}: {str(e)}"
-                        )
 
-            # Limpiar directorio temporal
-            if temp_dir and os.path.exists(temp_dir):
-                try:
-                    os.rmdir(temp_dir)
-                    logger.debug(f"Directorio temporal eliminado: {temp_dir}")
-                except Exception as e:
-                    logger.warning(
-                        f"No se pudo eliminar directorio temporal {temp_dir}: {str(e)}"
-                    )
+# ====================== LOTES EN SEGUNDO PLANO ======================
 
 
-def process_with_document_understanding(api_key, document):
+def load_job_results(store, job_id):
     """
-    Método alternativo usando Document Understanding para extracción de texto.
+    Pasa los resultados de un lote del registro al almacén de la sesión, de
+    uno en uno, y marca el procesamiento como completado.
     """
-    temp_json_path = None
-
-    with st.status(
-        "Utilizando método alternativo: Document Understanding API...", expanded=True
-    ) as status:
-        try:
-            # Extraer URL del documento
-            doc_url = document.get("document_url", "") or document.get("image_url", "")
-
-            if not doc_url:
-                status.update(
-                    label="Error: No se pudo extraer URL del documento", state="error"
-                )
-                return {
-                    "error": "No se pudo extraer URL del documento para el método alternativo"
-                }
-
-            # Construir datos para chat completions
-            doc_type = "document_url" if "document_url" in document else "image_url"
-            request_data = {
-                "model": "mistral-large-latest",  # Modelo avanzado para comprensión de documentos
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Extrae todo el texto de este documento manteniendo su estructura y formato original. Conserva párrafos, listas, tablas y la jerarquía del contenido exactamente como aparece. No añadas interpretaciones ni resúmenes.",
-                            },
-                            {"type": doc_type, doc_type: doc_url},
-                        ],
-                    }
-                ],
-                "document_image_limit": 10,  # Límites para documentos grandes
-                "document_page_limit": 100,
+    job = job_journal.get_job(job_id)
+    st.session_state["text_handles"] = []
+    st.session_state["file_paths"] = []
+    st.session_state["thumbnail_handles"] = []
+    st.session_state["preview_src"] = []
+    st.session_state["file_names"] = []
+    st.session_state["extracted_images"] = []
+    st.session_state["document_stats"] = []
+    store.clear()
+
+    missing_previews = 0
+    queued_job = job_queue.get(job_id)
+    for document in job_journal.documents(job_id):
+        result = job_journal.load_result(job_id, document, job["source_type"])
+        text_handle, thumbnail_handle = store_document_result(store, result)
+        file_path = result["file_path"]
+        if file_path is None and not result["preview_src"]:
+            missing_previews += 1
+        st.session_state["text_handles"].append(text_handle)
+        st.session_state["file_paths"].append(file_path)
+        st.session_state["thumbnail_handles"].append(thumbnail_handle)
+        st.session_state["preview_src"].append(result["preview_src"])
+        st.session_state["file_names"].append(result["file_name"])
+        st.session_state["extracted_images"].append(result.get("images", []))
+        # Lo que muestra la tabla de resultados se calcula una sola vez aquí
+        st.session_state["document_stats"].append(
+            {
+                "state": document["state"],
+                "size": os.path.getsize(file_path) if file_path else None,
+                "words": (
+                    len(result["result_text"].split()) if result["success"] else None
+                ),
             }
+        )
 
-            # Guardar la solicitud en un archivo temporal
-            with tempfile.NamedTemporaryFile(
-                mode="w", suffix=".json", delete=False, encoding="utf-8"
-            ) as tmp:
-                json.dump(request_data, tmp, ensure_ascii=False, indent=2)
-                temp_json_path = tmp.name
-
-            # Comando cURL para Document Understanding con mejor manejo de errores
-            du_command = [
-                "curl",
-                "--fail",
-                "--silent",
-                "--show-error",
-                "--connect-timeout",
-                "30",
-                "--max-time",
-                "300",  # 5 minutos para documentos complejos
-                "https://api.mistral.ai/v1/chat/completions",
-                "-H",
-                "Content-Type: application/json",
-                "-H",
-                f"Authorization: Bearer {api_key}",
-                "-d",
-                f"@{temp_json_path}",
-            ]
-
-            status.update(label="Procesando con Document Understanding API...")
-            logger.info("Ejecutando Document Understanding con cURL")
-            du_result = subprocess.run(du_command, capture_output=True, text=True)
-
-            # Verificar resultado
-            if du_result.returncode != 0:
-                error_msg = f"Error en Document Understanding (código {du_result.returncode}): {du_result.stderr}"
-                logger.error(error_msg)
-                status.update(label="Error en Document Understanding", state="error")
-                return {"error": error_msg}
+    st.session_state["batch_summary"] = {
+        "total": job["total"],
+        "succeeded": job["done"],
+        "cancelled": job["cancelled"],
+        "missing_previews": missing_previews,
+        "bytes_saved": sum(queued_job.bytes_saved.values()) if queued_job else 0,
+    }
+    st.session_state["processing_complete"] = True
+    st.session_state["job_id"] = job_id
+    st.session_state["active_job"] = None
+    remember_job(job_id)
 
-            try:
-                result_json = json.loads(du_result.stdout)
-                if "choices" in result_json and len(result_json["choices"]) > 0:
-                    content = result_json["choices"][0]["message"]["content"]
-
-                    # Simular el formato de respuesta de OCR
-                    pages = [{"markdown": content}]
-                    status.update(
-                        label="Texto extraído correctamente", state="complete"
-                    )
-                    return {"pages": pages}
-                else:
-                    error_msg = "Respuesta no válida de Document Understanding"
-                    logger.error(f"{error_msg}: {du_result.stdout[:200]}...")
-                    status.update(label=error_msg, state="error")
-                    return {"error": error_msg}
-            except json.JSONDecodeError:
-                error_msg = "Error al parsear respuesta JSON de Document Understanding"
-                logger.error(f"{error_msg}: {du_result.stdout[:200]}...")
-                status.update(label=error_msg, state="error")
-                return {"error": error_msg}
 
-        except Exception as e:
-            error_msg = (
-                f"Error durante el procesamiento con Document Understanding: {str(e)}"
-            )
-            logger.error(f"{error_msg}\n{traceback.format_exc()}")
-            status.update(label=f"Error: {str(e)}", state="error")
-            return {"error": error_msg}
-
-        finally:
-            # Limpiar archivo temporal
-            if temp_json_path and os.path.exists(temp_json_path):
-                try:
-                    os.unlink(temp_json_path)
-                    logger.debug(f"Archivo temporal eliminado: {temp_json_path}")
-                except Exception as e:
-                    logger.warning(
-                        f"No se pudo eliminar archivo temporal {temp_json_path}: {str(e)}"
-                    )
-
-
-# ====================== FUNCIÓN PRINCIPAL DE PROCESAMIENTO ======================
-
-
-def process_document(
-    api_key,
-    source,
-    idx,
-    total,
-    source_type,
-    processing_method,
-    show_debug,
-    optimize_images,
-    direct_api,
-):
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def render_job_monitor(job_id):
     """
-    Función para procesar un solo documento.
-    """
-    file_bytes = None
-    file_type = None
+    Muestra el avance de un lote en segundo plano y permite cancelar
+    documentos o el lote entero.
 
-    try:
-        logger.info(f"Procesando documento {idx+1}/{total}")
-
-        # Determinar el tipo de archivo automáticamente
-        if source_type == "Archivo local":
-            file_name = source.name
-            mime = mimetypes.guess_type(file_name)[0]
-            if mime == "application/pdf":
-                file_type = "PDF"
-            elif mime and mime.startswith("image/"):
-                file_type = "Imagen"
-            else:
-                logger.warning(f"Tipo de archivo no soportado: {mime} para {file_name}")
-                return {
-                    "success": False,
-                    "result_text": f"Tipo de archivo no soportado: {file_name}",
-                    "preview_src": "",
-                    "file_name": file_name,
-                    "file_bytes": None,
-                    "raw_response": None,
-                }
-        elif source_type == "URL":
-            source_name = source.split("/")[-1]
-            if source.lower().endswith(".pdf"):
-                file_type = "PDF"
-            else:
-                file_type = "Imagen"  # Assume image for other URLs for simplicity, more robust detection could be added
-        else:
-            return {
-                "success": False,
-                "result_text": "Tipo de fuente desconocido.",
-                "preview_src": "",
-                "file_name": f"Error-{idx+1}",
-                "file_bytes": None,
-                "raw_response": None,
-            }
+    Se vuelve a ejecutar cada ``JOB_POLL_INTERVAL`` segundos sin relanzar el
+    resto del script. Cuando el lote termina, carga sus resultados en la
+    sesión y relanza la página completa.
+    """
+    queued_job = job_queue.get(job_id)
+    job = job_journal.get_job(job_id)
+    if job is None:
+        st.session_state["active_job"] = None
+        st.rerun()
+
+    finished = job["done"] + job["failed"] + job["cancelled"]
+    if finished == job["total"]:
+        load_job_results(session_store, job_id)
+        st.rerun()
+    if queued_job is None or queued_job.status == JOB_FINISHED:
+        # El lote se detuvo sin terminar: se ofrece reanudarlo desde la URL
+        st.session_state["active_job"] = None
+        st.rerun()
+
+    if queued_job.status == JOB_QUEUED:
+        st.info(
+            f"Lote en cola (posición {job_queue.queue_position(job_id)}): empezará cuando termine alguno de los lotes en curso."
+        )
+    st.progress(finished / job["total"], text=f"Procesados {finished}/{job['total']}")
+    render_batch_summary(
+        st.empty(),
+        finished,
+        job["done"],
+        job["total"],
+        time.time() - (queued_job.started_at or time.time()),
+    )
 
-        # Preparar el documento según el tipo y la fuente
-        if file_type == "PDF":
-            if source_type == "URL":
-                document = {
-                    "type": "document_url",
-                    "document_url": source.strip(),
-                }
-                preview_src = source.strip()
-                file_name = source.split("/")[-1]
-            else:
-                try:
-                    file_bytes = source.read()
-                    encoded_pdf = base64.b64encode(file_bytes).decode("utf-8")
-                    document = {
-                        "type": "document_url",
-                        "document_url": f"data:application/pdf;base64,{encoded_pdf}",
-                    }
-                    preview_src = f"data:application/pdf;base64,{encoded_pdf}"
-                    file_name = source.name
-                    # Reiniciar el cursor del archivo para futuras operaciones
-                    source.seek(0)
-                except Exception as e:
-                    logger.error(f"Error al leer PDF: {str(e)}")
-                    return {
-                        "success": False,
-                        "result_text": f"Error al leer el archivo PDF: {str(e)}",
-                        "preview_src": "",
-                        "file_name": getattr(source, "name", f"PDF-Error-{idx+1}"),
-                        "file_bytes": None,
-                        "raw_response": None,
-                    }
-        elif file_type == "Imagen":
-            if source_type == "URL":
-                document = {
-                    "type": "image_url",
-                    "image_url": source.strip(),
-                }
-                preview_src = source.strip()
-                file_name = source.split("/")[-1]
-            else:
-                try:
-                    # Leer los bytes de la imagen
-                    file_bytes = source.read()
-
-                    # Optimizar la imagen si está habilitado
-                    if optimize_images:
-                        file_bytes, mime_type = prepare_image_for_ocr(file_bytes)
-                    else:
-                        mime_type = source.type
-
-                    # Codificar en base64 para enviar a la API
-                    encoded_image = base64.b64encode(file_bytes).decode("utf-8")
-
-                    # Preparar el documento con la imagen
-                    document = {
-                        "type": "image_url",
-                        "image_url": f"data:{mime_type};base64,{encoded_image}",
-                    }
-                    preview_src = f"data:{mime_type};base64,{encoded_image}"
-                    file_name = source.name
-
-                    # Reiniciar el cursor del archivo para futuras operaciones
-                    source.seek(0)
-                except Exception as e:
-                    logger.error(f"Error al leer imagen: {str(e)}")
-                    return {
-                        "success": False,
-                        "result_text": f"Error al leer la imagen: {str(e)}",
-                        "preview_src": "",
-                        "file_name": getattr(source, "name", f"Imagen-Error-{idx+1}"),
-                        "file_bytes": None,
-                        "raw_response": None,
-                    }
-        else:
-            return {
-                "success": False,
-                "result_text": f"Tipo de archivo no soportado para {source_name if 'source_name' in locals() else 'documento'}.",
-                "preview_src": "",
-                "file_name": (
-                    source_name if "source_name" in locals() else f"Error-{idx+1}"
+    documents = job_journal.documents(job_id)
+    st.dataframe(
+        [
+            {
+                "Documento": document["file_name"],
+                "Estado": DOCUMENT_STATE_LABELS.get(
+                    document["state"], document["state"]
+                ),
+                "Etapa": (
+                    queued_job.labels.get(document["idx"], "")
+                    if document["state"] in IN_PROGRESS_STATES
+                    else ""
+                ),
+                "Intentos": document["attempts"],
+                "Ahorro": (
+                    f"{queued_job.bytes_saved[document['idx']] / 1024:.0f} KB"
+                    if document["idx"] in queued_job.bytes_saved
+                    else ""
                 ),
-                "file_bytes": None,
-                "raw_response": None,
-            }
-
-        # Procesar documento con el método apropiado
-        try:
-            # Si es una imagen y está habilitada la API REST directa, usar ese método
-            if file_type == "Imagen" and direct_api and source_type == "Archivo local":
-                ocr_response = process_image_with_rest(api_key, file_bytes)
-                # Convertir la respuesta al formato esperado por el resto del código
-                if "text" in ocr_response:
-                    ocr_response = {"pages": [{"markdown": ocr_response["text"]}]}
-            else:
-                # Determinar el método a usar basado en la selección
-                if processing_method == "OCR API (Standard)":
-                    ocr_response = process_ocr_with_curl(
-                        api_key, document, method="OCR", show_debug=show_debug
-                    )
-                elif processing_method == "Document Understanding API":
-                    ocr_response = process_with_document_understanding(
-                        api_key, document
-                    )
-                else:  # Auto
-                    ocr_response = process_ocr_with_curl(
-                        api_key, document, method="Auto", show_debug=show_debug
-                    )
-        except Exception as e:
-            logger.error(
-                f"Error en el procesamiento OCR: {str(e)}\n{traceback.format_exc()}"
-            )
-            return {
-                "success": False,
-                "result_text": f"Error durante el procesamiento OCR: {str(e)}",
-                "preview_src": preview_src if "preview_src" in locals() else "",
-                "file_name": file_name if "file_name" in locals() else f"Error-{idx+1}",
-                "file_bytes": file_bytes,
-                "raw_response": None,
             }
+            for document in documents
+        ],
+        hide_index=True,
+        use_container_width=True,
+    )
 
-        # Procesar la respuesta
-        if "error" in ocr_response:
-            result_text = f"Error al procesar {file_name}: {ocr_response['error']}"
-            success = False
-        else:
-            pages = ocr_response.get("pages", [])
-            if pages:
-                result_text = "\n\n".join(
-                    page.get("markdown", "") for page in pages if "markdown" in page
-                )
-                if result_text.strip():
-                    success = True
-                else:
-                    result_text = f"No se encontró texto en {file_name}."
-                    success = False
-            else:
-                result_text = f"Estructura de respuesta inesperada para {file_name}."
-                success = False
-
-        logger.info(
-            f"Documento {idx+1}/{total} procesado: {'Éxito' if success else 'Fallido'}"
+    # Las opciones no cambian entre consultas para que la selección se
+    # conserve mientras avanza el lote
+    names = {document["idx"]: document["file_name"] for document in documents}
+    states = {document["idx"]: document["state"] for document in documents}
+    select_col, cancel_col, cancel_all_col = st.columns([3, 1, 1])
+    selected_idx = select_col.selectbox(
+        "Documento",
+        options=list(names),
+        format_func=lambda idx: f"Doc {idx+1}: {names[idx]}",
+        index=None,
+        placeholder="Elige un documento para revisarlo o cancelarlo",
+        key=f"job_document_{job_id}",
+        label_visibility="collapsed",
+    )
+    if cancel_col.button(
+        "⏹️ Cancelar documento",
+        key=f"cancel_document_{job_id}",
+        disabled=selected_idx is None or states[selected_idx] not in IN_PROGRESS_STATES,
+        use_container_width=True,
+    ):
+        job_queue.cancel_document(job_id, selected_idx)
+    if cancel_all_col.button(
+        "🛑 Cancelar lote", key=f"cancel_job_{job_id}", use_container_width=True
+    ):
+        job_queue.cancel_job(job_id)
+
+    # Los documentos terminados se pueden revisar sin esperar al resto
+    if selected_idx is not None and states[selected_idx] in (DOC_DONE, DOC_FAILED):
+        result = job_journal.load_result(
+            job_id, documents[selected_idx], job["source_type"]
         )
-        return {
-            "success": success,
-            "result_text": result_text,
-            "preview_src": preview_src,
-            "file_name": file_name,
-            "file_bytes": file_bytes,
-            "raw_response": (
-                ocr_response.get("raw_response")
-                if "raw_response" in ocr_response
-                else None
-            ),
-        }
-
-    except Exception as e:
-        error_msg = str(e)
-        logger.error(
-            f"Error inesperado procesando documento {idx+1}/{total}: {error_msg}\n{traceback.format_exc()}"
+        render_document_result(
+            result["file_name"],
+            "",
+            None,
+            result["result_text"],
+            key=f"job_text_area_{selected_idx}",
         )
-        return {
-            "success": False,
-            "result_text": f"Error inesperado: {error_msg}",
-            "preview_src": preview_src if "preview_src" in locals() else "",
-            "file_name": (
-                file_name
-                if "file_name" in locals()
-                else (
-                    getattr(source, "name", f"Doc-{idx+1}")
-                    if not isinstance(source, str)
-                    else f"URL-{idx+1}"
-                )
-            ),
-            "file_bytes": file_bytes,
-            "raw_response": None,
-        }
+
+    if queued_job.show_debug:
+        with st.expander("Detalles técnicos"):
+            for document in documents:
+                for kind, content in queued_job.debug_events(document["idx"]):
+                    st.caption(f"Doc {document['idx']+1}: {document['file_name']}")
+                    if kind == "request":
+                        st.code(content, language="bash")
+                    elif content is not None:
+                        st.json(content)
 
 
 # ====================== INTERFAZ DE USUARIO ======================
@@ -1122,21 +821,31 @@ with st.sidebar:
                 """
                 )
         else:
-            # Verificar la API key ingresada
-            valid, message = validate_api_key(api_key_input)
+            # Verificar la API key ingresada (resultado cacheado a nivel de proceso)
+            valid, message = validate_api_key(
+                api_key_input, force=st.session_state.pop("force_key_check", False)
+            )
             if valid:
                 st.success(f"✅ {message}")
                 api_key = api_key_input
             else:
                 st.warning(f"⚠️ {message}")
     else:
-        # Verificar silenciosamente la API key existente
-        valid, message = validate_api_key(api_key)
+        # Verificar silenciosamente la API key existente (resultado cacheado a nivel de proceso)
+        valid, message = validate_api_key(
+            api_key, force=st.session_state.pop("force_key_check", False)
+        )
         if valid:
             st.success("✅ API key configurada correctamente")
         else:
             st.error(f"❌ La API key configurada no es válida: {message}")
 
+    st.button(
+        "🔄 Revalidar API key",
+        help="Fuerza una nueva comprobación de la API key contra el servidor",
+        on_click=lambda: st.session_state.update(force_key_check=True),
+    )
+
     # Método de carga
     st.subheader("Método de carga")
     source_type = st.radio(
@@ -1160,6 +869,47 @@ with st.sidebar:
         help="Selecciona el método para procesar los documentos",
     )
 
+    execution_engine = st.radio(
+        "Motor de ejecución",
+        options=[ENGINE_THREADS, ENGINE_ASYNC],
+        format_func=lambda engine: (
+            "Hilos (pool de trabajadores)"
+            if engine == ENGINE_THREADS
+            else "asyncio (bucle de eventos)"
+        ),
+        help="asyncio mantiene muchos documentos en curso con un solo hilo y límites por etapa",
+    )
+
+    max_concurrency = 1
+    stage_limits = dict(DEFAULT_STAGE_LIMITS)
+    if execution_engine == ENGINE_THREADS:
+        max_concurrency = st.slider(
+            "Documentos en paralelo",
+            min_value=1,
+            max_value=8,
+            value=4,
+            help="Número máximo de documentos que se procesan a la vez",
+        )
+    else:
+        stage_limits[STAGE_UPLOAD] = st.number_input(
+            "Subidas simultáneas",
+            min_value=1,
+            max_value=32,
+            value=DEFAULT_STAGE_LIMITS[STAGE_UPLOAD],
+        )
+        stage_limits[STAGE_OCR] = st.number_input(
+            "Llamadas OCR simultáneas",
+            min_value=1,
+            max_value=64,
+            value=DEFAULT_STAGE_LIMITS[STAGE_OCR],
+        )
+        stage_limits[STAGE_DOCUMENT_UNDERSTANDING] = st.number_input(
+            "Llamadas Document Understanding simultáneas",
+            min_value=1,
+            max_value=16,
+            value=DEFAULT_STAGE_LIMITS[STAGE_DOCUMENT_UNDERSTANDING],
+        )
+
     # Opciones generales
     show_technical_details = st.checkbox(
         "Mostrar detalles técnicos",
@@ -1173,6 +923,37 @@ with st.sidebar:
         value=True,
         help="Optimiza las imágenes antes de enviarlas para OCR (recomendado)",
     )
+    if optimize_images:
+        # Se busca el formato, la calidad y la escala que caben en el presupuesto
+        optimize_images = {
+            "max_bytes": st.number_input(
+                "Tamaño máximo por imagen (KB)",
+                min_value=50,
+                max_value=20 * 1024,
+                value=DEFAULT_IMAGE_BUDGET // 1024,
+                help=f"Se prueban JPEG, WebP y PNG con distintas calidades y escalas sin bajar de {MIN_LEGIBLE_SIDE} px de lado largo",
+            )
+            * 1024
+        }
+    # Preprocesamiento con OpenCV: reduce las fotos grandes antes de subirlas
+    if optimize_images and st.checkbox(
+        "Preprocesar imágenes con OpenCV",
+        help="Limita la resolución, pasa a escala de grises y elimina el canal alfa y los metadatos",
+    ):
+        optimize_images |= {
+            "max_dpi": st.number_input(
+                "Resolución máxima (DPI)",
+                min_value=72,
+                max_value=600,
+                value=DEFAULT_MAX_DPI,
+                help="Sin DPI en la imagen, se supone una página A4",
+            ),
+            "grayscale": st.checkbox("Escala de grises", value=True),
+            "binarize": st.checkbox(
+                "Binarización adaptativa",
+                help="Blanco y negro para documentos de texto escaneados o fotografiados; no se recomienda para capturas de pantalla",
+            ),
+        }
 
     # Opciones específicas para imágenes
     direct_api_for_images = st.checkbox(
@@ -1181,8 +962,106 @@ with st.sidebar:
         help="Usa la API REST directamente para procesar imágenes (más confiable)",
     )
 
+    # División de PDFs grandes en fragmentos de páginas
+    split_large_pdfs = st.checkbox(
+        "Dividir PDFs grandes en fragmentos",
+        help="Procesa los PDFs locales por rangos de páginas en paralelo y reintenta solo los fragmentos fallidos",
+    )
+    split_pages = 0
+    chunk_concurrency = 4
+    if split_large_pdfs:
+        split_pages = st.number_input(
+            "Páginas por fragmento",
+            min_value=1,
+            max_value=500,
+            value=DEFAULT_PAGES_PER_CHUNK,
+        )
+        chunk_concurrency = st.slider(
+            "Fragmentos en paralelo por documento",
+            min_value=1,
+            max_value=8,
+            value=4,
+        )
+
+    # Imágenes incrustadas en la respuesta OCR (desactivadas por defecto)
+    include_images = st.checkbox(
+        "Extraer imágenes incrustadas",
+        help="Pide a la API las imágenes de los documentos y las guarda en disco. Aumenta el tamaño de las respuestas",
+    )
+    image_options = None
+    if include_images:
+        image_options = {
+            "limit": st.number_input(
+                "Máximo de imágenes por documento",
+                min_value=1,
+                max_value=500,
+                value=20,
+            ),
+            "min_size": st.number_input(
+                "Tamaño mínimo de imagen (px)",
+                min_value=0,
+                max_value=2000,
+                value=64,
+            ),
+            "max_bytes": st.number_input(
+                "Tamaño máximo por imagen (MB)",
+                min_value=1,
+                max_value=50,
+                value=DEFAULT_MAX_IMAGE_BYTES // (1024 * 1024),
+            )
+            * 1024
+            * 1024,
+        }
+
+    # Transporte HTTP para las llamadas a la API
+    transport_mode = st.radio(
+        "Transporte HTTP",
+        options=[TRANSPORT_POOL, TRANSPORT_CURL],
+        format_func=lambda mode: (
+            "Pool de conexiones (recomendado)"
+            if mode == TRANSPORT_POOL
+            else "cURL (compatibilidad)"
+        ),
+        help="El pool reutiliza conexiones keep-alive entre documentos; cURL lanza un proceso por solicitud. No aplica al motor asyncio.",
+    )
+
+    # Caché de resultados OCR
+    st.subheader("💾 Caché de resultados")
+    result_cache = get_result_cache()
+    bypass_cache = st.checkbox(
+        "Omitir caché en esta ejecución",
+        help="Vuelve a procesar los documentos aunque haya un resultado guardado (el nuevo resultado reemplaza al anterior)",
+    )
+    cache_budget_mb = st.number_input(
+        "Tamaño máximo de la caché (MB)",
+        min_value=10,
+        max_value=100_000,
+        value=result_cache.max_bytes // (1024 * 1024),
+        step=50,
+    )
+    if cache_budget_mb * 1024 * 1024 != result_cache.max_bytes:
+        result_cache.set_max_bytes(cache_budget_mb * 1024 * 1024)
+    cache_stats = result_cache.stats()
+    st.caption(
+        f"Aciertos: {cache_stats['hits']} | Fallos: {cache_stats['misses']} | "
+        f"{cache_stats['entries']} entradas, {cache_stats['bytes'] / (1024 * 1024):.1f} MB"
+    )
+    if st.button("Vaciar caché"):
+        result_cache.clear()
+        st.success("Caché vaciada")
+    st.caption(
+        f"Almacenamiento de esta sesión: {session_store.usage() / (1024 * 1024):.1f} de "
+        f"{session_store.quota_bytes / (1024 * 1024):.0f} MB"
+    )
+
     # Herramientas de diagnóstico
     st.subheader("🔧 Diagnóstico")
+    if api_key:
+        rate_limiter = get_rate_limiter(api_key)
+        st.caption(
+            f"Límite de tasa adaptativo: {rate_limiter.rate:.1f} solicitudes/s "
+            f"({rate_limiter.throttle_count} respuestas 429 recibidas)"
+        )
     if st.button("Verificar instalación de cURL"):
         try:
             result = subprocess.run(
@@ -1241,6 +1120,49 @@ if not api_key:
     # Detener la ejecución hasta que tengamos una API key
     st.stop()
 
+# El lote en curso se anota en la URL (?lote=...): al recargar la página se
+# vuelve a seguir si sigue en la cola, o se puede reanudar o recuperar su
+# resultado si la sesión se desconectó o el servidor se reinició
+resume_job = None
+url_job_id = st.query_params.get("lote")
+if url_job_id and url_job_id not in (
+    st.session_state.get("job_id"),
+    st.session_state.get("active_job"),
+):
+    url_job = job_journal.get_job(url_job_id)
+    if url_job is None:
+        del st.query_params["lote"]
+    elif job_queue.is_active(url_job_id):
+        st.session_state["active_job"] = url_job_id
+        remember_job(url_job_id)
+    else:
+        with st.container(border=True):
+            st.markdown(
+                f"♻️ **Lote del {time.strftime('%d/%m/%Y %H:%M', time.localtime(url_job['created_at']))}**: "
+                f"{url_job['total']} documento(s), {url_job['done']} terminado(s), "
+                f"{url_job['failed']} fallido(s), {url_job['cancelled']} cancelado(s), "
+                f"{url_job['total'] - url_job['done'] - url_job['failed'] - url_job['cancelled']} pendiente(s)"
+            )
+            resume_col, discard_col = st.columns(2)
+            if resume_col.button(
+                (
+                    "▶️ Reanudar lote"
+                    if url_job["remaining"]
+                    else "📥 Recuperar resultados"
+                ),
+                key="resume_job",
+                use_container_width=True,
+            ):
+                resume_job = url_job
+            if discard_col.button(
+                "🗑️ Descartar lote", key="discard_job", use_container_width=True
+            ):
+                job_journal.delete_job(url_job_id)
+                if url_job_id in st.session_state["session_jobs"]:
+                    st.session_state["session_jobs"].remove(url_job_id)
+                del st.query_params["lote"]
+                st.rerun()
+
 # Interfaz para cargar documentos
 st.header("1️⃣ Cargar documentos")
 
@@ -1270,93 +1192,73 @@ process_button = st.button(
     use_container_width=True,
     disabled=not api_key
     or (source_type == "URL" and not input_url.strip())
-    or (source_type == "Archivo local" and not uploaded_files),
+    or (source_type == "Archivo local" and not uploaded_files)
+    # Un lote a la vez por sesión; el resto de sesiones no se ven afectadas
+    or bool(st.session_state.get("active_job")),
 )
 
 # ====================== LÓGICA DE PROCESAMIENTO ======================
 
-if process_button:
+if process_button or resume_job:
     # Preparar fuentes
     try:
-        sources = input_url.split("\n") if source_type == "URL" else uploaded_files
-        sources = [
-            s
-            for s in sources
-            if s and (isinstance(s, str) and s.strip() or not isinstance(s, str))
-        ]
+        if resume_job:
+            # Se reanuda con las opciones con que se creó el lote, para que
+            # las claves de caché y las rutas coincidan
+            job_id = resume_job["job_id"]
+            job_source_type = resume_job["source_type"]
+            job_settings = resume_job["settings"]
+        else:
+            sources = input_url.split("\n") if source_type == "URL" else uploaded_files
+            sources = [
+                s
+                for s in sources
+                if s and (isinstance(s, str) and s.strip() or not isinstance(s, str))
+            ]
 
-        if not sources:
-            st.error("No se encontraron fuentes válidas para procesar.")
-            st.stop()
+            if not sources:
+                st.error("No se encontraron fuentes válidas para procesar.")
+                st.stop()
+
+            # Registrar el lote antes de empezar para poder reanudarlo si la
+            # sesión se desconecta o el servidor se reinicia
+            job_source_type = source_type
+            job_settings = {
+                "processing_method": processing_method,
+                "optimize_images": optimize_images,
+                "direct_api_for_images": direct_api_for_images,
+                "split_pages": split_pages,
+                "image_options": image_options,
+            }
+            job_id = job_journal.create_job(job_source_type, job_settings, sources)
+            st.query_params["lote"] = job_id
+        remember_job(job_id)
 
-        # Reiniciar estados
-        st.session_state["ocr_result"] = []
-        st.session_state["preview_src"] = []
-        st.session_state["image_bytes"] = []
-        st.session_state["file_names"] = []
         st.session_state["processing_complete"] = False
-
-        total_files = len(sources)
-        st.info(f"Procesando {total_files} documento(s)...")
-
-        # Configurar barra de progreso
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-
-        # Procesar documentos de forma secuencial con mejor información de progreso
-        results = []
-
-        for idx, source in enumerate(sources):
-            # Actualizar progreso
-            progress_value = idx / total_files
-            progress_bar.progress(
-                progress_value, text=f"Procesando {idx+1}/{total_files}"
-            )
-
-            # Nombre de fuente para mostrar
-            source_name = source if isinstance(source, str) else source.name
-            status_text.text(
-                f"Procesando {'URL' if source_type == 'URL' else 'archivo'}: {source_name}"
-            )
-
-            # Procesar documento
-            result = process_document(
+        pending_documents = job_journal.pending_documents(job_id)
+        if pending_documents:
+            # El lote se procesa en segundo plano: la interfaz solo consulta
+            # su estado, así que interactuar con ella no lo interrumpe
+            job_queue.submit(
+                job_id,
                 api_key,
-                source,
-                idx,
-                total_files,
-                source_type,
-                processing_method,
-                show_technical_details,
-                optimize_images,
-                direct_api_for_images,
-            )
-
-            results.append(result)
-
-            # Actualizar listas de resultados
-            st.session_state["ocr_result"].append(result["result_text"])
-            st.session_state["preview_src"].append(result["preview_src"])
-            st.session_state["file_names"].append(result["file_name"])
-            if result["file_bytes"] is not None:
-                st.session_state["image_bytes"].append(result["file_bytes"])
-
-        # Marcar procesamiento como completado
-        st.session_state["processing_complete"] = True
-
-        # Actualizar progreso final
-        progress_bar.progress(1.0, text="¡Procesamiento completado!")
-
-        # Mostrar resumen
-        success_count = sum(1 for r in results if r["success"])
-        if success_count == total_files:
-            st.success(
-                f"✅ ¡Procesamiento completado con éxito! Se procesaron {total_files} documento(s)."
+                job_source_type,
+                job_settings,
+                pending_documents,
+                {
+                    "engine": execution_engine,
+                    "max_concurrency": max_concurrency,
+                    "chunk_concurrency": chunk_concurrency,
+                    "transport_mode": transport_mode,
+                    "stage_limits": stage_limits,
+                },
+                use_cache=not bypass_cache,
+                show_debug=show_technical_details,
             )
+            st.session_state["active_job"] = job_id
         else:
-            st.warning(
-                f"⚠️ Procesamiento completado con {total_files - success_count} error(es). Se procesaron {success_count} de {total_files} documento(s) correctamente."
-            )
+            # Nada que procesar: solo se recuperan los resultados guardados
+            load_job_results(session_store, job_id)
 
     except Exception as e:
         st.error(f"Error al preparar documentos para procesamiento: {str(e)}")
@@ -1364,164 +1266,61 @@ if process_button:
             with st.expander("Detalles técnicos del error"):
                 st.code(traceback.format_exc())
 
+if st.session_state.get("active_job"):
+    st.header("3️⃣ Progreso")
+    render_job_monitor(st.session_state["active_job"])
+
 # ====================== VISUALIZACIÓN DE RESULTADOS ======================
 
 # Mostrar resultados si están disponibles
-if st.session_state.get("processing_complete") and st.session_state.get("ocr_result"):
+if st.session_state.get("processing_complete") and st.session_state.get("file_names"):
     st.header("3️⃣ Resultados")
 
+    batch_summary = st.session_state.get("batch_summary")
+    if batch_summary:
+        total_files = batch_summary["total"]
+        success_count = batch_summary["succeeded"]
+        if success_count == total_files:
+            st.success(
+                f"✅ ¡Procesamiento completado con éxito! Se procesaron {total_files} documento(s)."
+            )
+        else:
+            st.warning(
+                f"⚠️ Procesamiento completado con {total_files - success_count} error(es) o cancelación(es). Se procesaron {success_count} de {total_files} documento(s) correctamente."
+            )
+        if batch_summary["missing_previews"]:
+            st.warning(
+                f"{batch_summary['missing_previews']} documento(s) no tendrán vista previa: sus archivos ya no están guardados en el lote."
+            )
+        if batch_summary.get("bytes_saved"):
+            st.caption(
+                f"🗜️ La optimización de imágenes ahorró {batch_summary['bytes_saved'] / (1024 * 1024):.1f} MB de subida."
+            )
+
     try:
         if len(st.session_state["file_names"]) > 0:
-            # Usar tabs para múltiples documentos
+            st.download_button(
+                "⬇️ Descargar todo (ZIP)",
+                data=functools.partial(
+                    build_session_zip,
+                    session_store,
+                    list(st.session_state["file_names"]),
+                    list(st.session_state["text_handles"]),
+                ),
+                file_name="resultados_ocr.zip",
+                mime="application/zip",
+                key="download_batch_zip",
+                on_click="ignore",
+            )
+
+            if st.session_state.get("job_id"):
+                render_result_search(st.session_state["job_id"])
+
             if len(st.session_state["file_names"]) > 1:
-                tabs = st.tabs(
-                    [
-                        f"Doc {idx+1}: {name}"
-                        for idx, name in enumerate(st.session_state["file_names"])
-                    ]
-                )
+                render_results_browser(session_store)
             else:
-                # Para un solo documento, crear un contenedor sin tabs
-                tabs = [st.container()]
-
-            for idx, tab in enumerate(tabs):
-                with tab:
-                    # Dividir el espacio para previsualización y texto
-                    col1, col2 = st.columns([1, 1])
-
-                    with col1:
-                        st.subheader("Vista previa del documento")
-
-                        if (
-                            idx < len(st.session_state["preview_src"])
-                            and st.session_state["preview_src"][idx]
-                        ):
-                            file_name = st.session_state["file_names"][idx]
-
-                            if "pdf" in file_name.lower():
-                                # Solución para PDFs en Streamlit Cloud
-                                pdf_display_html = f"""
-                                <div style="border: 1px solid #ddd; border-radius: 5px; padding: 20px; text-align: center;">
-                                    <p style="margin-bottom: 15px;">Vista previa directa no disponible</p>
-                                    <a href="{st.session_state["preview_src"][idx]}"
-                                       target="_blank"
-                                       style="display: inline-block; padding: 10px 20px;
-                                              background-color: #1976D2; color: white;
-                                              text-decoration: none; border-radius: 4px;
-                                              font-weight: 500;">
-                                        Abrir PDF en nueva pestaña
-                                    </a>
-                                </div>
-                                """
-                                st.markdown(pdf_display_html, unsafe_allow_html=True)
-                            else:
-                                # Para imágenes
-                                try:
-                                    if source_type == "Archivo local" and idx < len(
-                                        st.session_state.get("image_bytes", [])
-                                    ):
-                                        st.image(
-                                            st.session_state["image_bytes"][idx],
-                                            caption=f"Imagen original: {file_name}",
-                                            use_container_width=True,
-                                        )
-                                    elif st.session_state["preview_src"][idx]:
-                                        st.image(
-                                            st.session_state["preview_src"][idx],
-                                            caption=f"Imagen original: {file_name}",
-                                            use_container_width=True,
-                                        )
-                                    else:
-                                        st.info(
-                                            "Vista previa no disponible para este documento."
-                                        )
-                                except Exception as e:
-                                    st.error(f"Error al mostrar imagen: {str(e)}")
-                                    st.info(
-                                        "Vista previa no disponible debido a un error."
-                                    )
-                        else:
-                            st.info("Vista previa no disponible para este documento.")
-
-                    with col2:
-                        st.subheader(f"Texto extraído")
-
-                        if idx < len(st.session_state["ocr_result"]):
-                            result_text = st.session_state["ocr_result"][idx]
-
-                            if not result_text.startswith("Error:"):
-                                # Añadir contador de caracteres
-                                char_count = len(result_text)
-                                word_count = len(result_text.split())
-                                st.caption(
-                                    f"{word_count} palabras | {char_count} caracteres"
-                                )
-
-                            # Texto área con resultado
-                            st.text_area(
-                                label="",
-                                value=result_text,
-                                height=400,
-                                key=f"text_area_{idx}",
-                            )
-
-                            # Opciones de descarga para resultados exitosos
-                            if not result_text.startswith("Error"):
-                                st.subheader("Descargar resultados")
-
-                                try:
-                                    # Nombre base para archivos de descarga
-                                    base_filename = st.session_state["file_names"][
-                                        idx
-                                    ].split(".")[0]
-
-                                    # Opciones de descarga con mejor UI
-                                    download_col1, download_col2, download_col3 = (
-                                        st.columns(3)
-                                    )
-
-                                    with download_col1:
-                                        json_data = json.dumps(
-                                            {"ocr_result": result_text},
-                                            ensure_ascii=False,
-                                            indent=2,
-                                        )
-                                        st.markdown(
-                                            create_download_link(
-                                                json_data,
-                                                "application/json",
-                                                f"{base_filename}.json",
-                                            ),
-                                            unsafe_allow_html=True,
-                                        )
-
-                                    with download_col2:
-                                        st.markdown(
-                                            create_download_link(
-                                                result_text,
-                                                "text/plain",
-                                                f"{base_filename}.txt",
-                                            ),
-                                            unsafe_allow_html=True,
-                                        )
-
-                                    with download_col3:
-                                        st.markdown(
-                                            create_download_link(
-                                                result_text,
-                                                "text/markdown",
-                                                f"{base_filename}.md",
-                                            ),
-                                            unsafe_allow_html=True,
-                                        )
-                                except Exception as e:
-                                    st.error(
-                                        f"Error al crear enlaces de descarga: {str(e)}"
-                                    )
-                        else:
-                            st.error(
-                                "No hay resultados disponibles para este documento."
-                            )
+                # Para un solo documento no hace falta la tabla
+                render_document_at(session_store, 0)
 
     except Exception as e:
         st.error(f"Error al mostrar resultados: {str(e)}")
@@ -0,0 +1,877 @@
+"""
+Transporte HTTP compartido y constructores de solicitudes para la API de Mistral.
+
+Mantiene un pool de conexiones keep-alive que se reutiliza entre documentos y
+entre reruns de Streamlit (el módulo queda cacheado en ``sys.modules``), y
+conserva el modo cURL como alternativa de compatibilidad.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import mmap
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from progress import BYTES_UPLOADED, NO_PROGRESS, RETRY
+from retry_policy import DEFAULT_RETRY_POLICY, get_rate_limiter, parse_retry_after
+
+logger = logging.getLogger("MistralOCR")
+
+MISTRAL_API_BASE = "https://api.mistral.ai/v1"
+
+# Timeout de conexión compartido por ambos transportes (equivalente a --connect-timeout)
+CONNECT_TIMEOUT = 30
+
+OCR_MODEL = "mistral-ocr-latest"
+DOCUMENT_UNDERSTANDING_MODEL = "mistral-large-latest"
+
+TRANSPORT_POOL = "pool"
+TRANSPORT_CURL = "curl"
+
+# Vigencia de la validación de una API key; pasado este tiempo se refresca en segundo plano
+API_KEY_VALIDATION_TTL = 300
+# Los fallos transitorios (red, timeout) se recuerdan muy poco tiempo
+API_KEY_TRANSIENT_TTL = 15
+
+# Tipo interno de documento para archivos locales que aún no se han subido a /v1/files
+LOCAL_FILE_DOCUMENT = "local_file"
+
+# Tamaño de bloque para enviar archivos en streaming
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# Frecuencia de los eventos de progreso de una subida
+UPLOAD_PROGRESS_STEP = 1024 * 1024
+
+# Los cuerpos de respuesta se guardan en memoria hasta este tamaño y después
+# en un archivo temporal, para no mantener respuestas enormes en RAM
+RESPONSE_SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+# Tamaño del pool de conexiones keep-alive
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+
+
+class TransportError(Exception):
+    """Error genérico de transporte (la solicitud no obtuvo respuesta HTTP)."""
+
+
+class TransportTimeout(TransportError):
+    """La solicitud superó el tiempo máximo permitido."""
+
+
+class TransportConnectionError(TransportError):
+    """No se pudo establecer la conexión con el servidor."""
+
+
+class HttpResponse:
+    """
+    Respuesta HTTP normalizada, independiente del transporte utilizado.
+
+    El cuerpo puede llegar como texto o en un archivo (``body_file``); en ese
+    caso ``text`` solo se construye si se pide y ``iter_bytes`` lo recorre por
+    bloques sin cargarlo entero.
+    """
+
+    def __init__(self, status_code, text=None, headers=None, body_file=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._text = text
+        self._body_file = body_file
+
+    @property
+    def ok(self):
+        return 200 <= self.status_code < 300
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = b"".join(self.iter_bytes()).decode("utf-8", errors="replace")
+        return self._text
+
+    def iter_bytes(self, chunk_size=RESPONSE_CHUNK_SIZE):
+        if self._body_file is None:
+            data = (self._text or "").encode("utf-8")
+            for start in range(0, len(data), chunk_size):
+                yield data[start : start + chunk_size]
+            return
+
+        self._body_file.seek(0)
+        while True:
+            chunk = self._body_file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        if self._body_file is not None:
+            self._body_file.close()
+
+    def json(self):
+        return json.loads(self.text)
+
+    def error_message(self, prefix):
+        return f"{prefix} (código {self.status_code}): {self.text[:500]}"
+
+
+def api_url(path):
+    """
+    Construye la URL completa de un endpoint de la API de Mistral.
+    """
+    if path.startswith("http"):
+        return path
+    return f"{MISTRAL_API_BASE}/{path.lstrip('/')}"
+
+
+def open_file_buffer(content):
+    """
+    Devuelve ``(buffer, close)`` con una vista sin copia del contenido.
+
+    ``content`` puede ser bytes, un buffer en memoria (``io.BytesIO`` o un
+    archivo subido de Streamlit) o la ruta de un archivo, que se mapea en
+    memoria en lugar de leerse completo.
+    """
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        return memoryview(content), lambda: None
+    if hasattr(content, "getbuffer"):
+        view = content.getbuffer()
+        return view, view.release
+    if isinstance(content, str):
+        with open(content, "rb") as f:
+            if not f.seek(0, 2):
+                return memoryview(b""), lambda: None
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+
+        def close():
+            view.release()
+            mapped.close()
+
+        return view, close
+    raise TypeError(f"Contenido de archivo no soportado: {type(content).__name__}")
+
+
+class Base64Part:
+    """
+    Parte de un cuerpo en streaming que codifica un buffer en base64 bajo
+    demanda: cada lectura codifica solo los bloques de 3 bytes que necesita,
+    sin construir nunca la cadena completa.
+    """
+
+    def __init__(self, view):
+        self._view = view
+        self._len = 4 * ((len(view) + 2) // 3)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(self._len)
+        first_block = start // 4
+        last_block = (stop + 3) // 4
+        encoded = base64.b64encode(self._view[first_block * 3 : last_block * 3])
+        offset = first_block * 4
+        return memoryview(encoded)[start - offset : stop - offset]
+
+    def release(self):
+        pass
+
+
+class StreamBody:
+    """
+    Cuerpo de solicitud formado por partes (vistas de memoria o
+    ``Base64Part``) que se leen por bloques, sin concatenarlas en memoria.
+
+    Si se indica ``progress``, publica eventos ``BYTES_UPLOADED`` a medida que
+    se lee el cuerpo (como mucho cada ``UPLOAD_PROGRESS_STEP`` bytes).
+    """
+
+    content_type = "application/octet-stream"
+
+    def __init__(self, parts, close_buffers=(), progress=NO_PROGRESS):
+        self.upload_id = uuid.uuid4().hex
+        self._parts = parts
+        self._close_buffers = list(close_buffers)
+        self.len = sum(len(part) for part in self._parts)
+        self._position = 0
+        self._progress = progress
+        self._reported = 0
+
+    def __len__(self):
+        return self.len
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self.len
+        self._position = max(0, min(offset, self.len))
+        self._reported = min(self._reported, self._position)
+        return self._position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len - self._position
+        chunks = []
+        start = 0
+        for part in self._parts:
+            end = start + len(part)
+            if size > 0 and self._position < end:
+                offset = self._position - start
+                chunk = part[offset : offset + size]
+                chunks.append(chunk.tobytes())
+                self._position += len(chunk)
+                size -= len(chunk)
+            start = end
+        if self._position - self._reported >= UPLOAD_PROGRESS_STEP or (
+            self._position == self.len and self._reported < self.len
+        ):
+            self._reported = self._position
+            self._progress.emit(
+                BYTES_UPLOADED,
+                upload_id=self.upload_id,
+                sent=self._position,
+                total=self.len,
+            )
+        return b"".join(chunks)
+
+    def __iter__(self):
+        self.seek(0)
+        while True:
+            chunk = self.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    async def aiter_chunks(self):
+        for chunk in self:
+            yield chunk
+
+    def close(self):
+        for part in self._parts:
+            part.release()
+        for close_buffer in self._close_buffers:
+            close_buffer()
+
+
+class MultipartFileStream(StreamBody):
+    """
+    Cuerpo ``multipart/form-data`` que se lee por bloques directamente desde
+    el buffer del archivo, sin construir la solicitud completa en memoria.
+    """
+
+    def __init__(
+        self,
+        fields,
+        filename,
+        content,
+        content_type="application/octet-stream",
+        progress=NO_PROGRESS,
+    ):
+        self.boundary = uuid.uuid4().hex
+        preamble = "".join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'
+            for key, value in fields.items()
+        )
+        preamble += (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        )
+        file_view, close_file = open_file_buffer(content)
+        super().__init__(
+            [
+                memoryview(preamble.encode("utf-8")),
+                file_view,
+                memoryview(f"\r\n--{self.boundary}--\r\n".encode("utf-8")),
+            ],
+            [close_file],
+            progress,
+        )
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+
+class InlineImage:
+    """
+    Imagen local que la API recibe como URI ``data:`` en base64.
+
+    Se guarda con sus bytes y su tipo MIME en lugar de la URI: ``JsonStreamBody``
+    la codifica por bloques al enviar la solicitud, de modo que cada imagen en
+    curso ocupa en memoria poco más que el propio archivo.
+    """
+
+    def __init__(self, content, mime_type):
+        self.content = content
+        self.mime_type = mime_type
+
+    def data_uri(self):
+        return f"data:{self.mime_type};base64," + base64.b64encode(self.content).decode(
+            "ascii"
+        )
+
+    def __repr__(self):
+        return f"<imagen {self.mime_type} de {len(self.content)} bytes>"
+
+
+class JsonStreamBody(StreamBody):
+    """
+    Cuerpo JSON en streaming. Las ``InlineImage`` del payload se envían como
+    URI ``data:`` codificadas en base64 por bloques; el resto del payload se
+    serializa normalmente.
+    """
+
+    content_type = "application/json"
+
+    def __init__(self, payload, progress=NO_PROGRESS):
+        marker = f'"{uuid.uuid4().hex}"'
+        images = []
+
+        def encode_image(value):
+            if isinstance(value, InlineImage):
+                images.append(value)
+                return marker[1:-1]
+            raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+        pieces = json.dumps(payload, ensure_ascii=False, default=encode_image).split(
+            marker
+        )
+        parts = []
+        close_buffers = []
+        for piece, image in zip(pieces, images):
+            parts.append(
+                memoryview(f'{piece}"data:{image.mime_type};base64,'.encode("utf-8"))
+            )
+            image_view, close_image = open_file_buffer(image.content)
+            parts.append(Base64Part(image_view))
+            close_buffers.append(close_image)
+            parts.append(memoryview(b'"'))
+        parts.append(memoryview(pieces[-1].encode("utf-8")))
+        super().__init__(parts, close_buffers, progress)
+
+
+def build_ocr_request(document, image_options=None):
+    """
+    Construye el cuerpo de una solicitud a ``/v1/ocr``.
+
+    Las imágenes incrustadas solo se piden si se indican ``image_options``
+    (``limit``: número máximo por documento, ``min_size``: lado mínimo en
+    píxeles).
+    """
+    payload = {
+        "model": OCR_MODEL,
+        "document": document,
+        "include_image_base64": bool(image_options),
+    }
+    if image_options:
+        if image_options.get("limit"):
+            payload["image_limit"] = image_options["limit"]
+        if image_options.get("min_size"):
+            payload["image_min_size"] = image_options["min_size"]
+    return payload
+
+
+def build_document_understanding_request(document):
+    """
+    Construye el cuerpo de una solicitud Document Understanding a ``/v1/chat/completions``.
+    """
+    doc_url = document.get("document_url", "") or document.get("image_url", "")
+    doc_type = "document_url" if "document_url" in document else "image_url"
+    return {
+        "model": DOCUMENT_UNDERSTANDING_MODEL,  # Modelo avanzado para comprensión de documentos
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Extrae todo el texto de este documento manteniendo su estructura y formato original. Conserva párrafos, listas, tablas y la jerarquía del contenido exactamente como aparece. No añadas interpretaciones ni resúmenes.",
+                    },
+                    {"type": doc_type, doc_type: doc_url},
+                ],
+            }
+        ],
+        "document_image_limit": 10,  # Límites para documentos grandes
+        "document_page_limit": 100,
+    }
+
+
+def _auth_headers(api_key, extra=None):
+    headers = {"Authorization": f"Bearer {api_key}"}
+    if extra:
+        headers.update(extra)
+    return headers
+
+
+class PooledTransport:
+    """
+    Transporte en proceso basado en una ``requests.Session`` con pool keep-alive.
+
+    Los cuerpos se envían directamente desde memoria y el tiempo total de cada
+    solicitud se limita igual que ``--max-time`` de cURL.
+    """
+
+    name = TRANSPORT_POOL
+
+    def __init__(self):
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0
+        )
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def request(
+        self, method, path, api_key, timeout, data=None, files=None, headers=None
+    ):
+        url = api_url(path)
+        deadline = time.monotonic() + timeout
+        try:
+            response = self._session.request(
+                method,
+                url,
+                data=data,
+                files=files,
+                headers=_auth_headers(api_key, headers),
+                timeout=(CONNECT_TIMEOUT, timeout),
+                stream=True,
+            )
+            body = tempfile.SpooledTemporaryFile(max_size=RESPONSE_SPOOL_MAX_MEMORY)
+            try:
+                # Leer el cuerpo respetando el tiempo total, no solo el de cada lectura
+                for chunk in response.iter_content(chunk_size=RESPONSE_CHUNK_SIZE):
+                    body.write(chunk)
+                    if time.monotonic() > deadline:
+                        raise TransportTimeout(
+                            f"Operación abortada tras {timeout} segundos"
+                        )
+            except BaseException:
+                body.close()
+                raise
+            finally:
+                response.close()
+        except requests.exceptions.Timeout as e:
+            raise TransportTimeout(str(e)) from e
+        except requests.exceptions.ConnectionError as e:
+            raise TransportConnectionError(str(e)) from e
+        except requests.exceptions.RequestException as e:
+            raise TransportError(str(e)) from e
+
+        return HttpResponse(
+            response.status_code, headers=dict(response.headers), body_file=body
+        )
+
+    def get(self, path, api_key, timeout, headers=None):
+        return self.request("GET", path, api_key, timeout, headers=headers)
+
+    def post_json(self, path, payload, api_key, timeout, progress=NO_PROGRESS):
+        body = JsonStreamBody(payload, progress=progress)
+        try:
+            return self.request(
+                "POST",
+                path,
+                api_key,
+                timeout,
+                data=body,
+                headers={"Content-Type": body.content_type},
+            )
+        finally:
+            body.close()
+
+    def upload_file(
+        self, path, fields, filename, content, api_key, timeout, progress=NO_PROGRESS
+    ):
+        body = MultipartFileStream(fields, filename, content, progress=progress)
+        try:
+            return self.request(
+                "POST",
+                path,
+                api_key,
+                timeout,
+                data=body,
+                headers={"Content-Type": body.content_type},
+            )
+        finally:
+            body.close()
+
+    def describe(self, method, path):
+        return f"{method} {api_url(path)}  # transporte: pool keep-alive"
+
+
+class CurlTransport:
+    """
+    Transporte de compatibilidad que ejecuta ``curl`` en un subproceso.
+
+    El cuerpo de la solicitud se entrega por stdin y el de la respuesta se
+    escribe en un archivo temporal anónimo que se lee por bloques.
+    """
+
+    name = TRANSPORT_CURL
+
+    # Marcador para separar las cabeceras volcadas del código HTTP
+    _STATUS_MARKER = "\n__HTTP_STATUS__:"
+
+    def _run(self, args, api_key, timeout, stdin=None):
+        command = [
+            "curl",
+            "--silent",
+            "--show-error",
+            "--dump-header",
+            "-",
+            "--connect-timeout",
+            str(CONNECT_TIMEOUT),
+            "--max-time",
+            str(timeout),
+            "--write-out",
+            f"{self._STATUS_MARKER}%{{http_code}}",
+            "-H",
+            f"Authorization: Bearer {api_key}",
+        ] + args
+
+        # El archivo se desvincula en cuanto cURL termina: solo queda el descriptor
+        fd, body_path = tempfile.mkstemp(prefix="mistral_ocr_")
+        body_file = os.fdopen(fd, "w+b")
+        try:
+            result = subprocess.run(
+                command + ["--output", body_path], input=stdin, capture_output=True
+            )
+        except OSError as e:
+            body_file.close()
+            raise TransportError(f"No se pudo ejecutar cURL: {str(e)}") from e
+        finally:
+            os.unlink(body_path)
+
+        try:
+            return self._parse_result(result, body_file)
+        except BaseException:
+            body_file.close()
+            raise
+
+    def _parse_result(self, result, body_file):
+        stdout = result.stdout.decode("utf-8", errors="replace")
+        stderr = result.stderr.decode("utf-8", errors="replace")
+
+        if result.returncode == 28:
+            raise TransportTimeout(stderr.strip() or "Timeout de cURL")
+        if result.returncode in (6, 7):
+            raise TransportConnectionError(stderr.strip() or "Error de conexión")
+        if result.returncode != 0:
+            raise TransportError(
+                f"cURL terminó con código {result.returncode}: {stderr}"
+            )
+
+        header_output, _, status = stdout.rpartition(self._STATUS_MARKER)
+        try:
+            status_code = int(status.strip())
+        except ValueError:
+            raise TransportError(f"Respuesta de cURL sin código HTTP: {stdout[:200]}")
+
+        headers, _ = self._split_headers(header_output)
+        return HttpResponse(status_code, headers=headers, body_file=body_file)
+
+    @staticmethod
+    def _split_headers(output):
+        """
+        Separa las cabeceras volcadas por ``--dump-header -`` del cuerpo.
+
+        Puede haber varios bloques (p. ej. ``100 Continue``); se conserva el último.
+        """
+        headers = {}
+        while output.startswith("HTTP/"):
+            block, separator, rest = output.partition("\r\n\r\n")
+            if not separator:
+                break
+            headers = {}
+            for line in block.split("\r\n")[1:]:
+                key, _, value = line.partition(":")
+                headers[key.strip()] = value.strip()
+            output = rest
+        return headers, output
+
+    def get(self, path, api_key, timeout, headers=None):
+        args = ["-X", "GET", api_url(path)]
+        for key, value in (headers or {}).items():
+            args += ["-H", f"{key}: {value}"]
+        return self._run(args, api_key, timeout)
+
+    def post_json(self, path, payload, api_key, timeout, progress=NO_PROGRESS):
+        # subprocess necesita el cuerpo completo: en el modo de compatibilidad
+        # se materializa una vez
+        stream = JsonStreamBody(payload, progress=progress)
+        try:
+            body = b"".join(stream)
+        finally:
+            stream.close()
+        args = [
+            api_url(path),
+            "-H",
+            "Content-Type: application/json",
+            "--data-binary",
+            "@-",
+        ]
+        return self._run(args, api_key, timeout, stdin=body)
+
+    def upload_file(
+        self, path, fields, filename, content, api_key, timeout, progress=NO_PROGRESS
+    ):
+        args = [api_url(path)]
+        for key, value in fields.items():
+            args += ["-F", f"{key}={value}"]
+        if isinstance(content, str):
+            # Ruta local: cURL lee el archivo directamente
+            args += ["-F", f"file=@{content};filename={filename}"]
+            response = self._run(args, api_key, timeout)
+            size = os.path.getsize(content)
+        else:
+            args += ["-F", f"file=@-;filename={filename}"]
+            file_view, close_file = open_file_buffer(content)
+            try:
+                response = self._run(args, api_key, timeout, stdin=file_view)
+                size = len(file_view)
+            finally:
+                close_file()
+
+        # cURL no informa del avance: se publica la subida completa al terminar
+        progress.emit(BYTES_UPLOADED, upload_id=uuid.uuid4().hex, sent=size, total=size)
+        return response
+
+    def describe(self, method, path):
+        return f"curl -X {method} {api_url(path)} -H 'Authorization: Bearer ****'"
+
+
+class RetryingTransport:
+    """
+    Envoltorio que aplica la política de reintentos y el limitador de tasa
+    compartidos a cualquier transporte.
+    """
+
+    def __init__(self, transport, policy=DEFAULT_RETRY_POLICY):
+        self._transport = transport
+        self.policy = policy
+        self.name = transport.name
+
+    def _call(self, api_key, send, idempotent, progress=NO_PROGRESS):
+        limiter = get_rate_limiter(api_key)
+        attempt = 0
+
+        while True:
+            attempt += 1
+            limiter.acquire()
+            try:
+                response = send()
+            except TransportError as e:
+                if self.policy.should_retry(
+                    attempt
+                ) and self.policy.is_retryable_exception(e, idempotent):
+                    delay = self.policy.backoff(attempt)
+                    logger.warning(
+                        f"Error de transporte ({str(e)}), reintento {attempt}/{self.policy.max_attempts - 1} en {delay:.1f}s"
+                    )
+                    progress.emit(RETRY, attempt=attempt, delay=delay, reason=str(e))
+                    time.sleep(delay)
+                    continue
+                raise
+
+            retry_after = parse_retry_after(response.headers)
+            if response.status_code == 429:
+                limiter.on_throttle(retry_after)
+            elif response.ok:
+                limiter.on_success()
+
+            if self.policy.should_retry(attempt) and self.policy.is_retryable_status(
+                response.status_code
+            ):
+                delay = self.policy.backoff(attempt, retry_after)
+                logger.warning(
+                    f"Respuesta {response.status_code}, reintento {attempt}/{self.policy.max_attempts - 1} en {delay:.1f}s"
+                )
+                progress.emit(
+                    RETRY,
+                    attempt=attempt,
+                    delay=delay,
+                    reason=f"HTTP {response.status_code}",
+                )
+                response.close()
+                time.sleep(delay)
+                continue
+
+            return response
+
+    def get(self, path, api_key, timeout, headers=None, progress=NO_PROGRESS):
+        return self._call(
+            api_key,
+            lambda: self._transport.get(path, api_key, timeout, headers=headers),
+            idempotent=True,
+            progress=progress,
+        )
+
+    def post_json(self, path, payload, api_key, timeout, progress=NO_PROGRESS):
+        return self._call(
+            api_key,
+            lambda: self._transport.post_json(
+                path, payload, api_key, timeout, progress=progress
+            ),
+            idempotent=False,
+            progress=progress,
+        )
+
+    def upload_file(
+        self, path, fields, filename, content, api_key, timeout, progress=NO_PROGRESS
+    ):
+        return self._call(
+            api_key,
+            lambda: self._transport.upload_file(
+                path, fields, filename, content, api_key, timeout, progress=progress
+            ),
+            idempotent=False,
+            progress=progress,
+        )
+
+    def describe(self, method, path):
+        return self._transport.describe(method, path)
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(mode=TRANSPORT_POOL):
+    """
+    Devuelve la instancia compartida del transporte solicitado.
+
+    Las instancias viven a nivel de proceso, por lo que el pool de conexiones
+    se comparte entre documentos, sesiones y reruns. Todas aplican la política
+    de reintentos y el limitador de tasa compartidos.
+    """
+    if mode != TRANSPORT_CURL:
+        mode = TRANSPORT_POOL
+
+    with _transports_lock:
+        if mode not in _transports:
+            if mode == TRANSPORT_CURL:
+                _transports[mode] = RetryingTransport(CurlTransport())
+            else:
+                _transports[mode] = RetryingTransport(PooledTransport())
+                logger.info("Pool de conexiones HTTP inicializado")
+        return _transports[mode]
+
+
+def _check_api_key(api_key, transport):
+    """
+    Consulta ``/v1/models`` y devuelve ``(válida, mensaje, definitivo)``.
+
+    ``definitivo`` es False cuando el resultado se debe a un problema de red y
+    no a la propia clave.
+    """
+    try:
+        # Intentar una solicitud simple para verificar la clave con timeout para evitar bloqueos
+        response = transport.get("models", api_key, timeout=10)
+        # Solo interesa el código de estado
+        response.close()
+
+        if response.status_code == 200:
+            return True, "API key válida", True
+        elif response.status_code == 401:
+            return False, "API key no válida o expirada", True
+        else:
+            return (
+                False,
+                f"Error verificando API key: código {response.status_code}",
+                False,
+            )
+    except TransportConnectionError:
+        return (
+            False,
+            "Error de conexión al verificar la API key. Comprueba tu conexión a internet.",
+            False,
+        )
+    except TransportTimeout:
+        return (
+            False,
+            "Timeout al verificar la API key. El servidor está tardando demasiado en responder.",
+            False,
+        )
+    except Exception as e:
+        logger.error(f"Error inesperado al validar API key: {str(e)}")
+        return False, f"Error al validar API key: {str(e)}", False
+
+
+# Resultados de validación compartidos por todas las sesiones, indexados por hash de la clave
+_key_validations = {}
+_key_validations_lock = threading.Lock()
+
+
+def _store_key_validation(key_hash, result):
+    valid, message, definitive = result
+    with _key_validations_lock:
+        _key_validations[key_hash] = {
+            "result": (valid, message),
+            "checked_at": time.monotonic(),
+            "ttl": API_KEY_VALIDATION_TTL if definitive else API_KEY_TRANSIENT_TTL,
+            "definitive": definitive,
+            "refreshing": False,
+        }
+
+
+def _refresh_key_validation(api_key, key_hash, transport):
+    try:
+        result = _check_api_key(api_key, transport)
+        if result[2]:
+            _store_key_validation(key_hash, result)
+    finally:
+        with _key_validations_lock:
+            entry = _key_validations.get(key_hash)
+            if entry:
+                entry["refreshing"] = False
+
+
+def validate_api_key(api_key, transport=None, force=False):
+    """
+    Verifica la validez de la API key.
+
+    El resultado se cachea a nivel de proceso durante ``API_KEY_VALIDATION_TTL``
+    segundos. Una vez vencido se sigue devolviendo el último resultado
+    definitivo mientras se refresca en segundo plano; ``force`` obliga a
+    repetir la comprobación de inmediato.
+    """
+    if not api_key:
+        return False, "No se ha proporcionado API key"
+
+    transport = transport or get_transport()
+    key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    if not force:
+        with _key_validations_lock:
+            entry = _key_validations.get(key_hash)
+            if entry:
+                age = time.monotonic() - entry["checked_at"]
+                if age < entry["ttl"]:
+                    return entry["result"]
+                if entry["definitive"]:
+                    # Servir el resultado anterior y refrescarlo sin bloquear el rerun
+                    if not entry["refreshing"]:
+                        entry["refreshing"] = True
+                        threading.Thread(
+                            target=_refresh_key_validation,
+                            args=(api_key, key_hash, transport),
+                            name="api-key-refresh",
+                            daemon=True,
+                        ).start()
+                    return entry["result"]
+
+    result = _check_api_key(api_key, transport)
+    _store_key_validation(key_hash, result)
+    return result[0], result[1]
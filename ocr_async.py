@@ -0,0 +1,667 @@
+"""
+Motor OCR asíncrono para lotes de documentos.
+
+Ejecuta subidas, obtención de URLs firmadas y llamadas OCR de todo un lote en
+un único bucle de eventos, con límites de concurrencia independientes por
+etapa (subida, OCR y Document Understanding). Replica el comportamiento de
+``process_image_with_rest``, ``process_ocr_with_curl`` y
+``process_with_document_understanding`` sin depender de Streamlit.
+"""
+
+import asyncio
+import json
+import logging
+import tempfile
+import traceback
+
+import httpx
+
+from mistral_client import (
+    CONNECT_TIMEOUT,
+    LOCAL_FILE_DOCUMENT,
+    OCR_MODEL,
+    RESPONSE_CHUNK_SIZE,
+    RESPONSE_SPOOL_MAX_MEMORY,
+    HttpResponse,
+    InlineImage,
+    JsonStreamBody,
+    MultipartFileStream,
+    TransportConnectionError,
+    TransportError,
+    TransportTimeout,
+    api_url,
+    build_document_understanding_request,
+    build_ocr_request,
+)
+from ocr_cache import SIGNED_URL_EXPIRY_HOURS, get_upload_registry
+from ocr_responses import extract_text_from_ocr_response, parse_ocr_response_stream
+from pdf_tools import describe_chunk, merge_chunk_images, merge_chunk_pages, split_pdf
+from progress import FALLBACK, FILE_UPLOADED, NO_PROGRESS, RETRY, STATE_ERROR
+from retry_policy import DEFAULT_RETRY_POLICY, get_rate_limiter, parse_retry_after
+
+logger = logging.getLogger("MistralOCR")
+
+STAGE_UPLOAD = "upload"
+STAGE_OCR = "ocr"
+STAGE_DOCUMENT_UNDERSTANDING = "document_understanding"
+# Etapa de progreso (sin límite propio) de un PDF procesado por fragmentos
+STAGE_PDF_CHUNKS = "pdf_chunks"
+
+# Solicitudes simultáneas permitidas por etapa
+DEFAULT_STAGE_LIMITS = {
+    STAGE_UPLOAD: 4,
+    STAGE_OCR: 8,
+    STAGE_DOCUMENT_UNDERSTANDING: 2,
+}
+
+# Rutas de procesamiento de un trabajo
+ROUTE_IMAGE_REST = "image_rest"
+ROUTE_OCR = "ocr"
+ROUTE_DOCUMENT_UNDERSTANDING = "document_understanding"
+
+
+class AsyncOCREngine:
+    """
+    Cliente asíncrono de la API de Mistral con semáforos por etapa.
+
+    Debe usarse como gestor de contexto asíncrono para abrir y cerrar el
+    cliente HTTP compartido por todo el lote.
+    """
+
+    def __init__(self, api_key, stage_limits=None, retry_policy=DEFAULT_RETRY_POLICY):
+        self.api_key = api_key
+        self.retry_policy = retry_policy
+        self.stage_limits = dict(DEFAULT_STAGE_LIMITS)
+        self.stage_limits.update(stage_limits or {})
+        self._semaphores = {}
+        self._client = None
+
+    async def __aenter__(self):
+        self._semaphores = {
+            stage: asyncio.Semaphore(max(1, limit))
+            for stage, limit in self.stage_limits.items()
+        }
+        max_connections = sum(self.stage_limits.values())
+        self._client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=httpx.Timeout(None, connect=CONNECT_TIMEOUT),
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._client.aclose()
+        self._client = None
+
+    async def _fetch(self, method, path, **kwargs):
+        # El cuerpo se vuelca a un archivo temporal en memoria/disco igual que
+        # en el transporte síncrono, sin acumular la respuesta completa
+        body = tempfile.SpooledTemporaryFile(max_size=RESPONSE_SPOOL_MAX_MEMORY)
+        try:
+            async with self._client.stream(method, api_url(path), **kwargs) as response:
+                async for chunk in response.aiter_bytes(RESPONSE_CHUNK_SIZE):
+                    body.write(chunk)
+        except BaseException:
+            body.close()
+            raise
+        return HttpResponse(
+            response.status_code, headers=dict(response.headers), body_file=body
+        )
+
+    async def _send(self, method, path, timeout, **kwargs):
+        try:
+            # El tiempo total de la solicitud equivale a --max-time de cURL
+            return await asyncio.wait_for(self._fetch(method, path, **kwargs), timeout)
+        except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+            raise TransportTimeout(f"Operación abortada tras {timeout} segundos") from e
+        except httpx.ConnectError as e:
+            raise TransportConnectionError(str(e)) from e
+        except httpx.HTTPError as e:
+            raise TransportError(str(e)) from e
+
+    async def _request(
+        self,
+        stage,
+        method,
+        path,
+        timeout,
+        content_factory=None,
+        progress=NO_PROGRESS,
+        **kwargs,
+    ):
+        """
+        Envía una solicitud respetando el semáforo de la etapa, el limitador de
+        tasa compartido y la política de reintentos.
+
+        ``content_factory`` crea el cuerpo en streaming de cada intento, y los
+        reintentos se publican en ``progress``. Un cuerpo ``json`` también se
+        envía en streaming (``JsonStreamBody``), con sus imágenes codificadas
+        en base64 por bloques.
+        """
+        if "json" in kwargs:
+            body = JsonStreamBody(kwargs.pop("json"), progress=progress)
+            try:
+                return await self._request(
+                    stage,
+                    method,
+                    path,
+                    timeout,
+                    content_factory=body.aiter_chunks,
+                    progress=progress,
+                    headers={
+                        **(kwargs.pop("headers", None) or {}),
+                        "Content-Type": body.content_type,
+                        "Content-Length": str(len(body)),
+                    },
+                    **kwargs,
+                )
+            finally:
+                body.close()
+
+        limiter = get_rate_limiter(self.api_key)
+        attempt = 0
+
+        while True:
+            attempt += 1
+            try:
+                if content_factory is not None:
+                    kwargs["content"] = content_factory()
+                async with self._semaphores[stage]:
+                    # El token se reserva ya dentro de la etapa: reservado antes
+                    # se gastaría esperando al semáforo y las solicitudes
+                    # saldrían en ráfaga al liberarse la etapa
+                    await limiter.acquire_async()
+                    response = await self._send(method, path, timeout, **kwargs)
+            except TransportError as e:
+                if self.retry_policy.should_retry(
+                    attempt
+                ) and self.retry_policy.is_retryable_exception(e, method == "GET"):
+                    delay = self.retry_policy.backoff(attempt)
+                    logger.warning(
+                        f"Error de transporte ({str(e)}), reintento {attempt}/{self.retry_policy.max_attempts - 1} en {delay:.1f}s"
+                    )
+                    progress.emit(RETRY, attempt=attempt, delay=delay, reason=str(e))
+                    await asyncio.sleep(delay)
+                    continue
+                raise
+
+            retry_after = parse_retry_after(response.headers)
+            if response.status_code == 429:
+                limiter.on_throttle(retry_after)
+            elif response.ok:
+                limiter.on_success()
+
+            if self.retry_policy.should_retry(
+                attempt
+            ) and self.retry_policy.is_retryable_status(response.status_code):
+                # La espera se hace fuera del semáforo para no bloquear la etapa
+                delay = self.retry_policy.backoff(attempt, retry_after)
+                logger.warning(
+                    f"Respuesta {response.status_code}, reintento {attempt}/{self.retry_policy.max_attempts - 1} en {delay:.1f}s"
+                )
+                progress.emit(
+                    RETRY,
+                    attempt=attempt,
+                    delay=delay,
+                    reason=f"HTTP {response.status_code}",
+                )
+                response.close()
+                await asyncio.sleep(delay)
+                continue
+
+            return response
+
+    @staticmethod
+    async def _in_stage(progress, stage, label, operation):
+        """
+        Ejecuta ``operation(stage_progress)`` dentro de una etapa de progreso
+        y la marca como fallida si devuelve un error.
+        """
+        with progress.stage(stage, label) as status:
+            result = await operation(status.progress)
+            if "error" in result:
+                status.update(label=f"Error: {result['error']}", state=STATE_ERROR)
+            return result
+
+    async def _request_signed_url(self, file_id, progress=NO_PROGRESS):
+        url_response = await self._request(
+            STAGE_UPLOAD,
+            "GET",
+            f"files/{file_id}/url?expiry={SIGNED_URL_EXPIRY_HOURS}",
+            timeout=60,
+            progress=progress,
+            headers={"Accept": "application/json"},
+        )
+        try:
+            if not url_response.ok:
+                return {
+                    "error": url_response.error_message("Error al obtener URL firmada")
+                }
+            signed_url = url_response.json().get("url")
+        finally:
+            url_response.close()
+        if not signed_url:
+            return {"error": "No se pudo obtener la URL firmada"}
+        return {"url": signed_url}
+
+    async def upload_document(self, document, progress=NO_PROGRESS):
+        """
+        Sube un documento local a ``/v1/files`` en streaming y devuelve el
+        documento con la URL firmada.
+
+        Igual que ``upload_local_document``, reutiliza el ``file_id`` y la URL
+        firmada registrados para el mismo contenido mientras sigan vigentes.
+        """
+        return await self._in_stage(
+            progress,
+            STAGE_UPLOAD,
+            "Subiendo documento...",
+            lambda stage_progress: self._upload_document(document, stage_progress),
+        )
+
+    async def _upload_document(self, document, progress):
+        registry = get_upload_registry()
+        content_hash = document.get("content_hash")
+        registered = registry.get(self.api_key, content_hash) if content_hash else None
+
+        if registered and not registry.needs_refresh(registered):
+            logger.info(f"Reutilizando archivo subido. ID: {registered['file_id']}")
+            progress.emit(FILE_UPLOADED, file_id=registered["file_id"])
+            return {
+                "document": {
+                    "type": "document_url",
+                    "document_url": registered["signed_url"],
+                }
+            }
+
+        if registered:
+            # El archivo sigue en el servidor: basta con renovar la firma
+            signed = await self._request_signed_url(registered["file_id"], progress)
+            if "url" in signed:
+                registry.put(
+                    self.api_key, content_hash, registered["file_id"], signed["url"]
+                )
+                progress.emit(FILE_UPLOADED, file_id=registered["file_id"])
+                return {
+                    "document": {"type": "document_url", "document_url": signed["url"]}
+                }
+            registry.forget(self.api_key, content_hash)
+
+        body = MultipartFileStream(
+            {"purpose": "ocr"},
+            document.get("file_name") or "temp_document.pdf",
+            document["content"],
+            progress=progress,
+        )
+        try:
+            upload_response = await self._request(
+                STAGE_UPLOAD,
+                "POST",
+                "files",
+                timeout=120,
+                # Un iterador nuevo por intento para poder reintentar la subida
+                content_factory=body.aiter_chunks,
+                progress=progress,
+                headers={
+                    "Content-Type": body.content_type,
+                    "Content-Length": str(len(body)),
+                },
+            )
+        finally:
+            body.close()
+        try:
+            if not upload_response.ok:
+                return {
+                    "error": upload_response.error_message("Error al subir archivo")
+                }
+            file_id = upload_response.json().get("id")
+        finally:
+            upload_response.close()
+        if not file_id:
+            return {"error": "No se pudo obtener el ID del archivo subido"}
+        logger.info(f"Archivo subido exitosamente. ID: {file_id}")
+        progress.emit(FILE_UPLOADED, file_id=file_id)
+
+        signed = await self._request_signed_url(file_id, progress)
+        if "error" in signed:
+            return signed
+
+        if content_hash:
+            registry.put(self.api_key, content_hash, file_id, signed["url"])
+        return {"document": {"type": "document_url", "document_url": signed["url"]}}
+
+    async def ocr_image(self, image, progress=NO_PROGRESS):
+        """
+        Equivalente asíncrono de ``process_image_with_rest`` para una
+        ``InlineImage``.
+        """
+        return await self._in_stage(
+            progress,
+            STAGE_OCR,
+            "Procesando imagen...",
+            lambda stage_progress: self._ocr_image(image, stage_progress),
+        )
+
+    async def _ocr_image(self, image, progress):
+        payload = {
+            "model": OCR_MODEL,
+            "document": {"type": "image_url", "image_url": image},
+        }
+
+        response = await self._request(
+            STAGE_OCR, "POST", "ocr", timeout=60, json=payload, progress=progress
+        )
+        try:
+            if not response.ok:
+                error_message = (
+                    f"Error en API OCR (código {response.status_code}): {response.text}"
+                )
+                logger.error(error_message)
+                return {"error": error_message}
+
+            return extract_text_from_ocr_response(response.json())
+        finally:
+            response.close()
+
+    async def ocr_document(
+        self, document, method="Auto", image_options=None, progress=NO_PROGRESS
+    ):
+        """
+        Equivalente asíncrono de ``process_ocr_with_curl``.
+        """
+        return await self._in_stage(
+            progress,
+            STAGE_OCR,
+            "Procesando documento con OCR...",
+            lambda stage_progress: self._ocr_document(
+                document, method, image_options, stage_progress
+            ),
+        )
+
+    async def _ocr_document(self, document, method, image_options, progress):
+        if document.get("type") == LOCAL_FILE_DOCUMENT:
+            uploaded = await self.upload_document(document, progress)
+            if "error" in uploaded:
+                return uploaded
+            document = uploaded["document"]
+
+        elif isinstance(document.get("image_url"), InlineImage):
+            return await self.ocr_image(document["image_url"], progress)
+
+        response = await self._request(
+            STAGE_OCR,
+            "POST",
+            "ocr",
+            timeout=180,
+            json=build_ocr_request(document, image_options),
+            progress=progress,
+        )
+        try:
+            if not response.ok:
+                error_details = {
+                    "error": f"Error en OCR (código {response.status_code})",
+                    "stdout": response.text[:1000],
+                }
+                logger.error(
+                    f"Error durante la solicitud OCR: {error_details['error']}"
+                )
+                return {"error": json.dumps(error_details)}
+
+            # Recorrer las páginas (y guardar sus imágenes) fuera del bucle de eventos
+            result = await asyncio.to_thread(
+                parse_ocr_response_stream, response, image_options
+            )
+        finally:
+            response.close()
+
+        # Intentar método alternativo si la API respondió con error
+        if result.pop("needs_fallback", False):
+            if "document understanding" not in method.lower():
+                logger.info("Intentando procesar con el método Document Understanding")
+                progress.emit(
+                    FALLBACK,
+                    from_method=method,
+                    to_method="Document Understanding",
+                    reason="La API OCR no devolvió páginas",
+                )
+                return await self.document_understanding(document, progress)
+        result.pop("raw_response", None)
+        return result
+
+    async def document_understanding(self, document, progress=NO_PROGRESS):
+        """
+        Equivalente asíncrono de ``process_with_document_understanding``.
+        """
+        return await self._in_stage(
+            progress,
+            STAGE_DOCUMENT_UNDERSTANDING,
+            "Procesando con Document Understanding...",
+            lambda stage_progress: self._document_understanding(
+                document, stage_progress
+            ),
+        )
+
+    async def _document_understanding(self, document, progress):
+        if document.get("type") == LOCAL_FILE_DOCUMENT:
+            uploaded = await self.upload_document(document, progress)
+            if "error" in uploaded:
+                return uploaded
+            document = uploaded["document"]
+
+        if not (document.get("document_url") or document.get("image_url")):
+            return {
+                "error": "No se pudo extraer URL del documento para el método alternativo"
+            }
+
+        response = await self._request(
+            STAGE_DOCUMENT_UNDERSTANDING,
+            "POST",
+            "chat/completions",
+            timeout=300,
+            json=build_document_understanding_request(document),
+            progress=progress,
+        )
+        try:
+            if not response.ok:
+                return {
+                    "error": response.error_message("Error en Document Understanding")
+                }
+            result_json = response.json()
+        finally:
+            response.close()
+        if "choices" in result_json and len(result_json["choices"]) > 0:
+            content = result_json["choices"][0]["message"]["content"]
+            return {"pages": [{"markdown": content}]}
+        return {"error": "Respuesta no válida de Document Understanding"}
+
+    async def ocr_pdf_chunk(self, chunk, image_options=None, progress=NO_PROGRESS):
+        """
+        Sube y procesa con OCR un fragmento de PDF.
+        """
+        document = {
+            "type": LOCAL_FILE_DOCUMENT,
+            "file_name": f"fragmento_{describe_chunk(chunk)}.pdf",
+            "content": chunk["content"],
+            "content_hash": chunk["content_hash"],
+        }
+        try:
+            uploaded = await self.upload_document(document, progress)
+            if "error" in uploaded:
+                return uploaded
+
+            response = await self._request(
+                STAGE_OCR,
+                "POST",
+                "ocr",
+                timeout=180,
+                json=build_ocr_request(uploaded["document"], image_options),
+                progress=progress,
+            )
+            try:
+                if not response.ok:
+                    return {"error": response.error_message("Error en OCR")}
+                parsed = await asyncio.to_thread(
+                    parse_ocr_response_stream, response, image_options
+                )
+            finally:
+                response.close()
+
+            if "error" in parsed:
+                return parsed
+            if not parsed.get("pages") or "raw_response" in parsed:
+                return {"error": "Estructura de respuesta inesperada"}
+            return {"pages": parsed["pages"], "images": parsed.get("images", [])}
+
+        except (TransportError, ValueError) as e:
+            return {"error": str(e)}
+
+    async def ocr_pdf_in_chunks(
+        self,
+        document,
+        pages_per_chunk,
+        max_rounds=3,
+        image_options=None,
+        progress=NO_PROGRESS,
+    ):
+        """
+        Equivalente asíncrono de ``process_pdf_in_chunks``: los fragmentos
+        compiten por los mismos límites de etapa que el resto del lote.
+        """
+        return await self._in_stage(
+            progress,
+            STAGE_PDF_CHUNKS,
+            "Procesando PDF por fragmentos...",
+            lambda stage_progress: self._ocr_pdf_in_chunks(
+                document, pages_per_chunk, max_rounds, image_options, stage_progress
+            ),
+        )
+
+    async def _ocr_pdf_in_chunks(
+        self, document, pages_per_chunk, max_rounds, image_options, progress
+    ):
+        chunks = await asyncio.to_thread(
+            split_pdf, document["content"], pages_per_chunk
+        )
+        chunk_responses = [None] * len(chunks)
+        pending = list(range(len(chunks)))
+        errors = {}
+
+        for round_number in range(1, max_rounds + 1):
+            responses = await asyncio.gather(
+                *(
+                    self.ocr_pdf_chunk(
+                        chunks[i],
+                        image_options,
+                        progress.bind(chunk=describe_chunk(chunks[i])),
+                    )
+                    for i in pending
+                )
+            )
+            for i, response in zip(pending, responses):
+                if "error" in response:
+                    errors[i] = response["error"]
+                    logger.warning(
+                        f"Fragmento {describe_chunk(chunks[i])} fallido (ronda {round_number}): {response['error']}"
+                    )
+                else:
+                    chunk_responses[i] = response
+
+            pending = [i for i in pending if chunk_responses[i] is None]
+            if not pending:
+                break
+
+        if pending:
+            failed_ranges = ", ".join(describe_chunk(chunks[i]) for i in pending)
+            return {
+                "error": f"Fallaron los fragmentos con páginas {failed_ranges}: {errors[pending[0]]}"
+            }
+        return {
+            "pages": merge_chunk_pages(chunks, chunk_responses),
+            "images": merge_chunk_images(chunks, chunk_responses),
+        }
+
+    async def process(self, job):
+        """
+        Procesa un trabajo ``{"route", "document", "file_bytes", "method"}``.
+        Si incluye ``split_pages``, el PDF se procesa por fragmentos, con
+        ``image_options`` se extraen las imágenes incrustadas y con
+        ``progress`` se publica su avance.
+
+        Siempre devuelve un diccionario con ``pages`` o ``error``.
+        """
+        progress = job.get("progress") or NO_PROGRESS
+        try:
+            route = job["route"]
+            if route == ROUTE_IMAGE_REST:
+                response = await self.ocr_image(job["document"]["image_url"], progress)
+                if "text" in response:
+                    response = {"pages": [{"markdown": response["text"]}]}
+                return response
+            if route == ROUTE_DOCUMENT_UNDERSTANDING:
+                return await self.document_understanding(job["document"], progress)
+            if job.get("split_pages"):
+                return await self.ocr_pdf_in_chunks(
+                    job["document"],
+                    job["split_pages"],
+                    image_options=job.get("image_options"),
+                    progress=progress,
+                )
+            return await self.ocr_document(
+                job["document"],
+                job.get("method", "Auto"),
+                job.get("image_options"),
+                progress,
+            )
+
+        except TransportTimeout as e:
+            error_msg = f"Timeout durante el procesamiento OCR: {str(e)}"
+            logger.error(error_msg)
+            return {"error": error_msg}
+        except TransportError as e:
+            error_msg = f"Error de transporte durante el procesamiento OCR: {str(e)}"
+            logger.error(error_msg)
+            return {"error": error_msg}
+        except Exception as e:
+            error_msg = f"Error durante el procesamiento OCR: {str(e)}"
+            logger.error(f"{error_msg}\n{traceback.format_exc()}")
+            return {"error": error_msg}
+
+    async def run_batch(self, jobs, on_complete=None):
+        """
+        Procesa todos los trabajos de forma concurrente.
+
+        Devuelve las respuestas en el orden de ``jobs`` e invoca
+        ``on_complete(completed, idx, response)`` a medida que terminan.
+        """
+
+        async def run_indexed(idx, job):
+            return idx, await self.process(job)
+
+        results = [None] * len(jobs)
+        tasks = [
+            asyncio.create_task(run_indexed(idx, job)) for idx, job in enumerate(jobs)
+        ]
+
+        for completed, task in enumerate(asyncio.as_completed(tasks), start=1):
+            idx, response = await task
+            results[idx] = response
+            if on_complete:
+                on_complete(completed, idx, response)
+
+        return results
+
+
+def run_ocr_batch(api_key, jobs, stage_limits=None, on_complete=None):
+    """
+    Ejecuta un lote completo en un bucle de eventos propio y devuelve las
+    respuestas en el orden de entrada.
+    """
+
+    async def runner():
+        async with AsyncOCREngine(api_key, stage_limits) as engine:
+            return await engine.run_batch(jobs, on_complete)
+
+    return asyncio.run(runner())
@@ -0,0 +1,296 @@
+"""
+Caché persistente de resultados OCR direccionada por contenido.
+
+Las entradas se indexan por el hash de los bytes del archivo junto con el
+modelo, el método de procesamiento y las opciones relevantes. Las respuestas
+se guardan comprimidas en disco y un índice SQLite lleva el tamaño y el último
+acceso de cada entrada para aplicar expulsión LRU dentro de un presupuesto de
+bytes.
+
+Incluye también el registro de archivos subidos a ``/v1/files``, que permite
+reutilizar ``file_id`` y URLs firmadas mientras no caduquen.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("MistralOCR")
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "MISTRAL_OCR_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "mistral_ocr"),
+)
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+
+def hash_bytes(data):
+    """
+    Hash SHA-256 en hexadecimal de un bloque de bytes.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def build_cache_key(content_hash, model, method, **options):
+    """
+    Construye la clave de caché a partir del contenido y la configuración.
+    """
+    key_data = {
+        "content": content_hash,
+        "model": model,
+        "method": method,
+        "options": options,
+    }
+    return hash_bytes(json.dumps(key_data, sort_keys=True).encode("utf-8"))
+
+
+class OCRResultCache:
+    """
+    Caché en disco con expulsión LRU limitada por bytes, segura entre hilos.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(directory, "results"), exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(directory, "index.sqlite3"), check_same_thread=False
+        )
+        with self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+
+    def _path(self, key):
+        return os.path.join(self.directory, "results", f"{key}.json.gz")
+
+    def get(self, key):
+        """
+        Devuelve la respuesta OCR cacheada o None, actualizando el último acceso.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            try:
+                with gzip.open(self._path(key), "rt", encoding="utf-8") as f:
+                    response = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Entrada de caché corrupta {key}: {str(e)}")
+                self._delete(key)
+                self.misses += 1
+                return None
+
+            with self._db:
+                self._db.execute(
+                    "UPDATE entries SET last_access = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+            self.hits += 1
+            return response
+
+    def put(self, key, response):
+        """
+        Guarda una respuesta OCR y expulsa las entradas menos usadas si hace falta.
+        """
+        data = gzip.compress(json.dumps(response, ensure_ascii=False).encode("utf-8"))
+        if len(data) > self.max_bytes:
+            logger.info(f"Respuesta demasiado grande para la caché: {len(data)} bytes")
+            return
+
+        with self._lock:
+            tmp_path = f"{self._path(key)}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+                    (key, len(data), time.time()),
+                )
+            self._evict()
+
+    def _delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+        with self._db:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self):
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+
+        rows = self._db.execute(
+            "SELECT key, size FROM entries ORDER BY last_access ASC"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._delete(key)
+            total -= size
+            logger.debug(f"Entrada de caché expulsada: {key}")
+
+    def _total_bytes(self):
+        return self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            for (key,) in self._db.execute("SELECT key FROM entries").fetchall():
+                self._delete(key)
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries,
+                "bytes": self._total_bytes(),
+                "max_bytes": self.max_bytes,
+            }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Devuelve la caché de resultados compartida por todo el proceso.
+    """
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = OCRResultCache()
+        return _result_cache
+
+
+# Vigencia solicitada para las URLs firmadas de /v1/files (en horas)
+SIGNED_URL_EXPIRY_HOURS = 24
+# Margen con el que se renueva una URL firmada antes de que caduque
+SIGNED_URL_REFRESH_MARGIN = 15 * 60
+
+
+class UploadRegistry:
+    """
+    Registro persistente de archivos ya subidos a ``/v1/files``.
+
+    Relaciona el hash del contenido (por cuenta) con su ``file_id`` y la URL
+    firmada vigente, para evitar repetir la subida y la firma mientras la URL
+    no esté a punto de caducar.
+    """
+
+    def __init__(
+        self,
+        directory=DEFAULT_CACHE_DIR,
+        refresh_margin=SIGNED_URL_REFRESH_MARGIN,
+    ):
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(directory, "uploads.sqlite3"), check_same_thread=False
+        )
+        with self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS uploads (
+                    account TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    signed_url TEXT,
+                    expires_at REAL,
+                    PRIMARY KEY (account, content_hash)
+                )
+                """
+            )
+
+    @staticmethod
+    def _account(api_key):
+        # Los file_id pertenecen a la cuenta, nunca se guarda la clave en claro
+        return hash_bytes(api_key.encode("utf-8"))
+
+    def get(self, api_key, content_hash):
+        """
+        Devuelve ``{"file_id", "signed_url", "expires_at"}`` o None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT file_id, signed_url, expires_at FROM uploads WHERE account = ? AND content_hash = ?",
+                (self._account(api_key), content_hash),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"file_id": row[0], "signed_url": row[1], "expires_at": row[2]}
+
+    def needs_refresh(self, entry):
+        """
+        Indica si la URL firmada de una entrada falta o caduca pronto.
+        """
+        return (
+            not entry.get("signed_url")
+            or not entry.get("expires_at")
+            or entry["expires_at"] - time.time() < self.refresh_margin
+        )
+
+    def put(self, api_key, content_hash, file_id, signed_url, expires_at=None):
+        if expires_at is None:
+            expires_at = time.time() + SIGNED_URL_EXPIRY_HOURS * 3600
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO uploads (account, content_hash, file_id, signed_url, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (self._account(api_key), content_hash, file_id, signed_url, expires_at),
+            )
+
+    def forget(self, api_key, content_hash):
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM uploads WHERE account = ? AND content_hash = ?",
+                (self._account(api_key), content_hash),
+            )
+
+
+_upload_registry = None
+_upload_registry_lock = threading.Lock()
+
+
+def get_upload_registry():
+    """
+    Devuelve el registro de subidas compartido por todo el proceso.
+    """
+    global _upload_registry
+    with _upload_registry_lock:
+        if _upload_registry is None:
+            _upload_registry = UploadRegistry()
+        return _upload_registry
@@ -0,0 +1,355 @@
+"""
+Procesamiento OCR por lotes desde la línea de comandos, sin Streamlit.
+
+Procesa directorios o listas de PDFs e imágenes con el motor asíncrono y
+escribe los resultados en un directorio de salida. Los documentos cuyo
+resultado ya existe se omiten, de modo que un trabajo interrumpido se puede
+relanzar con los mismos argumentos.
+
+Ejemplos::
+
+    python ocr_cli.py facturas/ -o resultados/
+    python ocr_cli.py --files-from lista.txt -o resultados/ -j 8 --formats md,json
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from batch_export import EXPORT_FORMATS, render_export
+from image_tools import DEFAULT_IMAGE_BUDGET, DEFAULT_MAX_DPI
+from ocr_async import (
+    DEFAULT_STAGE_LIMITS,
+    STAGE_DOCUMENT_UNDERSTANDING,
+    STAGE_OCR,
+    STAGE_UPLOAD,
+)
+from ocr_pipeline import SOURCE_LOCAL_FILE, LocalFileSource, process_documents_async
+from ocr_responses import DEFAULT_MAX_IMAGE_BYTES
+from progress import ProgressEvents, ProgressTotals
+
+logger = logging.getLogger("MistralOCR")
+
+SUPPORTED_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp")
+PROCESSING_METHODS = {
+    "auto": "Auto",
+    "ocr": "OCR API (Standard)",
+    "document-understanding": "Document Understanding API",
+}
+
+
+def discover_inputs(paths, recursive=False):
+    """
+    Devuelve pares ``(ruta, ruta_relativa)`` de los documentos soportados.
+
+    Los directorios se recorren (recursivamente si se pide) y la ruta relativa
+    conserva su estructura; los archivos sueltos usan solo su nombre.
+    """
+    found = []
+    seen = set()
+
+    def add(path, relative):
+        real = os.path.realpath(path)
+        if real not in seen:
+            seen.add(real)
+            found.append((path, relative))
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                        full_path = os.path.join(root, name)
+                        add(full_path, os.path.relpath(full_path, path))
+                if not recursive:
+                    break
+        elif os.path.isfile(path):
+            add(path, os.path.basename(path))
+        else:
+            logger.warning(f"Se omite {path}: no existe")
+
+    return found
+
+
+def read_file_list(list_path):
+    """
+    Rutas de un archivo de lista (una por línea; ``-`` lee la entrada estándar).
+    """
+    f = sys.stdin if list_path == "-" else open(list_path, encoding="utf-8")
+    try:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def output_paths(output_dir, relative, formats):
+    """
+    Rutas de salida de un documento: ``<ruta_relativa>.<formato>``.
+
+    Se conserva la extensión original para que ``a.pdf`` y ``a.png`` no
+    compartan resultado.
+    """
+    return {
+        extension: os.path.join(output_dir, f"{relative}.{extension}")
+        for extension in formats
+    }
+
+
+def is_done(paths):
+    return all(os.path.exists(path) for path in paths.values())
+
+
+def write_outputs(paths, result_text):
+    """
+    Escribe cada formato de forma atómica para que un archivo a medias nunca
+    cuente como terminado.
+    """
+    for extension, path in paths.items():
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(render_export(result_text, extension))
+        os.replace(tmp_path, path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extrae texto de PDFs e imágenes con Mistral OCR, sin interfaz."
+    )
+    parser.add_argument(
+        "inputs", nargs="*", help="Archivos o directorios con documentos"
+    )
+    parser.add_argument(
+        "--files-from",
+        metavar="LISTA",
+        help="Archivo con una ruta por línea ('-' para la entrada estándar)",
+    )
+    parser.add_argument(
+        "-o", "--output-dir", required=True, help="Directorio de resultados"
+    )
+    parser.add_argument(
+        "-r", "--recursive", action="store_true", help="Recorrer subdirectorios"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=DEFAULT_STAGE_LIMITS[STAGE_OCR],
+        help="Solicitudes OCR simultáneas (por defecto %(default)s)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=0,
+        help="Documentos leídos en memoria a la vez (por defecto 4 × --jobs)",
+    )
+    parser.add_argument(
+        "--method",
+        choices=sorted(PROCESSING_METHODS),
+        default="auto",
+        help="Método de procesamiento (por defecto %(default)s)",
+    )
+    parser.add_argument(
+        "--formats",
+        default="md",
+        help="Formatos de salida separados por comas: "
+        + ", ".join(extension for extension, _ in EXPORT_FORMATS)
+        + " (por defecto %(default)s)",
+    )
+    parser.add_argument(
+        "--split-pages",
+        type=int,
+        default=0,
+        help="Dividir PDFs con más páginas en fragmentos de este tamaño",
+    )
+    parser.add_argument(
+        "--optimize-images",
+        action="store_true",
+        help="Reencodificar las imágenes antes de enviarlas dentro de --max-image-kb",
+    )
+    parser.add_argument(
+        "--max-image-kb",
+        type=int,
+        default=DEFAULT_IMAGE_BUDGET // 1024,
+        help="Tamaño máximo por imagen con --optimize-images o --preprocess (por defecto %(default)s)",
+    )
+    parser.add_argument(
+        "--preprocess",
+        action="store_true",
+        help="Preprocesar las imágenes con OpenCV: limitar la resolución, escala de grises y sin alfa ni metadatos",
+    )
+    parser.add_argument(
+        "--max-dpi",
+        type=int,
+        default=DEFAULT_MAX_DPI,
+        help="Resolución máxima con --preprocess (por defecto %(default)s)",
+    )
+    parser.add_argument(
+        "--keep-color",
+        action="store_true",
+        help="Con --preprocess, conservar el color",
+    )
+    parser.add_argument(
+        "--binarize",
+        action="store_true",
+        help="Con --preprocess, binarizar con un umbral adaptativo (documentos de texto)",
+    )
+    parser.add_argument(
+        "--direct-image-api",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Procesar las imágenes con la API REST directa (por defecto sí)",
+    )
+    parser.add_argument(
+        "--extract-images",
+        action="store_true",
+        help="Pedir y guardar las imágenes incrustadas en el almacén de artefactos",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Reprocesar aunque exista el resultado"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="No consultar la caché de resultados (el resultado nuevo sí se guarda)",
+    )
+    parser.add_argument(
+        "--api-key", help="API key de Mistral (por defecto MISTRAL_API_KEY)"
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="Mostrar solo avisos y errores"
+    )
+
+    args = parser.parse_args(argv)
+    args.formats = [f.strip().lower() for f in args.formats.split(",") if f.strip()]
+    known_formats = {extension for extension, _ in EXPORT_FORMATS}
+    unknown = [f for f in args.formats if f not in known_formats]
+    if unknown or not args.formats:
+        parser.error(f"Formato de salida no soportado: {', '.join(unknown) or '-'}")
+    if not args.inputs and not args.files_from:
+        parser.error("Indica al menos un archivo, un directorio o --files-from")
+    if args.jobs < 1:
+        parser.error("--jobs debe ser al menos 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.WARNING if args.quiet else logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+    # httpx registra cada solicitud en INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    api_key = args.api_key or os.environ.get("MISTRAL_API_KEY", "").strip()
+    if not api_key:
+        logger.error("Falta la API key: usa --api-key o la variable MISTRAL_API_KEY")
+        return 2
+
+    paths = list(args.inputs)
+    if args.files_from:
+        paths.extend(read_file_list(args.files_from))
+    documents = discover_inputs(paths, args.recursive)
+
+    pending = []
+    skipped = 0
+    for path, relative in documents:
+        outputs = output_paths(args.output_dir, relative, args.formats)
+        if not args.force and is_done(outputs):
+            skipped += 1
+        else:
+            pending.append((path, relative, outputs))
+
+    logger.info(
+        f"{len(documents)} documento(s) encontrados: {skipped} ya procesados, {len(pending)} pendientes"
+    )
+
+    stage_limits = {
+        STAGE_UPLOAD: max(1, min(args.jobs, DEFAULT_STAGE_LIMITS[STAGE_UPLOAD])),
+        STAGE_OCR: args.jobs,
+        STAGE_DOCUMENT_UNDERSTANDING: max(
+            1, min(args.jobs, DEFAULT_STAGE_LIMITS[STAGE_DOCUMENT_UNDERSTANDING])
+        ),
+    }
+    image_options = (
+        {"limit": 20, "min_size": 64, "max_bytes": DEFAULT_MAX_IMAGE_BYTES}
+        if args.extract_images
+        else None
+    )
+    optimize_images = None
+    if args.optimize_images or args.preprocess:
+        optimize_images = {"max_bytes": args.max_image_kb * 1024}
+    if args.preprocess:
+        optimize_images |= {
+            "max_dpi": args.max_dpi,
+            "grayscale": not args.keep_color,
+            "binarize": args.binarize,
+        }
+    batch_size = args.batch_size or args.jobs * 4
+    succeeded = 0
+    failed = []
+    totals = ProgressTotals()
+    progress = ProgressEvents([totals])
+    start_time = time.time()
+
+    # Los documentos se leen por tandas para no cargar todo el lote en memoria
+    for offset in range(0, len(pending), batch_size):
+        batch = pending[offset : offset + batch_size]
+        sources = []
+        for path, relative, outputs in batch:
+            try:
+                sources.append(LocalFileSource(path))
+            except OSError as e:
+                sources.append(None)
+                failed.append(relative)
+                logger.error(f"No se pudo leer {path}: {str(e)}")
+
+        readable = [i for i, source in enumerate(sources) if source is not None]
+
+        def on_complete(completed, idx, result):
+            nonlocal succeeded
+            _, relative, outputs = batch[readable[idx]]
+            if result["success"]:
+                write_outputs(outputs, result["result_text"])
+                succeeded += 1
+                logger.info(f"[{offset + completed}/{len(pending)}] {relative}")
+            else:
+                # Sin resultado en disco, el documento se reintenta en la
+                # siguiente ejecución
+                failed.append(relative)
+                logger.error(
+                    f"[{offset + completed}/{len(pending)}] {relative}: {result['result_text']}"
+                )
+
+        process_documents_async(
+            api_key,
+            [sources[i] for i in readable],
+            SOURCE_LOCAL_FILE,
+            PROCESSING_METHODS[args.method],
+            optimize_images,
+            args.direct_image_api,
+            stage_limits,
+            on_complete=on_complete,
+            use_cache=not args.no_cache,
+            split_pages=args.split_pages,
+            image_options=image_options,
+            progress=progress,
+        )
+
+    elapsed = time.time() - start_time
+    logger.info(
+        f"Terminado en {elapsed:.1f} s: {succeeded} correctos, {len(failed)} fallidos, {skipped} omitidos"
+    )
+    logger.info(
+        f"{totals.bytes_uploaded / (1024 * 1024):.1f} MB subidos, {totals.bytes_saved / (1024 * 1024):.1f} MB ahorrados en imágenes, {totals.retries} reintento(s), {totals.fallbacks} método(s) alternativo(s)"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
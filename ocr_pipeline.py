@@ -0,0 +1,1244 @@
+"""
+Preparación y procesamiento de documentos independiente de la interfaz.
+
+Contiene los pasos que comparten la aplicación Streamlit y la línea de
+comandos (``ocr_cli.py``): preparar el payload de cada documento, elegir la
+ruta de la API, llamar a la API (de forma síncrona o con el motor
+asíncrono) y consultar la caché de resultados. Este módulo no debe importar
+Streamlit: el avance se comunica con los eventos de ``progress.py``.
+"""
+
+import io
+import json
+import logging
+import mimetypes
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PIL import Image
+
+from image_tools import preprocess_image
+from mistral_client import (
+    DOCUMENT_UNDERSTANDING_MODEL,
+    LOCAL_FILE_DOCUMENT,
+    InlineImage,
+    OCR_MODEL,
+    TRANSPORT_POOL,
+    TransportConnectionError,
+    TransportError,
+    TransportTimeout,
+    build_document_understanding_request,
+    build_ocr_request,
+    get_transport,
+)
+from ocr_async import (
+    ROUTE_DOCUMENT_UNDERSTANDING,
+    ROUTE_IMAGE_REST,
+    ROUTE_OCR,
+    STAGE_DOCUMENT_UNDERSTANDING,
+    STAGE_OCR,
+    STAGE_PDF_CHUNKS,
+    STAGE_UPLOAD,
+    run_ocr_batch,
+)
+from ocr_cache import (
+    SIGNED_URL_EXPIRY_HOURS,
+    build_cache_key,
+    get_result_cache,
+    get_upload_registry,
+    hash_bytes,
+)
+from ocr_responses import extract_text_from_ocr_response, parse_ocr_response_stream
+from pdf_tools import (
+    count_pdf_pages,
+    describe_chunk,
+    merge_chunk_images,
+    merge_chunk_pages,
+    split_pdf,
+)
+from progress import FALLBACK, FILE_UPLOADED, IMAGE_OPTIMIZED, NO_PROGRESS
+
+logger = logging.getLogger("MistralOCR")
+
+# Tipos de fuente de un lote
+SOURCE_LOCAL_FILE = "Archivo local"
+SOURCE_URL = "URL"
+# Separador entre las páginas del texto extraído
+PAGE_SEPARATOR = "\n\n"
+
+
+class LocalFileSource(io.BytesIO):
+    """
+    Archivo en disco con la misma interfaz que un archivo subido con
+    ``st.file_uploader`` (``name``, ``type`` y ``size``).
+    """
+
+    def __init__(self, path, name=None):
+        with open(path, "rb") as f:
+            super().__init__(f.read())
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.type = mimetypes.guess_type(self.name)[0] or "application/octet-stream"
+        self.size = os.path.getsize(path)
+
+
+def prepare_image_for_ocr(file_data, options=None):
+    """
+    Prepara una imagen para ser procesada con OCR, asegurando formato óptimo.
+
+    La imagen se recodifica dentro de un presupuesto de bytes buscando
+    formato, calidad y escala; ``options`` son las de
+    ``image_tools.preprocess_image`` (presupuesto, DPI, escala de grises y
+    binarización).
+    """
+    try:
+        return preprocess_image(file_data, **(options or {}))
+    except Exception as e:
+        logger.warning(f"No se pudo optimizar la imagen: {str(e)}")
+        return file_data, "image/jpeg"  # Formato por defecto
+
+
+def prepare_document(source, idx, source_type, optimize_images, progress=NO_PROGRESS):
+    """
+    Prepara un documento para OCR: detecta su tipo, lee los bytes y construye
+    el payload ``document`` de la API.
+
+    Devuelve un diccionario con ``file_type``, ``document``, ``preview_src``,
+    ``file_name``, ``file_bytes``, ``mime_type`` (de los archivos locales) y
+    ``content_hash``; si el documento no se puede preparar, devuelve
+    directamente el resultado fallido (con ``success`` en False).
+
+    ``optimize_images`` puede ser un booleano o un diccionario con las
+    opciones de ``image_tools.preprocess_image``. Si la imagen optimizada no
+    es más pequeña que la original, se envía la original; si lo es, los bytes
+    ahorrados se publican en ``progress``.
+    """
+    file_bytes = None
+    file_type = None
+    content_hash = None
+    mime_type = None
+
+    # Determinar el tipo de archivo automáticamente
+    if source_type == "Archivo local":
+        file_name = source.name
+        mime = mimetypes.guess_type(file_name)[0]
+        if mime == "application/pdf":
+            file_type = "PDF"
+        elif mime and mime.startswith("image/"):
+            file_type = "Imagen"
+        else:
+            logger.warning(f"Tipo de archivo no soportado: {mime} para {file_name}")
+            return {
+                "success": False,
+                "result_text": f"Tipo de archivo no soportado: {file_name}",
+                "preview_src": "",
+                "file_name": file_name,
+                "file_bytes": None,
+                "raw_response": None,
+            }
+    elif source_type == "URL":
+        source_name = source.split("/")[-1]
+        if source.lower().endswith(".pdf"):
+            file_type = "PDF"
+        else:
+            file_type = "Imagen"  # Assume image for other URLs for simplicity, more robust detection could be added
+    else:
+        return {
+            "success": False,
+            "result_text": "Tipo de fuente desconocido.",
+            "preview_src": "",
+            "file_name": f"Error-{idx+1}",
+            "file_bytes": None,
+            "raw_response": None,
+        }
+
+    # Preparar el documento según el tipo y la fuente
+    if file_type == "PDF":
+        if source_type == "URL":
+            document = {
+                "type": "document_url",
+                "document_url": source.strip(),
+            }
+            preview_src = source.strip()
+            file_name = source.split("/")[-1]
+        else:
+            try:
+                # getvalue() comparte el buffer del archivo subido, sin copiarlo
+                file_bytes = source.getvalue()
+                content_hash = hash_bytes(file_bytes)
+                file_name = source.name
+                # El PDF se sube en streaming desde estos bytes y la vista
+                # previa los lee del almacén de la sesión: no hace falta URI
+                document = {
+                    "type": LOCAL_FILE_DOCUMENT,
+                    "file_name": file_name,
+                    "content": file_bytes,
+                    "content_hash": content_hash,
+                }
+                preview_src = ""
+                mime_type = "application/pdf"
+            except Exception as e:
+                logger.error(f"Error al leer PDF: {str(e)}")
+                return {
+                    "success": False,
+                    "result_text": f"Error al leer el archivo PDF: {str(e)}",
+                    "preview_src": "",
+                    "file_name": getattr(source, "name", f"PDF-Error-{idx+1}"),
+                    "file_bytes": None,
+                    "raw_response": None,
+                }
+    elif file_type == "Imagen":
+        if source_type == "URL":
+            document = {
+                "type": "image_url",
+                "image_url": source.strip(),
+            }
+            preview_src = source.strip()
+            file_name = source.split("/")[-1]
+        else:
+            try:
+                # Leer los bytes de la imagen
+                file_bytes = source.read()
+                content_hash = hash_bytes(file_bytes)
+
+                # Optimizar la imagen si está habilitado
+                mime_type = source.type
+                if optimize_images:
+                    optimized, optimized_type = prepare_image_for_ocr(
+                        file_bytes,
+                        optimize_images if isinstance(optimize_images, dict) else None,
+                    )
+                    if len(optimized) < len(file_bytes):
+                        progress.emit(
+                            IMAGE_OPTIMIZED,
+                            original_bytes=len(file_bytes),
+                            optimized_bytes=len(optimized),
+                        )
+                        file_bytes, mime_type = optimized, optimized_type
+
+                # La imagen viaja como bytes y se codifica en base64 por
+                # bloques al enviarla; la vista previa usa los mismos bytes
+                document = {
+                    "type": "image_url",
+                    "image_url": InlineImage(file_bytes, mime_type),
+                }
+                preview_src = ""
+                file_name = source.name
+
+                # Reiniciar el cursor del archivo para futuras operaciones
+                source.seek(0)
+            except Exception as e:
+                logger.error(f"Error al leer imagen: {str(e)}")
+                return {
+                    "success": False,
+                    "result_text": f"Error al leer la imagen: {str(e)}",
+                    "preview_src": "",
+                    "file_name": getattr(source, "name", f"Imagen-Error-{idx+1}"),
+                    "file_bytes": None,
+                    "raw_response": None,
+                }
+    else:
+        return {
+            "success": False,
+            "result_text": f"Tipo de archivo no soportado para {source_name if 'source_name' in locals() else 'documento'}.",
+            "preview_src": "",
+            "file_name": (
+                source_name if "source_name" in locals() else f"Error-{idx+1}"
+            ),
+            "file_bytes": None,
+            "raw_response": None,
+        }
+
+    return {
+        "file_type": file_type,
+        "document": document,
+        "preview_src": preview_src,
+        "file_name": file_name,
+        "file_bytes": file_bytes,
+        "mime_type": mime_type,
+        "content_hash": content_hash,
+    }
+
+
+def build_document_result(prepared, ocr_response, idx, total):
+    """
+    Construye el resultado final de un documento a partir de la respuesta OCR.
+
+    ``page_offsets`` indica dónde empieza y termina cada página dentro de
+    ``result_text``, como ``[número de página, inicio, fin]``.
+    """
+    file_name = prepared["file_name"]
+    page_offsets = []
+
+    # Procesar la respuesta
+    if "error" in ocr_response:
+        result_text = f"Error al procesar {file_name}: {ocr_response['error']}"
+        success = False
+    else:
+        pages = ocr_response.get("pages", [])
+        if pages:
+            texts = []
+            position = 0
+            for number, page in enumerate(pages):
+                if "markdown" not in page:
+                    continue
+                if texts:
+                    position += len(PAGE_SEPARATOR)
+                markdown = page.get("markdown", "")
+                page_offsets.append(
+                    [page.get("index", number) + 1, position, position + len(markdown)]
+                )
+                texts.append(markdown)
+                position += len(markdown)
+            result_text = PAGE_SEPARATOR.join(texts)
+            if result_text.strip():
+                success = True
+            else:
+                result_text = f"No se encontró texto en {file_name}."
+                success = False
+        else:
+            result_text = f"Estructura de respuesta inesperada para {file_name}."
+            success = False
+    if not success:
+        page_offsets = []
+
+    logger.info(
+        f"Documento {idx+1}/{total} procesado: {'Éxito' if success else 'Fallido'}"
+    )
+    return {
+        "success": success,
+        "result_text": result_text,
+        "preview_src": prepared["preview_src"],
+        "file_name": file_name,
+        "file_bytes": prepared["file_bytes"],
+        "mime_type": prepared["mime_type"],
+        "raw_response": (
+            ocr_response.get("raw_response") if "raw_response" in ocr_response else None
+        ),
+        "images": ocr_response.get("images") or [],
+        "page_offsets": page_offsets,
+    }
+
+
+def select_processing_route(file_type, source_type, processing_method, direct_api):
+    """
+    Determina qué método de la API procesará un documento preparado.
+    """
+    if file_type == "Imagen" and direct_api and source_type == "Archivo local":
+        return ROUTE_IMAGE_REST
+    if processing_method == "Document Understanding API":
+        return ROUTE_DOCUMENT_UNDERSTANDING
+    return ROUTE_OCR
+
+
+def should_split_pdf(route, document, split_pages):
+    """
+    Indica si un PDF local debe procesarse por fragmentos de páginas.
+    """
+    if not split_pages or route != ROUTE_OCR:
+        return False
+    if document.get("type") != LOCAL_FILE_DOCUMENT:
+        return False
+    try:
+        return count_pdf_pages(document["content"]) > split_pages
+    except Exception as e:
+        logger.warning(f"No se pudo contar las páginas del PDF: {str(e)}")
+        return False
+
+
+def get_document_cache_key(
+    prepared, route, processing_method, optimize_images, image_options=None
+):
+    """
+    Clave de caché de un documento preparado, o None si no se puede cachear.
+
+    Solo los archivos locales tienen bytes con los que direccionar la caché;
+    el contenido de una URL puede cambiar sin que cambie la URL.
+    """
+    if not prepared.get("content_hash"):
+        return None
+
+    model = (
+        DOCUMENT_UNDERSTANDING_MODEL
+        if route == ROUTE_DOCUMENT_UNDERSTANDING
+        else OCR_MODEL
+    )
+    return build_cache_key(
+        prepared["content_hash"],
+        model,
+        f"{route}:{processing_method}",
+        optimize_images=optimize_images,
+        image_options=image_options if route == ROUTE_OCR else None,
+    )
+
+
+def process_image_with_rest(api_key, image, transport=None, progress=NO_PROGRESS):
+    """
+    Procesa una imagen utilizando API REST directamente (más confiable para imágenes).
+
+    ``image`` es normalmente la ``InlineImage`` del documento preparado, que
+    ya trae su tipo MIME; con bytes o un archivo, el formato se detecta aquí.
+    """
+    transport = transport or get_transport()
+
+    with progress.stage(STAGE_OCR, "Procesando imagen con REST API...") as status:
+        try:
+            if not isinstance(image, InlineImage):
+                # Si image es un archivo subido, convertirlo a bytes
+                if hasattr(image, "read"):
+                    bytes_data = image.read()
+                    image.seek(0)  # Reset file pointer
+                else:
+                    bytes_data = image
+                try:
+                    image_format = Image.open(io.BytesIO(bytes_data)).format.lower()
+                    mime_type = f"image/{image_format}"
+                    status.update(label=f"Imagen detectada como {mime_type}")
+                except Exception as e:
+                    logger.warning(f"Error al detectar formato de imagen: {str(e)}")
+                    # Si falla, usar un tipo genérico
+                    mime_type = "image/jpeg"
+                image = InlineImage(bytes_data, mime_type)
+
+            # La URI base64 se codifica por bloques al enviar la solicitud
+            payload = {
+                "model": OCR_MODEL,
+                "document": {"type": "image_url", "image_url": image},
+            }
+
+            status.update(label="Enviando imagen a la API...")
+
+            # Hacer la solicitud a la API de Mistral con timeout
+            response = transport.post_json(
+                "ocr",
+                payload,
+                api_key,
+                timeout=60,  # 60 segundos de timeout para imágenes grandes
+                progress=status.progress,
+            )
+
+            # Revisar si la respuesta fue exitosa
+            try:
+                if response.status_code == 200:
+                    result = response.json()
+                    status.update(
+                        label="Imagen procesada correctamente", state="complete"
+                    )
+                    return extract_text_from_ocr_response(result)
+                else:
+                    error_message = f"Error en API OCR (código {response.status_code}): {response.text}"
+                    logger.error(error_message)
+                    status.update(label="Error al procesar la imagen", state="error")
+                    return {"error": error_message}
+            finally:
+                response.close()
+
+        except TransportTimeout:
+            error_message = (
+                "Timeout al procesar la imagen. La operación tomó demasiado tiempo."
+            )
+            logger.error(error_message)
+            status.update(label="Timeout al procesar la imagen", state="error")
+            return {"error": error_message}
+
+        except TransportConnectionError:
+            error_message = "Error de conexión al procesar la imagen. Comprueba tu conexión a internet."
+            logger.error(error_message)
+            status.update(label="Error de conexión", state="error")
+            return {"error": error_message}
+
+        except Exception as e:
+            error_message = f"Error al procesar imagen: {str(e)}"
+            logger.error(f"{error_message}\n{traceback.format_exc()}")
+            status.update(label=f"Error: {str(e)}", state="error")
+            return {"error": error_message}
+
+
+def request_signed_url(api_key, file_id, transport, status):
+    """
+    Solicita la URL firmada de un archivo ya subido a ``/v1/files``.
+
+    Devuelve ``{"url": ...}`` o ``{"error": ...}``.
+    """
+    status.update(label="Obteniendo URL firmada...")
+    url_response = transport.get(
+        f"files/{file_id}/url?expiry={SIGNED_URL_EXPIRY_HOURS}",
+        api_key,
+        timeout=60,
+        headers={"Accept": "application/json"},
+        progress=status.progress,
+    )
+
+    try:
+        if not url_response.ok:
+            error_msg = url_response.error_message("Error al obtener URL firmada")
+            logger.error(error_msg)
+            return {"error": error_msg}
+        signed_url = url_response.json().get("url")
+    finally:
+        url_response.close()
+    if not signed_url:
+        return {"error": "No se pudo obtener la URL firmada"}
+    return {"url": signed_url}
+
+
+def upload_local_document(api_key, document, transport, progress=NO_PROGRESS):
+    """
+    Sube un documento local a ``/v1/files`` y obtiene su URL firmada.
+
+    Si el mismo contenido ya se subió con esta cuenta, reutiliza su
+    ``file_id`` y su URL firmada, renovando solo la firma cuando está a punto
+    de caducar. Devuelve ``{"document": ...}`` con la URL firmada o
+    ``{"error": ...}``.
+    """
+    registry = get_upload_registry()
+    content_hash = document.get("content_hash")
+    registered = registry.get(api_key, content_hash) if content_hash else None
+
+    with progress.stage(STAGE_UPLOAD, "Preparando el documento...") as status:
+        try:
+            if registered and not registry.needs_refresh(registered):
+                logger.info(f"Reutilizando archivo subido. ID: {registered['file_id']}")
+                status.update(
+                    label=f"Reutilizando archivo ya subido. ID: {registered['file_id']}"
+                )
+                status.progress.emit(FILE_UPLOADED, file_id=registered["file_id"])
+                return {
+                    "document": {
+                        "type": "document_url",
+                        "document_url": registered["signed_url"],
+                    }
+                }
+
+            if registered:
+                # El archivo sigue en el servidor: basta con renovar la firma
+                signed = request_signed_url(
+                    api_key, registered["file_id"], transport, status
+                )
+                if "url" in signed:
+                    registry.put(
+                        api_key, content_hash, registered["file_id"], signed["url"]
+                    )
+                    status.update(label="URL firmada renovada correctamente")
+                    status.progress.emit(FILE_UPLOADED, file_id=registered["file_id"])
+                    return {
+                        "document": {
+                            "type": "document_url",
+                            "document_url": signed["url"],
+                        }
+                    }
+                logger.info("No se pudo renovar la URL firmada, se volverá a subir")
+                registry.forget(api_key, content_hash)
+
+            # Subir el archivo en streaming desde su buffer, sin copias intermedias
+            status.update(label="Subiendo PDF al servidor de Mistral...")
+            upload_response = transport.upload_file(
+                "files",
+                {"purpose": "ocr"},
+                document.get("file_name") or "temp_document.pdf",
+                document["content"],
+                api_key,
+                timeout=120,
+                progress=status.progress,
+            )
+
+            try:
+                if not upload_response.ok:
+                    error_msg = upload_response.error_message("Error al subir archivo")
+                    logger.error(error_msg)
+                    status.update(label="Error al subir archivo", state="error")
+                    return {"error": error_msg}
+
+                # Parsear el resultado para obtener el ID del archivo
+                file_data = upload_response.json()
+            finally:
+                upload_response.close()
+            file_id = file_data.get("id")
+            if not file_id:
+                status.update(
+                    label="Error: No se pudo obtener ID del archivo",
+                    state="error",
+                )
+                return {"error": "No se pudo obtener el ID del archivo subido"}
+
+            logger.info(f"Archivo subido exitosamente. ID: {file_id}")
+            status.update(label=f"Archivo subido. ID: {file_id}")
+            status.progress.emit(FILE_UPLOADED, file_id=file_id)
+
+            # Obtener URL firmada
+            signed = request_signed_url(api_key, file_id, transport, status)
+            if "error" in signed:
+                status.update(label="Error al obtener URL firmada", state="error")
+                return signed
+
+            if content_hash:
+                registry.put(api_key, content_hash, file_id, signed["url"])
+
+            # Usar la URL firmada para el OCR
+            logger.info("URL firmada obtenida correctamente para OCR")
+            status.update(label="URL firmada obtenida correctamente")
+            return {"document": {"type": "document_url", "document_url": signed["url"]}}
+
+        except json.JSONDecodeError as e:
+            error_msg = f"Error al parsear respuesta del servidor: {str(e)}"
+            logger.error(error_msg)
+            status.update(
+                label="Error: Formato de respuesta incorrecto",
+                state="error",
+            )
+            return {"error": error_msg}
+        except Exception as e:
+            error_msg = f"Error al procesar PDF: {str(e)}"
+            logger.error(f"{error_msg}\n{traceback.format_exc()}")
+            status.update(label=f"Error al procesar PDF: {str(e)}", state="error")
+            return {"error": error_msg}
+
+
+def process_ocr_with_curl(
+    api_key,
+    document,
+    method="REST",
+    show_debug=False,
+    transport=None,
+    image_options=None,
+    progress=NO_PROGRESS,
+):
+    """
+    Realiza solicitud OCR usando el transporte HTTP configurado.
+
+    Por defecto usa el pool de conexiones compartido; el modo cURL se mantiene
+    como alternativa de compatibilidad. Las imágenes incrustadas solo se piden
+    con ``image_options`` y se guardan en disco en lugar de en la respuesta.
+    """
+    transport = transport or get_transport()
+
+    with progress.stage(STAGE_OCR, "Iniciando procesamiento OCR...") as status:
+        try:
+            # Preparar el documento según su tipo
+            if document.get("type") == LOCAL_FILE_DOCUMENT:
+                uploaded = upload_local_document(
+                    api_key, document, transport, status.progress
+                )
+                if "error" in uploaded:
+                    return uploaded
+                document = uploaded["document"]
+
+            elif isinstance(document.get("image_url"), InlineImage):
+                # Para imágenes locales, procesar directamente con la API REST
+                status.update(label="Procesando imagen...")
+                return process_image_with_rest(
+                    api_key, document["image_url"], transport, status.progress
+                )
+
+            # Preparar datos para la solicitud OCR
+            json_data = build_ocr_request(document, image_options)
+
+            # Ejecutar OCR
+            status.update(label=f"Ejecutando OCR ({transport.name})...")
+            if show_debug:
+                # La solicitud se publica sin API key
+                status.debug("request", transport.describe("POST", "ocr"))
+
+            logger.info(f"Ejecutando OCR con transporte {transport.name}")
+            ocr_response = transport.post_json(
+                "ocr",
+                json_data,
+                api_key,
+                timeout=180,  # 3 minutos para documentos grandes
+                progress=status.progress,
+            )
+            if not ocr_response.ok:
+                error_details = {
+                    "error": f"Error en OCR (código {ocr_response.status_code})",
+                    "stdout": ocr_response.text[:1000],
+                }
+                ocr_response.close()
+                logger.error(
+                    f"Error durante la solicitud OCR: {error_details['error']}"
+                )
+                status.update(label=f"Error: {error_details['error']}", state="error")
+                return {"error": json.dumps(error_details)}
+
+            # Recorrer la respuesta página a página sin cargarla entera en memoria
+            status.update(label="Procesando respuesta OCR...")
+            try:
+                result = parse_ocr_response_stream(ocr_response, image_options)
+            finally:
+                ocr_response.close()
+
+            # Comprobar si la API respondió con un error en lugar de páginas
+            if result.pop("needs_fallback", False):
+                status.update(
+                    label="API respondió con error, intentando método alternativo...",
+                    state="running",
+                )
+
+                if show_debug:
+                    status.debug("response", result.get("raw_response"))
+
+                # Intentar método alternativo
+                if "document understanding" not in method.lower():
+                    status.progress.emit(
+                        FALLBACK,
+                        from_method=method,
+                        to_method="Document Understanding",
+                        reason="La API OCR no devolvió páginas",
+                    )
+                    return process_with_document_understanding(
+                        api_key, document, transport, progress
+                    )
+
+            if "error" in result:
+                status.update(
+                    label=f"Error al procesar la respuesta OCR: {result['error']}",
+                    state="error",
+                )
+                return result
+
+            if show_debug and result.get("raw_response"):
+                status.debug("response", result["raw_response"])
+
+            status.update(label="Texto extraído correctamente", state="complete")
+            return result
+
+        except TransportTimeout as e:
+            error_msg = f"Timeout durante el procesamiento OCR: {str(e)}"
+            logger.error(error_msg)
+            status.update(label="Timeout durante el procesamiento OCR", state="error")
+            return {"error": error_msg}
+
+        except TransportError as e:
+            error_msg = f"Error de transporte durante el procesamiento OCR: {str(e)}"
+            logger.error(error_msg)
+            status.update(label=f"Error de conexión: {str(e)}", state="error")
+            return {"error": error_msg}
+
+        except Exception as e:
+            error_msg = f"Error durante el procesamiento OCR: {str(e)}"
+            logger.error(f"{error_msg}\n{traceback.format_exc()}")
+            status.update(label=f"Error inesperado: {str(e)}", state="error")
+            return {"error": error_msg}
+
+
+def ocr_pdf_chunk(api_key, chunk, transport, image_options=None, progress=NO_PROGRESS):
+    """
+    Sube y procesa con OCR un fragmento de PDF, sin elementos de interfaz.
+
+    Devuelve la respuesta con sus páginas o ``{"error": ...}``.
+    """
+    document = {
+        "type": LOCAL_FILE_DOCUMENT,
+        "file_name": f"fragmento_{describe_chunk(chunk)}.pdf",
+        "content": chunk["content"],
+        "content_hash": chunk["content_hash"],
+    }
+    try:
+        uploaded = upload_local_document(api_key, document, transport, progress)
+        if "error" in uploaded:
+            return uploaded
+
+        response = transport.post_json(
+            "ocr",
+            build_ocr_request(uploaded["document"], image_options),
+            api_key,
+            timeout=180,
+            progress=progress,
+        )
+        try:
+            if not response.ok:
+                return {"error": response.error_message("Error en OCR")}
+            parsed = parse_ocr_response_stream(response, image_options)
+        finally:
+            response.close()
+
+        if "error" in parsed:
+            return parsed
+        if not parsed.get("pages") or "raw_response" in parsed:
+            return {"error": "Estructura de respuesta inesperada"}
+        return {"pages": parsed["pages"], "images": parsed.get("images", [])}
+
+    except (TransportError, ValueError) as e:
+        return {"error": str(e)}
+
+
+def process_pdf_in_chunks(
+    api_key,
+    document,
+    pages_per_chunk,
+    max_workers,
+    transport=None,
+    max_rounds=3,
+    image_options=None,
+    progress=NO_PROGRESS,
+):
+    """
+    Divide un PDF local en fragmentos de páginas y los procesa en paralelo.
+
+    Las páginas se reensamblan en orden con la misma forma ``{"pages": [...]}``
+    y, en cada ronda, solo se reintentan los fragmentos que fallaron.
+    """
+    transport = transport or get_transport()
+
+    with progress.stage(STAGE_PDF_CHUNKS, "Dividiendo PDF en fragmentos...") as status:
+        try:
+            chunks = split_pdf(document["content"], pages_per_chunk)
+        except Exception as e:
+            error_msg = f"Error al dividir el PDF: {str(e)}"
+            logger.error(f"{error_msg}\n{traceback.format_exc()}")
+            status.update(label=error_msg, state="error")
+            return {"error": error_msg}
+
+        chunk_responses = [None] * len(chunks)
+        pending = list(range(len(chunks)))
+        errors = {}
+
+        for round_number in range(1, max_rounds + 1):
+            if round_number > 1:
+                status.update(
+                    label=f"Reintentando {len(pending)} fragmento(s) fallido(s)..."
+                )
+
+            with ThreadPoolExecutor(
+                max_workers=max(1, max_workers), thread_name_prefix="ocr-chunk"
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        ocr_pdf_chunk,
+                        api_key,
+                        chunks[i],
+                        transport,
+                        image_options,
+                        status.progress.bind(chunk=describe_chunk(chunks[i])),
+                    ): i
+                    for i in pending
+                }
+                for future in as_completed(futures):
+                    i = futures[future]
+                    response = future.result()
+                    if "error" in response:
+                        errors[i] = response["error"]
+                        logger.warning(
+                            f"Fragmento {describe_chunk(chunks[i])} fallido (ronda {round_number}): {response['error']}"
+                        )
+                    else:
+                        errors.pop(i, None)
+                        chunk_responses[i] = response
+
+                    completed = sum(1 for r in chunk_responses if r is not None)
+                    status.update(
+                        label=f"Fragmentos completados: {completed}/{len(chunks)}"
+                    )
+
+            pending = [i for i in pending if chunk_responses[i] is None]
+            if not pending:
+                break
+
+        if pending:
+            failed_ranges = ", ".join(describe_chunk(chunks[i]) for i in pending)
+            error_msg = f"Fallaron los fragmentos con páginas {failed_ranges}: {errors[pending[0]]}"
+            status.update(label="Error en fragmentos del PDF", state="error")
+            return {"error": error_msg}
+
+        status.update(
+            label=f"PDF procesado en {len(chunks)} fragmento(s)", state="complete"
+        )
+        return {
+            "pages": merge_chunk_pages(chunks, chunk_responses),
+            "images": merge_chunk_images(chunks, chunk_responses),
+        }
+
+
+def process_with_document_understanding(
+    api_key, document, transport=None, progress=NO_PROGRESS
+):
+    """
+    Método alternativo usando Document Understanding para extracción de texto.
+    """
+    transport = transport or get_transport()
+
+    with progress.stage(
+        STAGE_DOCUMENT_UNDERSTANDING,
+        "Utilizando método alternativo: Document Understanding API...",
+    ) as status:
+        try:
+            # Los documentos locales se suben primero para obtener una URL firmada
+            if document.get("type") == LOCAL_FILE_DOCUMENT:
+                uploaded = upload_local_document(
+                    api_key, document, transport, status.progress
+                )
+                if "error" in uploaded:
+                    return uploaded
+                document = uploaded["document"]
+
+            # Extraer URL del documento
+            doc_url = document.get("document_url", "") or document.get("image_url", "")
+
+            if not doc_url:
+                status.update(
+                    label="Error: No se pudo extraer URL del documento", state="error"
+                )
+                return {
+                    "error": "No se pudo extraer URL del documento para el método alternativo"
+                }
+
+            # Construir datos para chat completions
+            request_data = build_document_understanding_request(document)
+
+            status.update(label="Procesando con Document Understanding API...")
+            logger.info(
+                f"Ejecutando Document Understanding con transporte {transport.name}"
+            )
+            du_response = transport.post_json(
+                "chat/completions",
+                request_data,
+                api_key,
+                timeout=300,  # 5 minutos para documentos complejos
+                progress=status.progress,
+            )
+
+            # Verificar resultado
+            try:
+                if not du_response.ok:
+                    error_msg = du_response.error_message(
+                        "Error en Document Understanding"
+                    )
+                    logger.error(error_msg)
+                    status.update(
+                        label="Error en Document Understanding", state="error"
+                    )
+                    return {"error": error_msg}
+
+                try:
+                    result_json = du_response.json()
+                    if "choices" in result_json and len(result_json["choices"]) > 0:
+                        content = result_json["choices"][0]["message"]["content"]
+
+                        # Simular el formato de respuesta de OCR
+                        pages = [{"markdown": content}]
+                        status.update(
+                            label="Texto extraído correctamente", state="complete"
+                        )
+                        return {"pages": pages}
+                    else:
+                        error_msg = "Respuesta no válida de Document Understanding"
+                        logger.error(f"{error_msg}: {du_response.text[:200]}...")
+                        status.update(label=error_msg, state="error")
+                        return {"error": error_msg}
+                except json.JSONDecodeError:
+                    error_msg = (
+                        "Error al parsear respuesta JSON de Document Understanding"
+                    )
+                    logger.error(f"{error_msg}: {du_response.text[:200]}...")
+                    status.update(label=error_msg, state="error")
+                    return {"error": error_msg}
+            finally:
+                du_response.close()
+
+        except Exception as e:
+            error_msg = (
+                f"Error durante el procesamiento con Document Understanding: {str(e)}"
+            )
+            logger.error(f"{error_msg}\n{traceback.format_exc()}")
+            status.update(label=f"Error: {str(e)}", state="error")
+            return {"error": error_msg}
+
+
+def process_document(
+    api_key,
+    source,
+    idx,
+    total,
+    source_type,
+    processing_method,
+    show_debug,
+    optimize_images,
+    direct_api,
+    transport_mode=TRANSPORT_POOL,
+    use_cache=True,
+    split_pages=0,
+    chunk_concurrency=4,
+    image_options=None,
+    progress=NO_PROGRESS,
+):
+    """
+    Función para procesar un solo documento.
+
+    Con ``use_cache`` en False se omite la consulta a la caché, aunque el
+    resultado nuevo se sigue guardando en ella. Con ``split_pages`` mayor que
+    cero, los PDFs locales con más páginas se procesan por fragmentos en
+    paralelo. ``image_options`` activa la extracción de imágenes incrustadas.
+
+    El avance se publica en ``progress`` con el índice del documento (y su
+    nombre, una vez preparado) como contexto.
+    """
+    transport = get_transport(transport_mode)
+    prepared = None
+    progress = progress.bind(document=idx, total=total)
+
+    try:
+        logger.info(f"Procesando documento {idx+1}/{total}")
+
+        prepared = prepare_document(
+            source, idx, source_type, optimize_images, progress=progress
+        )
+        if "success" in prepared:
+            return prepared
+
+        file_type = prepared["file_type"]
+        document = prepared["document"]
+        progress = progress.bind(file_name=prepared["file_name"])
+
+        route = select_processing_route(
+            file_type, source_type, processing_method, direct_api
+        )
+
+        # Consultar la caché antes de cualquier llamada de red
+        cache_key = get_document_cache_key(
+            prepared, route, processing_method, optimize_images, image_options
+        )
+        if cache_key and use_cache:
+            cached_response = get_result_cache().get(cache_key)
+            if cached_response is not None:
+                logger.info(f"Documento {idx+1}/{total} obtenido de la caché")
+                return build_document_result(prepared, cached_response, idx, total)
+
+        # Procesar documento con el método apropiado
+        try:
+            # Si es una imagen y está habilitada la API REST directa, usar ese método
+            if route == ROUTE_IMAGE_REST:
+                ocr_response = process_image_with_rest(
+                    api_key, document["image_url"], transport, progress
+                )
+                # Convertir la respuesta al formato esperado por el resto del código
+                if "text" in ocr_response:
+                    ocr_response = {"pages": [{"markdown": ocr_response["text"]}]}
+            elif should_split_pdf(route, document, split_pages):
+                ocr_response = process_pdf_in_chunks(
+                    api_key,
+                    document,
+                    split_pages,
+                    chunk_concurrency,
+                    transport,
+                    image_options=image_options,
+                    progress=progress,
+                )
+            else:
+                # Determinar el método a usar basado en la selección
+                if processing_method == "OCR API (Standard)":
+                    ocr_response = process_ocr_with_curl(
+                        api_key,
+                        document,
+                        method="OCR",
+                        show_debug=show_debug,
+                        transport=transport,
+                        image_options=image_options,
+                        progress=progress,
+                    )
+                elif processing_method == "Document Understanding API":
+                    ocr_response = process_with_document_understanding(
+                        api_key, document, transport, progress
+                    )
+                else:  # Auto
+                    ocr_response = process_ocr_with_curl(
+                        api_key,
+                        document,
+                        method="Auto",
+                        show_debug=show_debug,
+                        transport=transport,
+                        image_options=image_options,
+                        progress=progress,
+                    )
+        except Exception as e:
+            logger.error(
+                f"Error en el procesamiento OCR: {str(e)}\n{traceback.format_exc()}"
+            )
+            return {
+                "success": False,
+                "result_text": f"Error durante el procesamiento OCR: {str(e)}",
+                "preview_src": prepared["preview_src"],
+                "file_name": prepared["file_name"],
+                "file_bytes": prepared["file_bytes"],
+                "mime_type": prepared["mime_type"],
+                "raw_response": None,
+            }
+
+        result = build_document_result(prepared, ocr_response, idx, total)
+        if cache_key and result["success"]:
+            get_result_cache().put(cache_key, ocr_response)
+        return result
+
+    except Exception as e:
+        error_msg = str(e)
+        logger.error(
+            f"Error inesperado procesando documento {idx+1}/{total}: {error_msg}\n{traceback.format_exc()}"
+        )
+        prepared = prepared if prepared and "success" not in prepared else {}
+        return {
+            "success": False,
+            "result_text": f"Error inesperado: {error_msg}",
+            "preview_src": prepared.get("preview_src", ""),
+            "file_name": prepared.get(
+                "file_name",
+                (
+                    getattr(source, "name", f"Doc-{idx+1}")
+                    if not isinstance(source, str)
+                    else f"URL-{idx+1}"
+                ),
+            ),
+            "file_bytes": prepared.get("file_bytes"),
+            "mime_type": prepared.get("mime_type"),
+            "raw_response": None,
+        }
+
+
+def plan_async_document(
+    source,
+    idx,
+    total,
+    source_type,
+    processing_method,
+    optimize_images,
+    direct_api,
+    use_cache=True,
+    split_pages=0,
+    image_options=None,
+    progress=NO_PROGRESS,
+):
+    """
+    Prepara un documento para el motor asíncrono.
+
+    Devuelve ``(result, job)``: ``result`` es el resultado final cuando no
+    hace falta llamar a la API (el documento no se pudo preparar o estaba en
+    la caché); si no, ``job`` es el trabajo para ``AsyncOCREngine.process``,
+    que se cierra con ``finish_async_document``.
+    """
+    progress = progress.bind(document=idx, total=total)
+    try:
+        prepared = prepare_document(
+            source, idx, source_type, optimize_images, progress=progress
+        )
+    except Exception as e:
+        logger.error(f"Error al preparar documento {idx+1}/{total}: {str(e)}")
+        prepared = {
+            "success": False,
+            "result_text": f"Error inesperado: {str(e)}",
+            "preview_src": "",
+            "file_name": (
+                getattr(source, "name", f"Doc-{idx+1}")
+                if not isinstance(source, str)
+                else f"URL-{idx+1}"
+            ),
+            "file_bytes": None,
+            "raw_response": None,
+        }
+
+    if "success" in prepared:
+        return prepared, None
+
+    route = select_processing_route(
+        prepared["file_type"], source_type, processing_method, direct_api
+    )
+
+    # Consultar la caché antes de encolar el trabajo
+    cache_key = get_document_cache_key(
+        prepared, route, processing_method, optimize_images, image_options
+    )
+    cached_response = (
+        get_result_cache().get(cache_key) if cache_key and use_cache else None
+    )
+    if cached_response is not None:
+        return build_document_result(prepared, cached_response, idx, total), None
+
+    return None, {
+        "route": route,
+        "document": prepared["document"],
+        "file_bytes": prepared["file_bytes"],
+        "method": ("OCR" if processing_method == "OCR API (Standard)" else "Auto"),
+        "split_pages": (
+            split_pages
+            if should_split_pdf(route, prepared["document"], split_pages)
+            else 0
+        ),
+        "image_options": image_options,
+        "progress": progress.bind(file_name=prepared["file_name"]),
+        "prepared": prepared,
+        "cache_key": cache_key,
+    }
+
+
+def finish_async_document(job, ocr_response, idx, total):
+    """
+    Resultado final de un trabajo del motor asíncrono; las respuestas
+    correctas se guardan en la caché.
+    """
+    result = build_document_result(job["prepared"], ocr_response, idx, total)
+    if job["cache_key"] and result["success"]:
+        get_result_cache().put(job["cache_key"], ocr_response)
+    return result
+
+
+def process_documents_async(
+    api_key,
+    sources,
+    source_type,
+    processing_method,
+    optimize_images,
+    direct_api,
+    stage_limits,
+    on_complete=None,
+    use_cache=True,
+    split_pages=0,
+    image_options=None,
+    progress=NO_PROGRESS,
+):
+    """
+    Procesa un lote con el motor asíncrono.
+
+    Los documentos se preparan en el hilo del script y todas las llamadas a la
+    API se ejecutan en un único bucle de eventos con límites por etapa. El
+    avance de cada documento se publica en ``progress``.
+    """
+    total = len(sources)
+    results = [None] * total
+    jobs = []
+    job_indices = []
+    completed = 0
+
+    for idx, source in enumerate(sources):
+        result, job = plan_async_document(
+            source,
+            idx,
+            total,
+            source_type,
+            processing_method,
+            optimize_images,
+            direct_api,
+            use_cache=use_cache,
+            split_pages=split_pages,
+            image_options=image_options,
+            progress=progress,
+        )
+        if result is not None:
+            # Sin llamadas a la API: ya es un resultado final
+            results[idx] = result
+            completed += 1
+            if on_complete:
+                on_complete(completed, idx, result)
+            continue
+
+        jobs.append(job)
+        job_indices.append(idx)
+
+    already_completed = completed
+
+    def on_job_complete(job_completed, job_idx, ocr_response):
+        idx = job_indices[job_idx]
+        results[idx] = finish_async_document(jobs[job_idx], ocr_response, idx, total)
+        if on_complete:
+            on_complete(already_completed + job_completed, idx, results[idx])
+
+    if jobs:
+        run_ocr_batch(api_key, jobs, stage_limits, on_job_complete)
+
+    return results
@@ -0,0 +1,271 @@
+"""
+Utilidades para interpretar las respuestas de la API OCR de Mistral.
+
+No dependen de Streamlit, de modo que pueden usarse desde la aplicación y
+desde los motores de procesamiento en segundo plano.
+"""
+
+import base64
+import binascii
+import itertools
+import json
+import logging
+
+from artifact_store import get_artifact_store
+from ocr_stream import JSONStreamError, OCRResponseStream
+
+logger = logging.getLogger("MistralOCR")
+
+# Tamaño máximo por defecto de una imagen extraída que se guarda en disco
+DEFAULT_MAX_IMAGE_BYTES = 5 * 1024 * 1024
+
+
+def extract_text_from_ocr_response(response):
+    """
+    Extrae texto de diferentes formatos de respuesta OCR.
+    """
+    try:
+        # Caso 1: Si hay páginas con markdown
+        if "pages" in response and isinstance(response["pages"], list):
+            pages = response["pages"]
+            if pages and "markdown" in pages[0]:
+                markdown_text = "\n\n".join(
+                    page.get("markdown", "") for page in pages if "markdown" in page
+                )
+                if markdown_text.strip():
+                    return {"text": markdown_text, "format": "markdown"}
+
+        # Caso 2: Si hay un texto plano en la respuesta
+        if "text" in response:
+            return {"text": response["text"], "format": "text"}
+
+        # Caso 3: Si hay elementos (para formatos más estructurados)
+        if "elements" in response:
+            elements = response["elements"]
+            if isinstance(elements, list):
+                text_parts = []
+                for element in elements:
+                    if "text" in element:
+                        text_parts.append(element["text"])
+                return {"text": "\n".join(text_parts), "format": "elements"}
+
+        # Caso 4: Si hay un campo 'content' principal
+        if "content" in response:
+            return {"text": response["content"], "format": "content"}
+
+        # Caso 5: Si no se encuentra texto en el formato esperado, intentar examinar toda la respuesta
+        response_str = json.dumps(response, indent=2)
+
+        # Si la respuesta es muy grande, devolver un mensaje informativo
+        if len(response_str) > 5000:
+            return {
+                "text": "La respuesta OCR contiene datos pero no en el formato esperado. Revisa los detalles técnicos para más información.",
+                "format": "unknown",
+                "raw_response": response,
+            }
+
+        # Intentar extraer cualquier texto encontrado en la respuesta
+        extracted_text = extract_all_text_fields(response)
+        if extracted_text:
+            return {"text": extracted_text, "format": "extracted"}
+
+        return {
+            "text": "No se pudo encontrar texto en la respuesta OCR. Revisa los detalles técnicos.",
+            "format": "unknown",
+            "raw_response": response,
+        }
+    except Exception as e:
+        logger.error(f"Error al extraer texto de la respuesta OCR: {str(e)}")
+        return {"error": f"Error al procesar la respuesta: {str(e)}"}
+
+
+def extract_all_text_fields(data, prefix=""):
+    """
+    Función recursiva para extraer todos los campos de texto de un diccionario anidado.
+    """
+    result = []
+
+    if isinstance(data, dict):
+        for key, value in data.items():
+            new_prefix = f"{prefix}.{key}" if prefix else key
+
+            if isinstance(value, str) and len(value) > 1:
+                result.append(f"{new_prefix}: {value}")
+            elif isinstance(value, (dict, list)):
+                result.extend(extract_all_text_fields(value, new_prefix))
+
+    elif isinstance(data, list):
+        for i, item in enumerate(data):
+            new_prefix = f"{prefix}[{i}]"
+            if isinstance(item, (dict, list)):
+                result.extend(extract_all_text_fields(item, new_prefix))
+            elif isinstance(item, str) and len(item) > 1:
+                result.append(f"{new_prefix}: {item}")
+
+    return "\n".join(result)
+
+
+def ocr_response_needs_fallback(response_text):
+    """
+    Indica si el cuerpo de una respuesta OCR sugiere recurrir a Document Understanding.
+    """
+    lowered = response_text.lower()
+    return "error" in lowered or "not found" in lowered
+
+
+def spill_page_images(page, position, max_image_bytes=DEFAULT_MAX_IMAGE_BYTES):
+    """
+    Decodifica las imágenes incrustadas de una página OCR y las guarda en el
+    almacén de artefactos.
+
+    Sustituye en cada imagen el campo ``image_base64`` por ``artifact`` (el
+    identificador en disco) y devuelve la lista de referencias
+    ``{"page", "id", "artifact"}``. Las imágenes que superan
+    ``max_image_bytes`` se descartan.
+    """
+    store = get_artifact_store()
+    references = []
+
+    for image in page.get("images") or []:
+        encoded = image.pop("image_base64", None)
+        if not encoded:
+            continue
+
+        header, _, data = encoded.rpartition(",")
+        extension = "jpeg"
+        if header.startswith("data:image/"):
+            extension = header[len("data:image/") :].split(";")[0]
+        elif "." in image.get("id", ""):
+            extension = image["id"].rsplit(".", 1)[1]
+
+        # Descartar sin decodificar las imágenes claramente demasiado grandes
+        if len(data) * 3 // 4 > max_image_bytes:
+            logger.info(f"Imagen {image.get('id')} descartada por tamaño")
+            continue
+        try:
+            image_bytes = base64.b64decode(data)
+        except (binascii.Error, ValueError) as e:
+            logger.warning(f"Imagen {image.get('id')} no válida: {str(e)}")
+            continue
+
+        image["artifact"] = store.put(image_bytes, extension)
+        references.append(
+            {
+                "page": page.get("index", position),
+                "id": image.get("id"),
+                "artifact": image["artifact"],
+            }
+        )
+
+    return references
+
+
+def spill_response_images(response, max_image_bytes=DEFAULT_MAX_IMAGE_BYTES):
+    """
+    Aplica ``spill_page_images`` a todas las páginas de una respuesta ya
+    decodificada y devuelve todas las referencias.
+    """
+    references = []
+    for position, page in enumerate(response.get("pages") or []):
+        references.extend(spill_page_images(page, position, max_image_bytes))
+
+    if references:
+        logger.info(f"{len(references)} imagen(es) extraída(s) guardada(s) en disco")
+    return references
+
+
+def parse_ocr_response_stream(response, image_options=None):
+    """
+    Interpreta una respuesta OCR (``HttpResponse``) recorriendo sus páginas de
+    una en una.
+
+    De cada página solo se conserva el markdown; sus imágenes se guardan en
+    disco si se pidieron con ``image_options`` y se descartan en otro caso,
+    así que la memoria usada es la de una página. Si la respuesta no trae
+    páginas y parece un error, el resultado incluye ``needs_fallback``.
+    """
+    chunks = response.iter_bytes()
+    first = next(chunks, b"")
+    if not first.lstrip().startswith(b"{"):
+        # No es un objeto JSON: el cuerpo es pequeño y se interpreta como antes
+        return parse_ocr_response_text(response.text, image_options)
+
+    max_image_bytes = (image_options or {}).get("max_bytes") or DEFAULT_MAX_IMAGE_BYTES
+    stream = OCRResponseStream(itertools.chain([first], chunks))
+    pages = []
+    images = []
+
+    try:
+        for position, page in enumerate(stream.pages()):
+            if image_options:
+                images.extend(spill_page_images(page, position, max_image_bytes))
+            pages.append(
+                {
+                    "index": page.get("index", position),
+                    "markdown": page.get("markdown", ""),
+                }
+            )
+    except JSONStreamError as e:
+        logger.warning(f"Error al parsear JSON de respuesta OCR: {str(e)}")
+        return {"error": f"Error al parsear respuesta OCR: {str(e)}"}
+
+    if pages:
+        if images:
+            logger.info(f"{len(images)} imagen(es) extraída(s) guardada(s) en disco")
+        return {"pages": pages, "images": images}
+
+    # Sin páginas: el resto del objeto es pequeño y se interpreta como antes
+    fields = stream.fields
+    extraction_result = extract_text_from_ocr_response(fields)
+    if "error" in extraction_result:
+        result = extraction_result
+    elif "text" in extraction_result:
+        result = {"pages": [{"markdown": extraction_result["text"]}]}
+    else:
+        result = dict(fields)
+    result["raw_response"] = fields
+    result["needs_fallback"] = ocr_response_needs_fallback(json.dumps(fields))
+    return result
+
+
+def parse_ocr_response_text(response_text, image_options=None):
+    """
+    Convierte el cuerpo de una respuesta OCR al formato ``{"pages": [...]}``.
+
+    Replica la interpretación de ``process_ocr_with_curl``: JSON con páginas,
+    texto plano corto o un diccionario ``{"error": ...}``. Con
+    ``image_options``, las imágenes incrustadas se guardan en disco y sus
+    referencias se devuelven en ``images``.
+    """
+    try:
+        response_json = json.loads(response_text)
+    except json.JSONDecodeError:
+        logger.warning(
+            f"Error al parsear JSON de respuesta OCR: {response_text[:200]}..."
+        )
+        if not response_text.strip():
+            return {"error": "Respuesta vacía del servidor"}
+
+        # Si la respuesta no es JSON, podría ser texto plano
+        if (
+            len(response_text) < 1000
+            and not response_text.startswith("{")
+            and not response_text.startswith("[")
+        ):
+            return {"pages": [{"markdown": response_text}]}
+
+        return {"error": f"Error al parsear respuesta OCR: {response_text[:200]}..."}
+
+    images = []
+    if image_options and isinstance(response_json, dict):
+        images = spill_response_images(
+            response_json,
+            image_options.get("max_bytes") or DEFAULT_MAX_IMAGE_BYTES,
+        )
+
+    extraction_result = extract_text_from_ocr_response(response_json)
+    if "error" in extraction_result:
+        return extraction_result
+    if "text" in extraction_result:
+        return {"pages": [{"markdown": extraction_result["text"]}], "images": images}
+    return response_json
@@ -0,0 +1,202 @@
+"""
+Lectura incremental de respuestas OCR.
+
+Recorre el array ``pages`` de una respuesta JSON página a página a partir de
+bloques de bytes, de modo que la memoria necesaria es proporcional a una
+página y no al documento completo (que puede incluir imágenes en base64).
+"""
+
+import codecs
+import json
+import re
+
+# Caracteres que terminan un valor escalar fuera de una cadena
+_SCALAR_END = re.compile(r"[,\]\}\s]")
+# Caracteres relevantes dentro de un objeto o array
+_STRUCTURAL = re.compile(r'["\{\}\[\]]')
+
+
+class JSONStreamError(ValueError):
+    """La respuesta no es un JSON válido o está incompleta."""
+
+
+class OCRResponseStream:
+    """
+    Lector incremental de una respuesta ``/v1/ocr``.
+
+    ``pages()`` produce cada página ya decodificada; los demás campos del
+    objeto raíz (``model``, ``usage_info``...) quedan en ``fields``.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self.fields = {}
+
+    def _fill(self):
+        """
+        Añade el siguiente bloque al buffer descartando lo ya consumido.
+
+        Devuelve False al llegar al final del flujo.
+        """
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            self._buffer = self._buffer[self._pos :] + self._decoder.decode(
+                b"", final=True
+            )
+            self._pos = 0
+            return False
+
+        self._buffer = self._buffer[self._pos :] + self._decoder.decode(chunk)
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """
+        Siguiente carácter significativo sin consumirlo ('' al final del flujo).
+        """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, expected):
+        found = self.peek()
+        if not found or found not in expected:
+            raise JSONStreamError(
+                f"Se esperaba {' o '.join(repr(c) for c in expected)} y se encontró {found!r}"
+            )
+        self._pos += 1
+        return found
+
+    def _read_raw_value(self):
+        """
+        Texto del valor JSON que empieza en la posición actual.
+
+        Los bloques leídos se acumulan en una lista y se unen una sola vez, y
+        el estado del escaneo se conserva entre bloques, así que el coste es
+        lineal en el tamaño del valor.
+        """
+        pieces = []
+        depth = 0
+        in_string = False
+        skip_next = False
+        first = self._buffer[self._pos]
+        start = self._pos
+
+        while True:
+            buffer = self._buffer
+            if skip_next and start < len(buffer):
+                # Carácter escapado que quedó al principio del nuevo bloque
+                start += 1
+                skip_next = False
+            end = None
+
+            while start < len(buffer):
+                if in_string:
+                    # str.find es mucho más rápido que una expresión regular
+                    # sobre cadenas largas como las imágenes en base64
+                    quote = buffer.find('"', start)
+                    limit = quote if quote != -1 else len(buffer)
+                    backslash = buffer.find("\\", start, limit)
+                    if backslash != -1:
+                        start = backslash + 1
+                        if start >= len(buffer):
+                            skip_next = True
+                            break
+                        start += 1
+                        continue
+                    if quote == -1:
+                        start = len(buffer)
+                        break
+                    start = quote + 1
+                    in_string = False
+                    if depth == 0:
+                        end = start
+                        break
+                    continue
+
+                if depth == 0 and first not in '"{[':
+                    match = _SCALAR_END.search(buffer, start)
+                    if match is None:
+                        start = len(buffer)
+                        break
+                    end = match.start()
+                    break
+
+                match = _STRUCTURAL.search(buffer, start)
+                if match is None:
+                    start = len(buffer)
+                    break
+                char = match.group()
+                start = match.end()
+                if char == '"':
+                    in_string = True
+                elif char in "{[":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        end = start
+                        break
+
+            if end is not None:
+                pieces.append(buffer[self._pos : end])
+                self._pos = end
+                return "".join(pieces)
+
+            pieces.append(buffer[self._pos :])
+            self._pos = len(buffer)
+            if not self._fill():
+                if depth == 0 and not in_string and first not in '"{[':
+                    return "".join(pieces)
+                raise JSONStreamError("Respuesta JSON incompleta")
+            start = 0
+
+    def _read_value(self):
+        if not self.peek():
+            raise JSONStreamError("Fin inesperado de la respuesta")
+        try:
+            return json.loads(self._read_raw_value())
+        except ValueError as e:
+            raise JSONStreamError(str(e)) from e
+
+    def pages(self):
+        """
+        Genera las páginas del array ``pages`` de una en una.
+        """
+        self._expect("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = self._read_value()
+            if not isinstance(key, str):
+                raise JSONStreamError("Clave de objeto no válida")
+            self._expect(":")
+
+            if key == "pages" and self.peek() == "[":
+                self._pos += 1
+                if self.peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._read_value()
+                        if self._expect(",]") == "]":
+                            break
+            else:
+                self.fields[key] = self._read_value()
+
+            if self._expect(",}") == "}":
+                return
@@ -0,0 +1,122 @@
+"""
+Utilidades para dividir documentos PDF en fragmentos de páginas.
+
+Permiten procesar PDFs grandes como varias solicitudes OCR independientes
+que se ejecutan en paralelo y se reensamblan en orden.
+"""
+
+import io
+import logging
+
+from pypdf import PdfReader, PdfWriter
+
+from image_tools import DEFAULT_THUMBNAIL_EDGE, encode_thumbnail
+from ocr_cache import hash_bytes
+
+try:
+    # Opcional: solo se usa para las miniaturas de la primera página
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+logger = logging.getLogger("MistralOCR")
+
+DEFAULT_PAGES_PER_CHUNK = 20
+
+
+def _open_reader(content):
+    if isinstance(content, str):
+        return PdfReader(content)
+    return PdfReader(io.BytesIO(content))
+
+
+def count_pdf_pages(content):
+    """
+    Devuelve el número de páginas de un PDF (bytes o ruta).
+    """
+    return len(_open_reader(content).pages)
+
+
+def render_pdf_thumbnail(content, max_edge=DEFAULT_THUMBNAIL_EDGE):
+    """
+    Miniatura JPEG de la primera página de un PDF (bytes o ruta en disco), o
+    None si ``pypdfium2`` no está instalado.
+    """
+    if pypdfium2 is None:
+        return None
+    pdf = pypdfium2.PdfDocument(content)
+    try:
+        page = pdf[0]
+        # El tamaño de la página está en puntos (1/72 de pulgada)
+        scale = max_edge / max(page.get_size())
+        return encode_thumbnail(page.render(scale=scale).to_pil(), max_edge)
+    finally:
+        pdf.close()
+
+
+def split_pdf(content, pages_per_chunk=DEFAULT_PAGES_PER_CHUNK):
+    """
+    Divide un PDF en fragmentos de ``pages_per_chunk`` páginas.
+
+    Devuelve una lista de diccionarios con ``start_page`` (índice 0 de la
+    primera página), ``page_count``, ``content`` y ``content_hash``.
+    """
+    reader = _open_reader(content)
+    total_pages = len(reader.pages)
+    chunks = []
+
+    for start_page in range(0, total_pages, pages_per_chunk):
+        end_page = min(start_page + pages_per_chunk, total_pages)
+        writer = PdfWriter()
+        for page_number in range(start_page, end_page):
+            writer.add_page(reader.pages[page_number])
+
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        chunk_bytes = buffer.getvalue()
+        chunks.append(
+            {
+                "start_page": start_page,
+                "page_count": end_page - start_page,
+                "content": chunk_bytes,
+                "content_hash": hash_bytes(chunk_bytes),
+            }
+        )
+
+    logger.info(f"PDF de {total_pages} páginas dividido en {len(chunks)} fragmento(s)")
+    return chunks
+
+
+def describe_chunk(chunk):
+    """
+    Rango de páginas legible (base 1) de un fragmento.
+    """
+    first = chunk["start_page"] + 1
+    last = chunk["start_page"] + chunk["page_count"]
+    return f"{first}-{last}" if last > first else str(first)
+
+
+def merge_chunk_pages(chunks, chunk_responses):
+    """
+    Reensambla en orden las páginas de las respuestas OCR de cada fragmento,
+    ajustando su índice al del documento completo.
+    """
+    pages = []
+    for chunk, response in zip(chunks, chunk_responses):
+        for local_index, page in enumerate(response.get("pages", [])):
+            page = dict(page)
+            page["index"] = chunk["start_page"] + page.get("index", local_index)
+            pages.append(page)
+    return pages
+
+
+def merge_chunk_images(chunks, chunk_responses):
+    """
+    Reúne las referencias de imágenes extraídas de cada fragmento con el
+    número de página del documento completo.
+    """
+    images = []
+    for chunk, response in zip(chunks, chunk_responses):
+        for image in response.get("images") or []:
+            images.append(dict(image, page=chunk["start_page"] + image["page"]))
+    return images
@@ -0,0 +1,172 @@
+"""
+Eventos de progreso del procesamiento OCR.
+
+El pipeline informa de su avance (etapas, bytes subidos y ahorrados,
+reintentos y métodos alternativos) publicando eventos en lugar de llamar a una interfaz.
+Cada frontend (Streamlit, la línea de comandos, los registros o las métricas)
+se suscribe a ellos, de modo que el procesamiento puede ejecutarse en hilos,
+procesos o servicios sin depender de ninguno; el registro de lotes
+(``job_journal``) también los usa para seguir el estado de cada documento.
+
+Los eventos son diccionarios con ``type`` y ``time`` más el contexto con el
+que se creó el emisor (por ejemplo ``document`` y ``file_name``).
+"""
+
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger("MistralOCR")
+
+# Tipos de evento
+STAGE_STARTED = "stage_started"
+STAGE_UPDATED = "stage_updated"
+STAGE_FINISHED = "stage_finished"
+BYTES_UPLOADED = "bytes_uploaded"
+FILE_UPLOADED = "file_uploaded"
+IMAGE_OPTIMIZED = "image_optimized"
+RETRY = "retry"
+FALLBACK = "fallback"
+DEBUG = "debug"
+
+# Estados de una etapa (los mismos que usa ``st.status``)
+STATE_RUNNING = "running"
+STATE_COMPLETE = "complete"
+STATE_ERROR = "error"
+
+_stage_ids = itertools.count(1)
+
+
+class ProgressEvents:
+    """
+    Emisor de eventos de progreso.
+
+    ``bind`` crea un emisor con más contexto que comparte los suscriptores, y
+    ``stage`` abre una etapa cuyo manejador tiene la misma forma que
+    ``st.status``. Sin suscriptores, emitir no cuesta nada.
+    """
+
+    def __init__(self, subscribers=None, **context):
+        self._subscribers = list(subscribers or [])
+        self.context = context
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+        return callback
+
+    def bind(self, **context):
+        events = ProgressEvents(**{**self.context, **context})
+        events._subscribers = self._subscribers
+        return events
+
+    def emit(self, event_type, **fields):
+        if not self._subscribers:
+            return
+        event = {"type": event_type, "time": time.time(), **self.context, **fields}
+        for callback in list(self._subscribers):
+            try:
+                callback(event)
+            except Exception as e:
+                # Un suscriptor defectuoso no debe interrumpir el procesamiento
+                logger.warning(f"Error en un suscriptor de progreso: {str(e)}")
+
+    def stage(self, stage, label):
+        return StageProgress(self, stage, label)
+
+
+NO_PROGRESS = ProgressEvents()
+
+
+class StageProgress:
+    """
+    Etapa en curso. Se usa como gestor de contexto y ``update`` admite los
+    mismos argumentos que el de ``st.status``.
+
+    ``progress`` es un emisor ligado a la etapa, para que las subetapas
+    indiquen de cuál dependen (``parent_stage``).
+    """
+
+    def __init__(self, events, stage, label):
+        self.stage = stage
+        self.stage_id = next(_stage_ids)
+        self.label = label
+        self.state = STATE_RUNNING
+        self._events = events
+        self._started = None
+        self.progress = events.bind(parent_stage=self.stage_id)
+
+    def _emit(self, event_type, **fields):
+        self._events.emit(
+            event_type,
+            stage=self.stage,
+            stage_id=self.stage_id,
+            label=self.label,
+            state=self.state,
+            **fields,
+        )
+
+    def __enter__(self):
+        self._started = time.monotonic()
+        self._emit(STAGE_STARTED)
+        return self
+
+    def update(self, label=None, state=None, **kwargs):
+        if label:
+            self.label = label
+        if state:
+            self.state = state
+        self._emit(STAGE_UPDATED)
+
+    def debug(self, kind, content):
+        """
+        Publica un detalle técnico (solicitud o respuesta) de la etapa.
+        """
+        self._emit(DEBUG, kind=kind, content=content)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.state = STATE_ERROR
+        elif self.state == STATE_RUNNING:
+            self.state = STATE_COMPLETE
+        self._emit(STAGE_FINISHED, elapsed=time.monotonic() - self._started)
+        return False
+
+
+class ProgressTotals:
+    """
+    Suscriptor que acumula métricas del lote: bytes subidos, bytes ahorrados
+    al optimizar imágenes, reintentos, métodos alternativos y etapas
+    terminadas por estado.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._upload_positions = {}
+        self.bytes_uploaded = 0
+        self.bytes_saved = 0
+        self.retries = 0
+        self.fallbacks = 0
+        self.stages = {}
+
+    def __call__(self, event):
+        with self._lock:
+            if event["type"] == BYTES_UPLOADED:
+                # Los eventos llevan el total enviado; un reintento vuelve a
+                # empezar desde cero y sus bytes también se cuentan
+                key = event.get("upload_id")
+                previous = self._upload_positions.pop(key, 0)
+                if event["sent"] < previous:
+                    previous = 0
+                self.bytes_uploaded += event["sent"] - previous
+                if event["sent"] < event["total"]:
+                    self._upload_positions[key] = event["sent"]
+            elif event["type"] == IMAGE_OPTIMIZED:
+                self.bytes_saved += event["original_bytes"] - event["optimized_bytes"]
+            elif event["type"] == RETRY:
+                self.retries += 1
+            elif event["type"] == FALLBACK:
+                self.fallbacks += 1
+            elif event["type"] == STAGE_FINISHED:
+                key = (event["stage"], event["state"])
+                self.stages[key] = self.stages.get(key, 0) + 1
@@ -0,0 +1,184 @@
+"""
+Política de reintentos y limitador de tasa adaptativo para la API de Mistral.
+
+Clasifica los errores como reintentables o no, respeta ``Retry-After`` y usa
+backoff exponencial con jitter. El token bucket ajusta su tasa según el
+throttling observado (aumento aditivo, reducción multiplicativa) para mantener
+el throughput cerca del límite de la cuenta sin sobrepasarlo.
+"""
+
+import email.utils
+import hashlib
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger("MistralOCR")
+
+# Códigos HTTP que indican un fallo transitorio
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def parse_retry_after(headers):
+    """
+    Devuelve los segundos indicados por la cabecera ``Retry-After`` o None.
+
+    Acepta tanto segundos como una fecha HTTP.
+    """
+    if not headers:
+        return None
+
+    value = None
+    for key, header_value in headers.items():
+        if key.lower() == "retry-after":
+            value = str(header_value).strip()
+            break
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """
+    Decide si una respuesta o excepción debe reintentarse y cuánto esperar.
+    """
+
+    def __init__(
+        self, max_attempts=4, base_delay=1.0, max_delay=30.0, max_retry_after=120.0
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def is_retryable_status(self, status_code):
+        return status_code in RETRYABLE_STATUS_CODES
+
+    def is_retryable_exception(self, error, idempotent=True):
+        """
+        Los errores de conexión siempre se reintentan; los timeouts solo en
+        solicitudes idempotentes, para no multiplicar esperas de varios minutos.
+        """
+        # Importación diferida para evitar un ciclo con mistral_client
+        from mistral_client import TransportConnectionError, TransportTimeout
+
+        if isinstance(error, TransportConnectionError):
+            return True
+        if isinstance(error, TransportTimeout):
+            return idempotent
+        return False
+
+    def should_retry(self, attempt):
+        """``attempt`` es el número de intentos ya realizados."""
+        return attempt < self.max_attempts
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Segundos de espera antes del siguiente intento (``attempt`` empieza en 1).
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        # Backoff exponencial con "full jitter"
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+
+class AdaptiveTokenBucket:
+    """
+    Token bucket seguro entre hilos cuya tasa se adapta al throttling.
+
+    Cada 429 reduce la tasa a la mitad; cada respuesta correcta la aumenta un
+    poco, hasta ``max_rate``.
+    """
+
+    def __init__(
+        self, rate=5.0, burst=5, min_rate=0.2, max_rate=20.0, increase_step=0.1
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.throttle_count = 0
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def reserve(self):
+        """
+        Reserva un token y devuelve los segundos que hay que esperar antes de usarlo.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        import asyncio
+
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            self.throttle_count += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Vaciar el bucket para no lanzar otra ráfaga inmediatamente
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._tokens = min(self._tokens, -retry_after * self.rate)
+        logger.warning(
+            f"Throttling detectado: tasa reducida a {self.rate:.2f} solicitudes/s"
+        )
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_key):
+    """
+    Devuelve el token bucket compartido del proceso para una API key.
+
+    Los límites de tasa son por cuenta, así que todas las sesiones que usan la
+    misma clave comparten el mismo bucket. Se indexa por hash para no guardar
+    la clave en claro.
+    """
+    key_hash = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    with _rate_limiters_lock:
+        if key_hash not in _rate_limiters:
+            _rate_limiters[key_hash] = AdaptiveTokenBucket()
+        return _rate_limiters[key_hash]
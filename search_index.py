@@ -0,0 +1,290 @@
+"""
+Índice de búsqueda de texto completo sobre los resultados OCR.
+
+Cada página de los documentos terminados entra en un índice invertido en
+memoria: la cola de lotes añade los resultados a medida que llegan y los
+lotes de ejecuciones anteriores se cargan desde el registro de lotes la
+primera vez que se buscan. Los resultados se ordenan con BM25 y traen el
+número de página y un fragmento con los términos resaltados.
+
+Las búsquedas no distinguen mayúsculas ni acentos: «camion» encuentra
+«Camión».
+"""
+
+import collections
+import heapq
+import itertools
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+
+from job_journal import DOC_DONE
+
+logger = logging.getLogger("MistralOCR")
+
+# Parámetros de BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Resultados que se devuelven por búsqueda
+DEFAULT_MAX_HITS = 20
+# Longitud aproximada de los fragmentos de texto de cada resultado
+SNIPPET_CHARS = 160
+
+_TOKEN_RE = re.compile(r"\w+")
+_MARKDOWN_SPECIAL_RE = re.compile(r"([\\`*_{}\[\]()#+\-.!|<>~$])")
+
+
+class _FoldTable(dict):
+    """
+    Tabla para ``str.translate`` que pasa cada carácter a minúsculas y sin
+    acentos. Cada carácter se sustituye por uno solo, de modo que las
+    posiciones del texto normalizado valen también para el original.
+    """
+
+    def __missing__(self, code):
+        char = chr(code)
+        folded = unicodedata.normalize("NFKD", char.lower())[:1] or char
+        self[code] = folded
+        return folded
+
+
+_FOLD_TABLE = _FoldTable()
+
+
+def fold(text):
+    return text.translate(_FOLD_TABLE)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(fold(text))
+
+
+def escape_markdown(text):
+    return _MARKDOWN_SPECIAL_RE.sub(r"\\\1", text)
+
+
+def _plain(text):
+    # Los saltos de línea y sangrías del Markdown original no caben en un
+    # fragmento de una línea
+    return escape_markdown(re.sub(r"\s+", " ", text))
+
+
+def build_snippet(text, terms, max_chars=SNIPPET_CHARS):
+    """
+    Fragmento en Markdown alrededor de la primera aparición de ``terms`` en
+    ``text``, con los términos en negrita.
+    """
+    pattern = re.compile(
+        r"\b(?:" + "|".join(re.escape(term) for term in terms) + r")\b"
+    )
+    folded = fold(text)
+    first = pattern.search(folded)
+    start = 0
+    if first is not None:
+        start = max(0, first.start() - max_chars // 3)
+        # Empezar y terminar en un límite de palabra
+        while start > 0 and not text[start - 1].isspace():
+            start -= 1
+    end = min(len(text), start + max_chars)
+    while end < len(text) and not text[end].isspace():
+        end += 1
+
+    parts = ["…" if start > 0 else ""]
+    position = start
+    for match in pattern.finditer(folded, start, end):
+        parts.append(_plain(text[position : match.start()]))
+        parts.append(f"**{text[match.start() : match.end()]}**")
+        position = match.end()
+    parts.append(_plain(text[position:end]))
+    parts.append("…" if end < len(text) else "")
+    return "".join(parts).strip()
+
+
+class SearchIndex:
+    """
+    Índice invertido por páginas, seguro entre hilos.
+
+    Los documentos se identifican con ``(job_id, idx)``, como en el registro
+    de lotes; volver a añadir un documento sustituye su versión anterior.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._page_ids = itertools.count()
+        # Término -> {página: apariciones}
+        self._postings = collections.defaultdict(dict)
+        # Página -> (documento, nombre del archivo, número de página, texto, términos)
+        self._pages = {}
+        self._documents = {}
+        self._synced_jobs = set()
+        self._total_terms = 0
+
+    def __len__(self):
+        return len(self._pages)
+
+    def has_document(self, key):
+        with self._lock:
+            return key in self._documents
+
+    def add_document(self, key, file_name, text, page_offsets=None):
+        """
+        Indexa el texto de un documento página a página.
+
+        ``page_offsets`` son los ``[número de página, inicio, fin]`` de cada
+        página dentro de ``text`` (los del resultado de ``process_document``);
+        sin ellos, el documento se indexa como una sola página sin número.
+        """
+        spans = page_offsets or [[None, 0, len(text)]]
+        # Tokenizar fuera del bloqueo: es lo más costoso
+        pages = []
+        for number, start, end in spans:
+            page_text = text[start:end]
+            pages.append((number, page_text, collections.Counter(tokenize(page_text))))
+
+        with self._lock:
+            self._remove(key)
+            page_ids = []
+            for number, page_text, counts in pages:
+                page_id = next(self._page_ids)
+                length = sum(counts.values())
+                for term, count in counts.items():
+                    self._postings[term][page_id] = count
+                self._pages[page_id] = (key, file_name, number, page_text, length)
+                self._total_terms += length
+                page_ids.append(page_id)
+            self._documents[key] = page_ids
+
+    def remove_document(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        for page_id in self._documents.pop(key, []):
+            _, _, _, page_text, length = self._pages.pop(page_id)
+            self._total_terms -= length
+            for term in set(tokenize(page_text)):
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(page_id, None)
+                    if not postings:
+                        del self._postings[term]
+
+    def forget_job(self, job_id):
+        """
+        Saca del índice todos los documentos de un lote descartado o caducado.
+        """
+        with self._lock:
+            for key in [key for key in self._documents if key[0] == job_id]:
+                self._remove(key)
+            self._synced_jobs.discard(job_id)
+
+    def sync_jobs(self, journal, job_ids):
+        """
+        Añade los documentos terminados de ``job_ids`` que aún no estén en
+        el índice leyendo su texto del registro de lotes.
+
+        Cada lote se lee del registro una sola vez: los resultados
+        posteriores los añade la cola a medida que llegan.
+        """
+        for job_id in job_ids:
+            with self._lock:
+                if job_id in self._synced_jobs:
+                    continue
+            store = journal.store(job_id)
+            added = 0
+            for document in journal.documents(job_id):
+                key = (job_id, document["idx"])
+                if document["state"] != DOC_DONE or self.has_document(key):
+                    continue
+                text = store.read_text(document["result_handle"])
+                if text is not None:
+                    self.add_document(
+                        key, document["file_name"], text, document["page_offsets"]
+                    )
+                    added += 1
+            with self._lock:
+                self._synced_jobs.add(job_id)
+            if added:
+                logger.info(f"{added} documento(s) del lote {job_id} indexados")
+
+    def search(self, query, job_ids=None, max_hits=DEFAULT_MAX_HITS):
+        """
+        Busca ``query`` y devuelve ``(hits, total)``: las ``max_hits``
+        páginas mejor puntuadas con BM25 y el número de páginas que contienen
+        algún término.
+
+        Cada resultado es ``{"key", "file_name", "page", "score",
+        "snippet"}``. Con ``job_ids`` solo se buscan esos lotes.
+        """
+        start = time.perf_counter()
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return [], 0
+        allowed = set(job_ids) if job_ids is not None else None
+
+        with self._lock:
+            page_count = len(self._pages)
+            if not page_count:
+                return [], 0
+            average_length = self._total_terms / page_count or 1
+            scores = collections.defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(
+                    1 + (page_count - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for page_id, count in postings.items():
+                    length = self._pages[page_id][4]
+                    scores[page_id] += (
+                        idf
+                        * count
+                        * (BM25_K1 + 1)
+                        / (
+                            count
+                            + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                        )
+                    )
+            if allowed is not None:
+                scores = {
+                    page_id: score
+                    for page_id, score in scores.items()
+                    if self._pages[page_id][0][0] in allowed
+                }
+            best = heapq.nlargest(max_hits, scores.items(), key=lambda item: item[1])
+            matches = [(self._pages[page_id], score) for page_id, score in best]
+
+        hits = [
+            {
+                "key": key,
+                "file_name": file_name,
+                "page": number,
+                "score": score,
+                "snippet": build_snippet(page_text, terms),
+            }
+            for (key, file_name, number, page_text, _), score in matches
+        ]
+        logger.debug(
+            f"Búsqueda «{query}»: {len(scores)} página(s) en {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
+        return hits, len(scores)
+
+
+_search_index = None
+_search_index_lock = threading.Lock()
+
+
+def get_search_index():
+    """
+    Devuelve el índice de búsqueda compartido por todas las sesiones del
+    proceso.
+    """
+    global _search_index
+    with _search_index_lock:
+        if _search_index is None:
+            _search_index = SearchIndex()
+        return _search_index